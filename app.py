@@ -2,7 +2,7 @@ import gradio as gr
 import os
 from pathlib import Path
 from config import Config
-from pdf_processor import PDFProcessor
+from pdf_processor import PDFProcessor, shared_page_ratio
 from openai_handler import OpenAIHandler
 from rag_manager import RAGManager
 from handbook_generator import HandbookGenerator
@@ -44,12 +44,79 @@ def process_pdf_upload(file):
         
         status_msg = f"📄 Processing: {file_name}...\n"
         
-        result = pdf_processor.process_pdf(file_path)
+        content_hash = pdf_processor.content_hash(file_path)
         
-        status_msg += f"✅ Extracted {result['total_words']} words from {result['total_chunks']} chunks\n"
-        status_msg += f"📥 Adding to knowledge base...\n"
+        if rag_manager.has_document(content_hash):
+            status_msg += f"♻️ {file_name} is already in the knowledge base, skipping\n"
+            status_msg += f"📚 Total documents in system: {rag_manager.get_document_count()}"
+            files_list = "\n".join([f"• {f}" for f in uploaded_files])
+            return status_msg, files_list
         
-        rag_manager.add_document(result['full_text'], metadata={'filename': file_name})
+        if pdf_processor.is_cached(file_path):
+            status_msg += f"⚡ Using cached extraction\n"
+        
+        previous = rag_manager.find_document(filename=file_name)
+        if previous is None:
+            previous = rag_manager.find_document(title=pdf_processor.get_metadata(file_path).get('title'))
+        previous_pages = rag_manager.document_pages(previous) if previous is not None else None
+        document_info = {}
+        
+        if previous_pages is not None:
+            # A name or title match alone (titles are often generic) is not
+            # enough: the upload must also keep enough of the pages
+            page_hashes = pdf_processor.page_fingerprints(file_path)
+            shared = shared_page_ratio(previous_pages['hashes'], page_hashes)
+            if shared < Config.REVISION_MIN_SHARED_PAGES:
+                previous_name = rag_manager.chunks.metadata[previous].get('filename', '')
+                status_msg += f"ℹ️ Matches {previous_name} by name or title but shares only {shared:.0%} of its pages; adding it as a new document\n"
+                previous_pages = None
+        
+        if previous_pages is not None:
+            # A new revision of a document already in the knowledge base:
+            # only changed pages are extracted and only their chunks replaced
+            previous_name = rag_manager.chunks.metadata[previous].get('filename', file_name)
+            pages = list(pdf_processor.iter_revised_pages(file_path, previous_pages, document_info, page_hashes))
+            report = rag_manager.replace_document(
+                previous,
+                pages,
+                document_info['page_hashes'],
+                metadata={'filename': file_name, 'content_hash': content_hash, 'title': document_info.get('title', '')},
+                chunk_size=pdf_processor.chunk_size,
+                chunk_overlap=pdf_processor.chunk_overlap,
+                boilerplate_lines=document_info.get('boilerplate_lines')
+            )
+            
+            status_msg += f"🔁 New revision of {previous_name}: {len(document_info['changed_pages'])} of {len(pages)} pages changed\n"
+            status_msg += f"✅ Kept {report['chunks_kept']} chunks, replaced {report['chunks_removed']} with {report['chunks_added']}\n"
+        else:
+            # Stream chunks straight into the knowledge base so the whole
+            # document is never held in memory at once
+            stats = {'total_units': 0}
+            
+            def tracked_chunks():
+                for chunk in pdf_processor.iter_chunks(file_path, document_info):
+                    stats['total_units'] = chunk['end_index']
+                    yield chunk
+            
+            total_chunks = rag_manager.add_document(
+                chunks=tracked_chunks(),
+                metadata={'filename': file_name, 'content_hash': content_hash},
+                document_info=document_info
+            )
+            
+            status_msg += f"✅ Extracted {stats['total_units']} {pdf_processor.chunk_unit} from {total_chunks} chunks\n"
+        if document_info.get('boilerplate_words'):
+            status_msg += (
+                f"🧹 Removed {document_info['boilerplate_words']} words of repeated headers/footers "
+                f"({document_info['boilerplate_share']:.0%} of the text)\n"
+            )
+        if document_info.get('timed_out_pages'):
+            status_msg += f"⏱️ Pages over the time limit, re-extracted with the fast extractor: {document_info['timed_out_pages']}\n"
+        if document_info.get('crashed_pages'):
+            status_msg += f"💥 Pages that crashed the extractor, re-extracted with the fast extractor: {document_info['crashed_pages']}\n"
+        if document_info.get('skipped_pages'):
+            status_msg += f"⚠️ Pages skipped: {document_info['skipped_pages']}\n"
+        status_msg += f"📥 Added to knowledge base\n"
         
         uploaded_files.append(file_name)
         
@@ -125,7 +192,7 @@ def chat(message, history):
         
         else:
             print(f"💬 Q&A mode - retrieving context...")
-            context = rag_manager.get_context_for_query(message)
+            context = rag_manager.get_context_for_query(message, max_tokens=Config.CONTEXT_MAX_TOKENS)
             print(f"📄 Retrieved context length: {len(context)} chars")
             
             print(f"🤖 Calling OpenAI API...")
@@ -0,0 +1,140 @@
+"""
+Recall, query throughput and memory of approximate vector search against
+exact search, on synthetic clustered embeddings.
+
+Usage:
+    python benchmark_ann.py
+    python benchmark_ann.py --vectors 1000000 --dimensions 1536 --nprobe 8 16 32 64
+    python benchmark_ann.py --quantization none int8 pq --rerank 100 --output ann.json
+
+Vectors are drawn around random topic directions, which gives them the
+cluster structure of real embeddings, and written to a VectorIndex file.
+Queries are drawn the same way. For every --quantization, a full scan and
+IVFIndex search at every nprobe are compared with the exact float32 top
+10 (recall@10) and timed one query at a time, as RAGManager runs them.
+Memory is what a scan reads: the codes, per million chunks.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+from itertools import islice
+import numpy as np
+from ivf_index import IVFIndex
+from vector_index import QUANTIZATIONS, VectorIndex
+
+TOP_K = 10
+# Rows generated at a time
+GENERATE_BLOCK = 65536
+
+
+def clustered_vectors(rng: np.random.Generator, topics: np.ndarray, count: int, noise: float) -> np.ndarray:
+    """Unit vectors scattered around randomly chosen topic directions."""
+    vectors = topics[rng.integers(len(topics), size=count)]
+    # noise is the length of the offset from the topic, relative to it
+    vectors = vectors + rng.standard_normal(vectors.shape, dtype=np.float32) * (noise / np.sqrt(vectors.shape[1]))
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def build_vectors(path: str, args) -> VectorIndex:
+    rng = np.random.default_rng(args.seed)
+    topics = rng.standard_normal((args.topics, args.dimensions), dtype=np.float32)
+    topics /= np.linalg.norm(topics, axis=1, keepdims=True)
+    
+    vectors = VectorIndex(path, args.dimensions, quantization='none')
+    for start in range(0, args.vectors, GENERATE_BLOCK):
+        vectors.append(clustered_vectors(rng, topics, min(GENERATE_BLOCK, args.vectors - start), args.noise))
+    vectors.flush()
+    vectors.queries = clustered_vectors(rng, topics, args.queries, args.noise)
+    return vectors
+
+
+def time_queries(rank, queries: np.ndarray) -> tuple:
+    """Top results of every query, and queries per second."""
+    started = time.perf_counter()
+    results = [list(islice(rank(query), TOP_K)) for query in queries]
+    return results, len(queries) / (time.perf_counter() - started)
+
+
+def recall(results: list, exact: list) -> float:
+    return sum(len(set(found) & set(truth)) for found, truth in zip(results, exact)) / (TOP_K * len(exact))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@10, QPS and memory of IVF and quantized search")
+    parser.add_argument('--vectors', type=int, default=200000)
+    parser.add_argument('--dimensions', type=int, default=384)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--topics', type=int, default=2000, help="cluster centres the vectors are drawn around")
+    parser.add_argument('--noise', type=float, default=1.0, help="spread around each topic, relative to it")
+    parser.add_argument('--nlist', type=int, default=0, help="IVF lists; 0 = about sqrt(vectors)")
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[4, 8, 16, 32, 64])
+    parser.add_argument('--quantization', nargs='+', choices=QUANTIZATIONS, default=list(QUANTIZATIONS))
+    parser.add_argument('--rerank', type=int, default=None, help="candidates re-scored on float vectors")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="where to write the results as JSON")
+    args = parser.parse_args()
+    
+    folder = tempfile.mkdtemp(prefix='benchmark_ann_')
+    try:
+        print(f"Generating {args.vectors} vectors of {args.dimensions} dimensions...")
+        path = os.path.join(folder, 'vectors.npy')
+        vectors = build_vectors(path, args)
+        queries = vectors.queries
+        
+        ann = IVFIndex(os.path.join(folder, 'vectors.ivf.npz'), nlist=args.nlist, min_vectors=0)
+        started = time.perf_counter()
+        ann.update(vectors.matrix, len(vectors), 'benchmark')
+        build_seconds = time.perf_counter() - started
+        print(f"IVF index of {len(ann.centroids)} lists built in {build_seconds:.1f}s")
+        
+        exact, exact_qps = time_queries(vectors.rank, queries)
+        results = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': f"{platform.system()} {platform.machine()} ({os.cpu_count()} CPUs)",
+            'settings': {key: value for key, value in vars(args).items() if key != 'output'},
+            'nlist': len(ann.centroids),
+            'build_seconds': build_seconds,
+            'exact_qps': exact_qps,
+            'quantization': {},
+        }
+        print(f"\n{'codes':>6} {'search':>10} {'MB/1M':>8} {'recall@10':>10} {'QPS':>10} {'speedup':>8}")
+        
+        for quantization in args.quantization:
+            index = VectorIndex(path, args.dimensions, quantization=quantization, rerank=args.rerank)
+            started = time.perf_counter()
+            index.open(len(vectors))
+            encode_seconds = time.perf_counter() - started
+            megabytes = index.bytes_per_vector * 1e6 / 2 ** 20
+            searches = {'scan': index.rank}
+            for nprobe in args.nprobe:
+                searches[f"nprobe {nprobe}"] = lambda query, nprobe=nprobe: ann.rank(index, query, nprobe=nprobe)
+            
+            results['quantization'][quantization] = {
+                'bytes_per_vector': index.bytes_per_vector,
+                'mb_per_million': megabytes,
+                'encode_seconds': encode_seconds,
+                'searches': {},
+            }
+            for name, rank in searches.items():
+                found, qps = time_queries(rank, queries)
+                results['quantization'][quantization]['searches'][name] = {'recall_at_10': recall(found, exact), 'qps': qps}
+                print(
+                    f"{quantization:>6} {name:>10} {megabytes:>8.0f} {recall(found, exact):>10.3f} "
+                    f"{qps:>10.1f} {qps / exact_qps:>7.1f}x"
+                )
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Measure PDF extraction throughput.
+
+Usage:
+    python benchmark_extraction.py workers path/to/manual.pdf --workers 1 2 4 8
+    python benchmark_extraction.py strategies path/to/corpus/
+"""
+import argparse
+import glob
+import os
+import time
+from page_extractors import STRATEGIES, PageExtractor
+from pdf_processor import PDFProcessor, _count_pages, shutdown_extraction_pool
+
+
+def benchmark(pdf_path: str, workers: int, repeat: int) -> dict:
+    # No page time limit, which would bypass the pool (see PDFProcessor.iter_raw_pages)
+    processor = PDFProcessor(workers=workers, use_cache=False, page_timeout=0)
+    num_pages = _count_pages(pdf_path)
+    
+    # Untimed run so the pool is warm, as it is between uploads in the app
+    reference = processor.extract_text_from_pdf(pdf_path)
+    
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        text = processor.extract_text_from_pdf(pdf_path)
+        timings.append(time.perf_counter() - start)
+        assert text == reference, "extraction output changed between runs"
+    
+    best = min(timings)
+    return {
+        'workers': workers,
+        'pages': num_pages,
+        'wall_clock': best,
+        'pages_per_sec': num_pages / best if best else 0.0,
+        'text': reference,
+    }
+
+
+def run_workers(args):
+    results = []
+    for workers in args.workers:
+        results.append(benchmark(args.pdf_path, workers, args.repeat))
+        shutdown_extraction_pool()
+    
+    baseline = results[0]
+    print(f"{'workers':>8} {'pages':>6} {'wall (s)':>10} {'pages/s':>10} {'speedup':>8} {'same text':>10}")
+    for result in results:
+        speedup = baseline['wall_clock'] / result['wall_clock'] if result['wall_clock'] else 0.0
+        print(
+            f"{result['workers']:>8} {result['pages']:>6} {result['wall_clock']:>10.2f} "
+            f"{result['pages_per_sec']:>10.1f} {speedup:>7.2f}x {str(result['text'] == baseline['text']):>10}"
+        )
+
+
+def extract_corpus(pdf_paths, strategy: str) -> dict:
+    """Clean text of every page of every PDF, plus timing and backend counts."""
+    cleaner = PDFProcessor(use_cache=False)
+    pages = {}
+    stats = {}
+    
+    start = time.perf_counter()
+    for pdf_path in pdf_paths:
+        with PageExtractor(pdf_path, strategy) as extractor:
+            for page_no in range(extractor.num_pages):
+                pages[(pdf_path, page_no)] = cleaner._clean_text(extractor.extract(page_no))
+            for backend, count in extractor.stats.items():
+                stats[backend] = stats.get(backend, 0) + count
+    elapsed = time.perf_counter() - start
+    
+    return {'pages': pages, 'stats': stats, 'wall_clock': elapsed}
+
+
+def run_strategies(args):
+    pdf_paths = sorted(glob.glob(os.path.join(args.corpus, '**', '*.pdf'), recursive=True))
+    if not pdf_paths:
+        raise SystemExit(f"No PDFs found under {args.corpus}")
+    
+    results = {strategy: extract_corpus(pdf_paths, strategy) for strategy in args.strategies}
+    reference = results.get('pdfplumber') or extract_corpus(pdf_paths, 'pdfplumber')
+    
+    print(f"{len(pdf_paths)} files, {len(reference['pages'])} pages; equality is against pdfplumber output")
+    print(
+        f"{'strategy':>10} {'wall (s)':>10} {'pages/s':>10} {'equal':>8} {'equal*':>8}  backends"
+    )
+    for strategy, result in results.items():
+        pages = result['pages']
+        equal = sum(1 for key, text in pages.items() if text == reference['pages'][key])
+        # Same characters once whitespace is ignored: layout differences only
+        loose = sum(
+            1 for key, text in pages.items()
+            if ''.join(text.split()) == ''.join(reference['pages'][key].split())
+        )
+        backends = ', '.join(f"{name}={count}" for name, count in result['stats'].items() if count)
+        print(
+            f"{strategy:>10} {result['wall_clock']:>10.2f} {len(pages) / result['wall_clock']:>10.1f} "
+            f"{equal / len(pages):>8.1%} {loose / len(pages):>8.1%}  {backends}"
+        )
+    print("equal* ignores whitespace")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PDF extraction")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    workers_parser = subparsers.add_parser('workers', help="throughput per worker count for one PDF")
+    workers_parser.add_argument('pdf_path')
+    workers_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    workers_parser.add_argument('--repeat', type=int, default=3)
+    workers_parser.set_defaults(run=run_workers)
+    
+    strategies_parser = subparsers.add_parser('strategies', help="throughput and text equality per strategy")
+    strategies_parser.add_argument('corpus', help="directory of PDFs")
+    strategies_parser.add_argument('--strategies', nargs='+', choices=STRATEGIES, default=list(STRATEGIES))
+    strategies_parser.set_defaults(run=run_strategies)
+    
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Ingestion throughput suite on a deterministic synthetic corpus.
+
+Usage:
+    python benchmark_ingestion.py --save-baseline ingestion_baseline.json
+    python benchmark_ingestion.py --baseline ingestion_baseline.json --threshold 0.2
+    python benchmark_ingestion.py --scale 0.25 --repeat 2 --output quick.json
+
+Each ingestion stage is timed on its own for every document of the corpus:
+PDFProcessor.extract_text_from_pdf (uncached extraction and cleaning),
+_clean_text over the raw pages, chunk_text over the document text and
+RAGManager.add_document into an empty store. The best of --repeat rounds
+is kept. Against a baseline, a stage more than --threshold slower fails
+the run with exit status 1.
+"""
+import argparse
+import contextlib
+import gc
+import hashlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+from config import Config
+from page_extractors import STRATEGIES
+from pdf_processor import PDFProcessor, shutdown_extraction_pool
+from rag_manager import RAGManager
+from synthetic_pdf import iter_cjk_pages, iter_synthetic_pages, write_pdf
+
+# name: (pages at scale 1, page generator, write_pdf options)
+CORPUS = {
+    'text_heavy': (40, lambda n: iter_synthetic_pages(n, lines_per_page=60, seed=1), {}),
+    'multi_column': (
+        40, lambda n: iter_synthetic_pages(n, lines_per_page=90, seed=2, words_per_line=(4, 6)), {'columns': 2}
+    ),
+    'cjk': (40, lambda n: iter_cjk_pages(n, seed=3), {'cjk': True}),
+    'large': (400, lambda n: iter_synthetic_pages(n, seed=4), {}),
+}
+
+# stage: unit of its throughput
+STAGES = {
+    'extract_text_from_pdf': 'pages',
+    '_clean_text': 'MB',
+    'chunk_text': 'MB',
+    'add_document': 'chunks',
+}
+
+# Stages faster than this are too noisy to fail a run on
+MIN_COMPARED_SECONDS = 0.01
+
+
+def corpus_pdf_path(name: str, num_pages: int) -> str:
+    """Path of a corpus document, generated on first use."""
+    folder = os.path.join(Config.CACHE_FOLDER, 'benchmark')
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{name}_{num_pages}.pdf")
+    
+    if not os.path.exists(path):
+        _, pages, options = CORPUS[name]
+        print(f"Generating {path}...")
+        tmp_path = path + '.tmp'
+        write_pdf(tmp_path, pages(num_pages), **options)
+        os.replace(tmp_path, path)
+    
+    return path
+
+
+def file_sha1(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def time_stage(func, repeat: int) -> float:
+    """
+    Best seconds per call of func. Fast calls are looped until a round
+    takes at least 0.2s; the calibration doubles as a warm-up.
+    """
+    timer = timeit.Timer(func, setup='gc.enable()', globals={'gc': gc})
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+def benchmark_document(processor: PDFProcessor, name: str, num_pages: int, repeat: int) -> dict:
+    pdf_path = corpus_pdf_path(name, num_pages)
+    raw_pages = list(processor.iter_raw_pages(pdf_path))
+    text = processor.extract_text_from_pdf(pdf_path)
+    chunks = processor.chunk_text(text)
+    text_mb = len(text.encode('utf-8')) / 1e6
+    raw_mb = sum(len(page.encode('utf-8')) for page in raw_pages) / 1e6
+    
+    store_dir = tempfile.mkdtemp(prefix='benchmark_store_')
+    
+    def add_document():
+        shutil.rmtree(store_dir, ignore_errors=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            RAGManager(store_dir).add_document(text, {'filename': f"{name}.pdf"})
+    
+    try:
+        seconds = {
+            'extract_text_from_pdf': time_stage(lambda: processor.extract_text_from_pdf(pdf_path), repeat),
+            '_clean_text': time_stage(lambda: [processor._clean_text(page) for page in raw_pages], repeat),
+            'chunk_text': time_stage(lambda: processor.chunk_text(text), repeat),
+            'add_document': time_stage(add_document, repeat),
+        }
+    finally:
+        shutil.rmtree(store_dir, ignore_errors=True)
+    
+    stage_amounts = {
+        'extract_text_from_pdf': num_pages,
+        '_clean_text': raw_mb,
+        'chunk_text': text_mb,
+        'add_document': len(chunks),
+    }
+    return {
+        'pages': num_pages,
+        'sha1': file_sha1(pdf_path),
+        'chars': len(text),
+        'chunks': len(chunks),
+        'stages': {
+            stage: {
+                'seconds': seconds[stage],
+                'per_sec': stage_amounts[stage] / seconds[stage] if seconds[stage] else 0.0,
+            }
+            for stage in STAGES
+        },
+    }
+
+
+def settings(args, processor: PDFProcessor) -> dict:
+    """What a result depends on besides the machine and the code."""
+    return {
+        'scale': args.scale,
+        'strategy': processor.strategy,
+        'workers': processor.workers,
+        'chunk_unit': processor.chunk_unit,
+        'chunk_size': processor.chunk_size,
+        'chunk_overlap': processor.chunk_overlap,
+        'strip_boilerplate': processor.strip_boilerplate,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Print current timings against the baseline; return the regressions."""
+    if results['settings'] != baseline.get('settings'):
+        raise SystemExit(
+            f"Baseline settings {baseline.get('settings')} differ from this run's {results['settings']}"
+        )
+    
+    regressions = []
+    print(f"\n{'document':>14} {'stage':>22} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, document in results['documents'].items():
+        previous = baseline['documents'].get(name)
+        if previous is None:
+            print(f"{name:>14}  not in baseline")
+            continue
+        if previous['sha1'] != document['sha1']:
+            print(f"{name:>14}  corpus file changed; timings are not comparable")
+            continue
+        if (previous['chars'], previous['chunks']) != (document['chars'], document['chunks']):
+            print(f"{name:>14}  output changed: {previous['chars']} -> {document['chars']} chars, "
+                  f"{previous['chunks']} -> {document['chunks']} chunks")
+        
+        for stage, timing in document['stages'].items():
+            before = previous['stages'][stage]['seconds']
+            after = timing['seconds']
+            change = after / before - 1 if before else 0.0
+            regressed = change > threshold and max(before, after) >= MIN_COMPARED_SECONDS
+            if regressed:
+                regressions.append(f"{name} {stage}: {before:.4f}s -> {after:.4f}s ({change:+.0%})")
+            print(
+                f"{name:>14} {stage:>22} {before:>10.4f} {after:>10.4f} {change:>+8.0%}"
+                f"{'  REGRESSION' if regressed else ''}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time each ingestion stage on a synthetic PDF corpus")
+    parser.add_argument('--documents', nargs='+', choices=list(CORPUS), default=list(CORPUS))
+    parser.add_argument('--scale', type=float, default=1.0, help="multiplier for every document's page count")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--strategy', choices=STRATEGIES, default=None)
+    parser.add_argument('--output', default='benchmark_ingestion.json', help="where to write the results")
+    parser.add_argument('--baseline', help="results file to compare against")
+    parser.add_argument('--save-baseline', metavar='PATH', help="also write the results here as the new baseline")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed slowdown per stage, e.g. 0.2 = 20%%")
+    args = parser.parse_args()
+    
+    processor = PDFProcessor(use_cache=False, workers=args.workers, strategy=args.strategy)
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': f"{platform.system()} {platform.machine()} ({os.cpu_count()} CPUs)",
+        'settings': settings(args, processor),
+        'documents': {},
+    }
+    
+    print(f"{'document':>14} {'pages':>6} " + ' '.join(f"{stage:>22}" for stage in STAGES))
+    try:
+        for name in args.documents:
+            num_pages = max(1, round(CORPUS[name][0] * args.scale))
+            document = benchmark_document(processor, name, num_pages, args.repeat)
+            results['documents'][name] = document
+            cells = [
+                f"{document['stages'][stage]['per_sec']:>11.1f} {unit + '/s':>10}"
+                for stage, unit in STAGES.items()
+            ]
+            print(f"{name:>14} {num_pages:>6} " + ' '.join(cells))
+    finally:
+        shutdown_extraction_pool()
+    
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {path}")
+    
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} stage(s) slower than the baseline by more than {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"\nNo stage slower than the baseline by more than {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
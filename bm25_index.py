@@ -0,0 +1,437 @@
+import heapq
+import math
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from itertools import count, groupby, repeat
+from operator import itemgetter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from mapped_file import ALIGNMENT, MappedFile, SectionWriter
+from ranking import iter_ranked
+from text_segmentation import CJK_CHARACTERS
+
+# Index terms: runs of letters and digits, or single CJK characters.
+# Punctuation is dropped so "policy." and "policy" are the same term.
+TERM_PATTERN = re.compile(f'[{CJK_CHARACTERS}]|[^\\W_{CJK_CHARACTERS}]+')
+
+INDEX_FORMAT = 2
+MAX_TERM_FREQUENCY = 65535
+# A term found in more than this share of the chunks keeps a dense array of
+# its frequency in every chunk instead of a postings list: it is no larger
+# (2 bytes per chunk instead of 6 per posting) and is scored without any
+# scatter or gather. Only for at least DENSE_MIN_CHUNKS chunks.
+DENSE_RATIO = 1 / 3
+DENSE_MIN_CHUNKS = 10000
+# BM25Index.rank_many() scores a query over its postings alone when they
+# are at most this share of the chunks; past it, a sort of the postings
+# costs more than a pass over a score per chunk
+SPARSE_SCORING_RATIO = 1 / 32
+
+# Term directory of a segment file, sorted by term
+TERM_RECORD = np.dtype([
+    ('term_offset', '<u8'),
+    ('data_offset', '<u8'),  # in the postings section
+    ('term_bytes', '<u4'),
+    ('count', '<u4'),  # chunks containing the term
+    ('dense', 'u1'),
+])
+
+
+def terms(text: str) -> List[str]:
+    return TERM_PATTERN.findall(text.lower())
+
+
+class PostingsSegment:
+    """
+    The postings of a run of chunks, read from a segment file (see
+    BM25Index.write_segment) through mmap. Terms are found by binary search
+    in the sorted term directory, so opening a segment reads nothing but
+    its footer, and a query only the postings of its own terms.
+    """
+    
+    def __init__(self, path: str):
+        self.file = MappedFile(path, 'bm25', INDEX_FORMAT)
+        self.path = path
+        self.first_chunk = self.file.fields['first_chunk']
+        self.total_length = self.file.fields['total_length']
+        self.lengths = self.file.array('lengths')
+        self.directory = self.file.array('directory')
+        self._keys = _TermKeys(self)
+    
+    @property
+    def chunk_count(self) -> int:
+        return len(self.lengths)
+    
+    def term_key(self, entry: int) -> bytes:
+        """UTF-8 term of a directory entry."""
+        record = self.directory[entry]
+        offset = int(record['term_offset'])
+        return self.file.bytes('terms', offset, offset + int(record['term_bytes']))
+    
+    def find(self, term: str) -> Optional[int]:
+        """Directory entry of a term, if it occurs in the segment."""
+        key = term.encode('utf-8')
+        entry = bisect_left(self._keys, key)
+        return entry if entry < len(self.directory) and self.term_key(entry) == key else None
+    
+    def terms(self) -> List[str]:
+        """Every term, in directory order."""
+        data = self.file.bytes('terms', 0, self.file.sections['terms'][1])
+        return data.decode('utf-8').split('\n') if data else []
+    
+    def part(self, entry: int) -> Tuple[Optional[int], Optional[np.ndarray], np.ndarray, int]:
+        """The postings of a directory entry, as described in BM25Index._term_parts()."""
+        record = self.directory[entry]
+        offset, df = int(record['data_offset']), int(record['count'])
+        if record['dense']:
+            return self.first_chunk, None, self.file.array('postings', offset, self.chunk_count, np.uint16), df
+        
+        indices = self.file.array('postings', offset, df, np.uint32)
+        frequencies = self.file.array('postings', _aligned(offset + 4 * df), df, np.uint16)
+        return None, indices, frequencies, df
+
+
+class _TermKeys:
+    """The directory of a segment as a sequence of UTF-8 terms, for bisect."""
+    
+    def __init__(self, segment: PostingsSegment):
+        self.segment = segment
+    
+    def __len__(self) -> int:
+        return len(self.segment.directory)
+    
+    def __getitem__(self, entry: int) -> bytes:
+        return self.segment.term_key(entry)
+
+
+class BM25Index:
+    """
+    Inverted index over chunk texts with Okapi BM25 scoring.
+    
+    Chunks are numbered like ChunkTable chunks. Every term has a postings
+    list of the chunks containing it and how often, so a query only reads
+    the postings of its own terms and scores each term in one vectorized
+    step: rare terms cost next to nothing however large the corpus is.
+    Very common terms are stored densely (see DENSE_RATIO).
+    
+    Saved chunks are read from memory-mapped segment files (see
+    PostingsSegment). Chunks added since are indexed in growable arrays,
+    so adding chunks never touches existing postings. Removed chunks stay
+    in the postings but are never returned; they are left out when their
+    segment is next rewritten.
+    """
+    
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.segments: List[PostingsSegment] = []
+        self.base = 0  # chunks in the segments
+        self._segment_chunks: List[int] = []  # first chunk of each segment
+        # Chunks added since the segments were written
+        self.postings: Dict[str, Tuple[array, array]] = {}  # term: (chunk indices, term frequencies)
+        self.dense: Dict[str, array] = {}  # term: frequency in every chunk
+        self.dense_df: Dict[str, int] = {}  # term: chunks containing it, for dense terms
+        self.lengths = array('I')  # terms per chunk
+        
+        self.removed = array('B')  # 1 for removed chunks, over all chunks
+        self.removed_count = 0
+        self.total_length = 0  # terms in live chunks
+        self._norms = None  # per-chunk length normalization, rebuilt after changes
+    
+    @property
+    def chunk_count(self) -> int:
+        """Number of chunks, removed ones included."""
+        return self.base + len(self.lengths)
+    
+    def __len__(self) -> int:
+        """Number of live chunks."""
+        return self.chunk_count - self.removed_count
+    
+    def add(self, texts: Iterable[str]):
+        """Index the next chunks, in chunk order."""
+        for text in texts:
+            index = self.chunk_count
+            local = len(self.lengths)
+            counts = Counter(terms(text))
+            length = sum(counts.values())
+            dense_limit = DENSE_RATIO * local if local >= DENSE_MIN_CHUNKS else None
+            
+            for term, frequencies in self.dense.items():
+                count = counts.pop(term, 0)
+                frequencies.append(min(count, MAX_TERM_FREQUENCY))
+                if count:
+                    self.dense_df[term] += 1
+            
+            for term, count in counts.items():
+                entry = self.postings.get(term)
+                if entry is None:
+                    entry = self.postings[term] = (array('I'), array('H'))
+                entry[0].append(index)
+                entry[1].append(min(count, MAX_TERM_FREQUENCY))
+                if dense_limit is not None and len(entry[0]) > dense_limit:
+                    self._make_dense(term, local + 1)
+            
+            self.lengths.append(length)
+            self.removed.append(0)
+            self.total_length += length
+        self._norms = None
+    
+    def remove(self, indices: Iterable[int]):
+        for index in indices:
+            if not self.removed[index]:
+                self.removed[index] = 1
+                self.removed_count += 1
+                self.total_length -= self._length(index)
+        self._norms = None
+    
+    def clear(self):
+        self.__init__(self.k1, self.b)
+    
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every chunk for the query; 0 where no query term occurs."""
+        query_terms = set(terms(query))
+        return self._scores(query_terms, self._term_weights(query_terms))
+    
+    def rank(self, query: str) -> Iterator[int]:
+        """
+        Indices of the chunks matching the query, best first (ties in chunk
+        order), selected lazily (see iter_ranked).
+        """
+        scores = self.scores(query)
+        return iter_ranked(scores, np.flatnonzero(scores > 0))
+    
+    def rank_many(self, queries: List[str]) -> Iterator[Iterator[int]]:
+        """
+        Rankings of several queries, as from rank(), each scored when it is
+        reached. The queries form a sparse query-term matrix: each distinct
+        term's postings are read and weighted once, however many of the
+        queries contain it. A query whose terms are rare is then scored over
+        their postings alone, so it costs time in proportion to those, not
+        to the corpus (see SPARSE_SCORING_RATIO).
+        """
+        query_terms = [set(terms(query)) for query in queries]
+        weights = self._term_weights(set().union(*query_terms))
+        for terms_of_query in query_terms:
+            parts = [part for term in terms_of_query for part in weights.get(term, ())]
+            sparse = not any(isinstance(indices, slice) for indices, _ in parts) and (
+                sum(len(term_weights) for _, term_weights in parts) <= SPARSE_SCORING_RATIO * self.chunk_count
+            )
+            if sparse:
+                chunks, scores = self._sparse_scores(parts)
+                yield (int(chunks[i]) for i in iter_ranked(scores, np.flatnonzero(scores > 0)))
+            else:
+                scores = self._scores(terms_of_query, weights)
+                yield iter_ranked(scores, np.flatnonzero(scores > 0))
+    
+    def removed_mask(self) -> np.ndarray:
+        """Boolean array over all chunks, True for removed ones."""
+        return np.frombuffer(self.removed, dtype=np.uint8).astype(bool)
+    
+    def set_segments(self, segments: List[PostingsSegment]):
+        """
+        Read postings from these segments from now on. They must cover
+        chunks 0 onwards without gaps: on an empty index, any number of
+        chunks, which start out live; otherwise exactly the chunks indexed
+        so far, whose in-memory postings are then released. Removals are
+        kept.
+        """
+        chunks = 0
+        for segment in segments:
+            if segment.first_chunk != chunks:
+                raise ValueError(f"{segment.path} does not start at chunk {chunks}")
+            chunks += segment.chunk_count
+        
+        if self.chunk_count:
+            if chunks != self.chunk_count:
+                raise ValueError("The segments do not cover the chunks of the index")
+            removed, removed_count, total_length = self.removed, self.removed_count, self.total_length
+        else:
+            removed, removed_count = array('B', bytes(chunks)), 0
+            total_length = sum(segment.total_length for segment in segments)
+        
+        self.__init__(self.k1, self.b)
+        self.segments = list(segments)
+        self.base = chunks
+        self._segment_chunks = [segment.first_chunk for segment in segments]
+        self.removed, self.removed_count, self.total_length = removed, removed_count, total_length
+    
+    def write_segment(self, path: str, start: int):
+        """
+        Write the postings of chunks `start` onwards to a segment file, for
+        a PostingsSegment. `start` is where one of the segments or the
+        in-memory chunks begin, so the newest segments can be merged into
+        the new one. Postings of removed chunks are left out and their
+        lengths written as 0, but chunks keep their numbers.
+        """
+        sources = [segment for segment in self.segments if segment.first_chunk >= start]
+        chunk_count = self.chunk_count - start
+        removed = np.frombuffer(self.removed, dtype=np.uint8)[start:].astype(bool)
+        lengths = np.concatenate(
+            [segment.lengths for segment in sources] + [np.frombuffer(self.lengths, dtype=np.uint32)]
+        )
+        lengths[removed] = 0
+        dense_limit = DENSE_RATIO * chunk_count if chunk_count >= DENSE_MIN_CHUNKS else None
+        
+        # Every term of every source in sorted order, with where to find it
+        listings = [zip(segment.terms(), repeat(position), count()) for position, segment in enumerate(sources)]
+        listings.append(zip(sorted(self.postings.keys() | self.dense.keys()), repeat(len(sources)), repeat(None)))
+        directory = []
+        keys = []
+        key_offset = 0
+        
+        with SectionWriter(path, 'bm25', INDEX_FORMAT) as writer:
+            writer.begin('postings', np.uint8)
+            for term, group in groupby(heapq.merge(*listings), key=itemgetter(0)):
+                index_parts = []
+                frequency_parts = []
+                for _, position, entry in group:
+                    first, indices, frequencies, _ = (
+                        sources[position].part(entry) if entry is not None else self._memory_part(term)
+                    )
+                    if indices is None:
+                        nonzero = np.flatnonzero(frequencies)
+                        indices, frequencies = (nonzero + first).astype(np.uint32), frequencies[nonzero]
+                    index_parts.append(indices)
+                    frequency_parts.append(frequencies)
+                
+                indices = np.concatenate(index_parts)
+                frequencies = np.concatenate(frequency_parts)
+                if self.removed_count:
+                    keep = ~removed[indices - start]
+                    indices, frequencies = indices[keep], frequencies[keep]
+                if not len(indices):
+                    continue
+                
+                dense = dense_limit is not None and len(indices) > dense_limit
+                if dense:
+                    column = np.zeros(chunk_count, dtype=np.uint16)
+                    column[indices - start] = frequencies
+                    offset = writer.write(column, align=True)
+                else:
+                    offset = writer.write(indices, align=True)
+                    writer.write(frequencies, align=True)
+                
+                key = term.encode('utf-8')
+                directory.append((key_offset, offset, len(key), len(indices), dense))
+                keys.append(key)
+                key_offset += len(key) + 1
+            writer.end()
+            
+            writer.add('terms', np.frombuffer(b'\n'.join(keys), dtype=np.uint8))
+            writer.add('directory', np.array(directory, dtype=TERM_RECORD))
+            writer.add('lengths', lengths)
+            writer.finish({'first_chunk': start, 'total_length': int(lengths.sum())})
+    
+    def _term_parts(self, term: str) -> Iterator[Tuple[Optional[int], Optional[np.ndarray], np.ndarray, int]]:
+        """
+        The postings of a term in chunk order, one part per segment that
+        has it and one for the in-memory chunks: (None, chunk indices,
+        frequencies, df), or (first chunk, None, frequencies of every chunk
+        from there, df) where they are stored densely.
+        """
+        for segment in self.segments:
+            entry = segment.find(term)
+            if entry is not None:
+                yield segment.part(entry)
+        
+        part = self._memory_part(term)
+        if part is not None:
+            yield part
+    
+    def _term_weights(self, query_terms: Iterable[str]) -> Dict[str, List[Tuple[object, np.ndarray]]]:
+        """
+        The score each term adds to the chunks containing it, per part of
+        its postings: (chunk indices, or a slice where they are dense, weights).
+        """
+        weights = {}
+        live = len(self)
+        if not live:
+            return weights
+        
+        norms = self._length_norms()
+        for term in query_terms:
+            parts = list(self._term_parts(term))
+            if not parts:
+                continue
+            # Postings of removed chunks still count towards df here; they
+            # are few until their segment is rewritten
+            idf = self._idf(sum(part[3] for part in parts), live)
+            
+            weights[term] = []
+            for first, indices, frequencies, _ in parts:
+                frequencies = frequencies.astype(np.float32)
+                if indices is None:
+                    indices = slice(first, first + len(frequencies))
+                weights[term].append((indices, idf * frequencies * (self.k1 + 1) / (frequencies + norms[indices])))
+        return weights
+    
+    def _scores(self, query_terms: Iterable[str], weights: Dict[str, List[Tuple[object, np.ndarray]]]) -> np.ndarray:
+        scores = np.zeros(self.chunk_count, dtype=np.float32)
+        for term in query_terms:
+            for indices, term_weights in weights.get(term, ()):
+                scores[indices] += term_weights
+        
+        if self.removed_count:
+            scores[self.removed_mask()] = 0
+        return scores
+    
+    def _sparse_scores(self, parts: List[Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The chunks in these sparse _term_weights() parts, ascending, and
+        their scores, summed part by part in the order given; in the term
+        order of _scores(), both give equal scores.
+        """
+        if not parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        
+        chunks = np.sort(np.concatenate([indices for indices, _ in parts]))
+        chunks = chunks[np.concatenate(([True], chunks[1:] != chunks[:-1]))]
+        scores = np.zeros(len(chunks), dtype=np.float32)
+        for indices, term_weights in parts:
+            # A part lists each chunk once, so the positions do not repeat
+            scores[np.searchsorted(chunks, indices)] += term_weights
+        
+        if self.removed_count:
+            scores[np.frombuffer(self.removed, dtype=np.uint8)[chunks].astype(bool)] = 0
+        return chunks, scores
+    
+    def _memory_part(self, term: str) -> Optional[Tuple[Optional[int], Optional[np.ndarray], np.ndarray, int]]:
+        if term in self.dense:
+            return self.base, None, np.frombuffer(self.dense[term], dtype=np.uint16), self.dense_df[term]
+        entry = self.postings.get(term)
+        if entry is None:
+            return None
+        return None, np.frombuffer(entry[0], dtype=np.uint32), np.frombuffer(entry[1], dtype=np.uint16), len(entry[0])
+    
+    def _idf(self, df: int, live: int) -> float:
+        df = min(df, live)
+        return math.log(1 + (live - df + 0.5) / (df + 0.5))
+    
+    def _length(self, index: int) -> int:
+        if index >= self.base:
+            return self.lengths[index - self.base]
+        segment = self.segments[bisect_right(self._segment_chunks, index) - 1]
+        return int(segment.lengths[index - segment.first_chunk])
+    
+    def _length_norms(self) -> np.ndarray:
+        if self._norms is None or len(self._norms) != self.chunk_count:
+            lengths = np.concatenate(
+                [segment.lengths for segment in self.segments] + [np.frombuffer(self.lengths, dtype=np.uint32)]
+            ).astype(np.float32)
+            average = self.total_length / len(self) if len(self) else 1.0
+            self._norms = self.k1 * (1 - self.b + self.b * lengths / max(average, 1.0))
+        return self._norms
+    
+    def _make_dense(self, term: str, num_chunks: int):
+        """Store a term densely over the num_chunks in-memory chunks."""
+        indices, frequencies = self.postings.pop(term)
+        dense = np.zeros(num_chunks, dtype=np.uint16)
+        dense[np.frombuffer(indices, dtype=np.uint32) - self.base] = np.frombuffer(frequencies, dtype=np.uint16)
+        self.dense[term] = array('H', dense.tobytes())
+        self.dense_df[term] = len(indices)
+
+
+def _aligned(offset: int) -> int:
+    return offset + -offset % ALIGNMENT
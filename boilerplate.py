@@ -0,0 +1,118 @@
+import re
+from collections import Counter, deque
+from typing import Dict, Iterable, Iterator, List, Optional
+from text_segmentation import count_words
+
+DIGITS_PATTERN = re.compile(r'\d+')
+SPACE_PATTERN = re.compile(r'\s+')
+# A line that is only a page number: "3", "- 3 -", "3/40", "p. 3", "Page 3 of 40"
+PAGE_NUMBER_LINE = re.compile(r'[\W_]*(?:(?:page|pg\.?|p\.)\s*)?\d+(?:\s*(?:of|/)\s*\d+)?[\W_]*', re.IGNORECASE)
+# A page number inside a longer line, e.g. "Employee Handbook | Page 3 of 40"
+PAGE_REFERENCE = re.compile(r'\bpage\s*\d+(?:\s*(?:of|/)\s*\d+)?', re.IGNORECASE)
+
+# Header/footer zone: this many non-empty lines at the top and bottom of a
+# page, fewer on short pages so that at least one line is never in it
+ZONE_LINES = 3
+# A zone line is boilerplate once it is seen on at least this share of the
+# pages in the window, and on at least MIN_PAGES pages
+MIN_PAGE_RATIO = 0.5
+MIN_PAGES = 3
+# Pages buffered before the first page is released, and the size of the
+# sliding window used to pick up headers that only start later on
+WINDOW_PAGES = 20
+
+
+def line_key(line: str) -> str:
+    """
+    Normalized form of a line used to recognise repeats: case and spacing
+    are ignored and page numbers are masked, so "Page 3 of 40" and "Page 4
+    of 40" are the same line. Other numbers are kept, so numbered headings
+    such as "Section 3" and "Section 4" stay distinct.
+    """
+    line = SPACE_PATTERN.sub(' ', line).strip().lower()
+    if PAGE_NUMBER_LINE.fullmatch(line):
+        return DIGITS_PATTERN.sub('#', line)
+    return PAGE_REFERENCE.sub(lambda match: DIGITS_PATTERN.sub('#', match.group()), line)
+
+
+class BoilerplateFilter:
+    """
+    Removes running headers, footers, page numbers and repeated notices from
+    raw page text before cleaning. Lines in the top and bottom ZONE_LINES of
+    each page are hashed; a line that recurs on most pages of a sliding
+    window is boilerplate and is removed wherever it appears in a zone.
+    Only a window of pages is buffered, so pages still stream through.
+    Lines repeated within a single page are never counted, which keeps
+    pages of genuinely repetitive content intact.
+    """
+    
+    def __init__(self, known_lines: Optional[Iterable[str]] = None):
+        self.boilerplate = set(known_lines or ())
+        self.window = deque()
+        self.counts = Counter()
+        self.pages = 0
+        self.chars_total = 0
+        self.chars_removed = 0
+        self.words_removed = 0
+    
+    def filter(self, raw_pages: Iterable[str]) -> Iterator[str]:
+        """Yield each raw page with its boilerplate lines removed, in order."""
+        pending = deque()
+        
+        for page_text in raw_pages:
+            lines = page_text.splitlines()
+            self._observe(lines)
+            pending.append(lines)
+            
+            # The first pages wait until the window is full, so the
+            # earliest headers are judged on as many pages as later ones
+            if self.pages >= WINDOW_PAGES:
+                while pending:
+                    yield self._strip(pending.popleft())
+        
+        while pending:
+            yield self._strip(pending.popleft())
+    
+    def report(self) -> Dict[str, any]:
+        """What was removed from the document, for its metadata."""
+        return {
+            'boilerplate_lines': sorted(self.boilerplate),
+            'boilerplate_chars': self.chars_removed,
+            'boilerplate_words': self.words_removed,
+            'boilerplate_share': round(self.chars_removed / self.chars_total, 4) if self.chars_total else 0.0,
+        }
+    
+    def _zone(self, lines: List[str]) -> List[int]:
+        """Indices of the header and footer lines of a page; never all of its lines."""
+        non_empty = [i for i, line in enumerate(lines) if line.strip()]
+        size = min(ZONE_LINES, (len(non_empty) - 1) // 2)
+        if size <= 0:
+            return []
+        return non_empty[:size] + non_empty[-size:]
+    
+    def _observe(self, lines: List[str]):
+        keys = Counter(line_key(lines[i]) for i in self._zone(lines))
+        page_keys = {key for key, count in keys.items() if count == 1 and key}
+        
+        self.window.append(page_keys)
+        self.counts.update(page_keys)
+        self.pages += 1
+        
+        if len(self.window) > WINDOW_PAGES:
+            for key in self.window.popleft():
+                self.counts[key] -= 1
+                if not self.counts[key]:
+                    del self.counts[key]
+        
+        threshold = max(MIN_PAGES, MIN_PAGE_RATIO * len(self.window))
+        self.boilerplate.update(key for key in page_keys if self.counts[key] >= threshold)
+    
+    def _strip(self, lines: List[str]) -> str:
+        removed = {i for i in self._zone(lines) if line_key(lines[i]) in self.boilerplate}
+        
+        for i in removed:
+            self.chars_removed += len(lines[i].strip())
+            self.words_removed += count_words(lines[i])
+        self.chars_total += sum(len(line.strip()) for line in lines)
+        
+        return '\n'.join(line for i, line in enumerate(lines) if i not in removed)
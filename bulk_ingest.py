@@ -0,0 +1,251 @@
+"""
+Bulk ingestion of many PDFs into the knowledge base.
+
+Usage:
+    python bulk_ingest.py customer_docs/ "archive/**/*.pdf" --workers 4 --commit-every 25
+
+Files are extracted in parallel on the shared extraction pool, with at most
+a few files in flight per worker. Chunks are added to the RAG store in the
+main process and written to disk once per --commit-every files. Every
+committed file is recorded in a state file with its content hash, so an
+interrupted run picks up where it stopped when started again with the same
+state file. Files are only skipped while the store still holds their
+content, so a cleared or rebuilt store is filled again.
+"""
+import argparse
+import glob
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+from config import Config
+from pdf_processor import PDFProcessor, get_extraction_pool
+from rag_manager import RAGManager
+
+# Files queued on the pool per worker; bounds memory held by finished
+# extractions waiting to be indexed
+IN_FLIGHT_PER_WORKER = 2
+
+
+def expand_inputs(inputs: Iterable[str]) -> List[str]:
+    """Resolve directories and glob patterns to a sorted, de-duplicated list of PDFs."""
+    paths = set()
+    
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.update(glob.glob(os.path.join(item, '**', '*.pdf'), recursive=True))
+        else:
+            paths.update(path for path in glob.glob(item, recursive=True) if os.path.isfile(path))
+    
+    return sorted(paths)
+
+
+def _file_key(path: str) -> str:
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _extract_file(pdf_path: str, settings: Dict[str, any]) -> Dict[str, any]:
+    """
+    Pool entry point: extract and clean one PDF in a worker process, with
+    the caller's processor settings (see PDFProcessor.settings). The file
+    is already one task on the pool, so its pages are read in the worker.
+    """
+    processor = PDFProcessor(**{**settings, 'workers': 1})
+    cache_hit = processor.is_cached(pdf_path)
+    info = {}
+    pages = list(processor.iter_pages(pdf_path, info))
+    
+    return {
+        'pages': pages,
+        'info': info,
+        'content_hash': processor.content_hash(pdf_path),
+        'cache_hit': cache_hit,
+    }
+
+
+class IngestState:
+    """Append-only record of files already committed to the index."""
+    
+    def __init__(self, state_file: Optional[str]):
+        self.state_file = state_file
+        self.done: Dict[str, str] = {}  # file key -> content hash
+        
+        if state_file and os.path.exists(state_file):
+            with open(state_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn last line from an interrupted run
+                    if record.get('status') in ('done', 'duplicate') and record.get('content_hash'):
+                        self.done[record['file_key']] = record['content_hash']
+    
+    def is_ingested(self, path: str, rag_manager: RAGManager) -> bool:
+        """Whether the file was committed unchanged and the store still holds its content."""
+        content_hash = self.done.get(_file_key(path))
+        return content_hash is not None and rag_manager.has_document(content_hash)
+    
+    def record(self, records: List[Dict]):
+        if not self.state_file or not records:
+            return
+        
+        with open(self.state_file, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def ingest_paths(
+    pdf_paths: List[str],
+    rag_manager: RAGManager,
+    processor: Optional[PDFProcessor] = None,
+    workers: int = None,
+    commit_every: int = 25,
+    state_file: Optional[str] = None,
+    progress: Optional[Callable[[str], None]] = print
+) -> Dict[str, any]:
+    """
+    Extract and index many PDFs with bounded concurrency.
+    Returns counts, failures and throughput for the run.
+    """
+    processor = processor or PDFProcessor()
+    workers = workers or max(Config.EXTRACTION_WORKERS, 1)
+    state = IngestState(state_file)
+    report = progress or (lambda message: None)
+    
+    pending_paths = [path for path in pdf_paths if not state.is_ingested(path, rag_manager)]
+    skipped = len(pdf_paths) - len(pending_paths)
+    if skipped:
+        report(f"Resuming: {skipped} file(s) already ingested")
+    
+    summary = {
+        'files': len(pdf_paths), 'ingested': 0, 'duplicates': 0, 'resumed': skipped,
+        'cache_hits': 0, 'chunks': 0, 'pages': 0, 'bytes': 0, 'commits': 0, 'failures': []
+    }
+    uncommitted = []
+    done_count = skipped
+    
+    def commit():
+        if not uncommitted:
+            return
+        rag_manager.commit()
+        state.record(uncommitted)
+        summary['commits'] += 1
+        uncommitted.clear()
+    
+    pool = get_extraction_pool(workers)
+    settings = processor.settings()
+    queue = iter(pending_paths)
+    in_flight = {}
+    start = time.perf_counter()
+    
+    def submit_next():
+        path = next(queue, None)
+        if path is not None:
+            in_flight[pool.submit(_extract_file, path, settings)] = path
+    
+    try:
+        for _ in range(workers * IN_FLIGHT_PER_WORKER):
+            submit_next()
+        
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            
+            for future in finished:
+                path = in_flight.pop(future)
+                submit_next()
+                done_count += 1
+                record = {'file_key': _file_key(path), 'path': path}
+                
+                try:
+                    result = future.result()
+                except Exception as e:
+                    summary['failures'].append({'path': path, 'error': str(e)})
+                    report(f"[{done_count}/{len(pdf_paths)}] FAILED {path}: {e}")
+                    continue
+                
+                summary['pages'] += len(result['pages'])
+                summary['bytes'] += os.path.getsize(path)
+                summary['cache_hits'] += result['cache_hit']
+                record['content_hash'] = result['content_hash']
+                
+                if rag_manager.has_document(result['content_hash']):
+                    summary['duplicates'] += 1
+                    uncommitted.append({**record, 'status': 'duplicate'})
+                    report(f"[{done_count}/{len(pdf_paths)}] duplicate {path}")
+                    continue
+                
+                added = rag_manager.add_document(
+                    chunks=processor.iter_chunks_from_pages(result['pages']),
+                    metadata={
+                        'filename': Path(path).name,
+                        'source_path': path,
+                        'content_hash': result['content_hash']
+                    },
+                    commit=False,
+                    document_info=result['info']
+                )
+                summary['ingested'] += 1
+                summary['chunks'] += added
+                uncommitted.append({**record, 'status': 'done', 'chunks': added})
+                report(f"[{done_count}/{len(pdf_paths)}] ok {path} ({len(result['pages'])} pages, {added} chunks)")
+                
+                if len(uncommitted) >= commit_every:
+                    commit()
+    finally:
+        # Also runs on Ctrl-C, so everything indexed so far is kept
+        for future in in_flight:
+            future.cancel()
+        commit()
+    
+    elapsed = time.perf_counter() - start
+    summary['wall_clock'] = elapsed
+    summary['files_per_sec'] = (done_count - skipped) / elapsed if elapsed else 0.0
+    summary['pages_per_sec'] = summary['pages'] / elapsed if elapsed else 0.0
+    summary['mb_per_sec'] = summary['bytes'] / 1e6 / elapsed if elapsed else 0.0
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest a directory or glob of PDFs into the knowledge base")
+    parser.add_argument('inputs', nargs='+', help="directories, PDF files or glob patterns")
+    parser.add_argument('--workers', type=int, default=max(Config.EXTRACTION_WORKERS, os.cpu_count() or 1))
+    parser.add_argument('--commit-every', type=int, default=25, help="files per index write")
+    parser.add_argument('--state-file', default=os.path.join(Config.CACHE_FOLDER, 'bulk_ingest_state.jsonl'))
+    parser.add_argument('--no-resume', action='store_true', help="ignore and overwrite the state file")
+    args = parser.parse_args()
+    
+    Config.create_folders()
+    if args.no_resume and os.path.exists(args.state_file):
+        os.remove(args.state_file)
+    
+    pdf_paths = expand_inputs(args.inputs)
+    print(f"Found {len(pdf_paths)} PDF(s)")
+    
+    rag_manager = RAGManager(working_dir=Config.CACHE_FOLDER)
+    summary = ingest_paths(
+        pdf_paths,
+        rag_manager,
+        workers=args.workers,
+        commit_every=args.commit_every,
+        state_file=args.state_file
+    )
+    
+    print(f"\n{'='*60}")
+    print(f"Ingested: {summary['ingested']}  Duplicates: {summary['duplicates']}  "
+          f"Resumed: {summary['resumed']}  Failed: {len(summary['failures'])}")
+    print(f"Chunks added: {summary['chunks']}  Index commits: {summary['commits']}  "
+          f"Extraction cache hits: {summary['cache_hits']}")
+    print(f"Wall clock: {summary['wall_clock']:.1f}s  {summary['files_per_sec']:.2f} files/s  "
+          f"{summary['pages_per_sec']:.1f} pages/s  {summary['mb_per_sec']:.2f} MB/s")
+    for failure in summary['failures']:
+        print(f"FAILED {failure['path']}: {failure['error']}")
+    print(f"{'='*60}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,595 @@
+import json
+import re
+from array import array
+from bisect import bisect_right
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from mapped_file import MappedFile, SectionWriter
+from text_segmentation import iter_segment_spans
+from tokenization import iter_token_spans
+
+WORD_PATTERN = re.compile(r'\S+')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def normalize_text(text: str) -> str:
+    """Collapse all whitespace to single spaces, without building a word list."""
+    return WHITESPACE_PATTERN.sub(' ', text).strip()
+
+
+def iter_text_chunks(
+    pages: Iterable[str],
+    chunk_size: int,
+    chunk_overlap: int,
+    unit: str = 'words'
+) -> Iterator[Dict[str, any]]:
+    """
+    Chunk a stream of normalized page texts with a sliding window of words
+    (single characters for CJK text), or of tiktoken tokens when unit is
+    'tokens'. Pages are treated as joined
+    by single spaces, and character offsets refer to that joined text.
+    page_start/page_end are the 1-based pages of the first and last word. Only
+    the text under the current window is kept, so memory is bounded by the
+    chunk size, not the document size.
+    """
+    if chunk_overlap >= chunk_size:
+        raise ValueError(f"Chunk overlap ({chunk_overlap}) must be smaller than the chunk size ({chunk_size})")
+    step = chunk_size - chunk_overlap
+    window = deque()  # (start_char, end_char, page_no) of each word in the window
+    buffer = ''
+    buffer_base = 0  # character offset of buffer[0] in the joined text
+    length = 0
+    start_index = 0
+    pending = False
+    
+    def make_chunk():
+        start_char, end_char = window[0][0], window[-1][1]
+        return {
+            'text': buffer[start_char - buffer_base:end_char - buffer_base],
+            'start_char': start_char,
+            'end_char': end_char,
+            'start_index': start_index,
+            'end_index': start_index + len(window),
+            'page_start': window[0][2],
+            'page_end': window[-1][2],
+            count_key: len(window)
+        }
+    
+    count_key = 'token_count' if unit == 'tokens' else 'word_count'
+    
+    for page_no, (page_text, spans) in enumerate(_iter_spans(pages, unit), 1):
+        if not page_text:
+            continue
+        
+        if length:
+            buffer += ' '
+            length += 1
+        page_base = length
+        buffer += page_text
+        length += len(page_text)
+        
+        for start, end in spans:
+            window.append((page_base + start, page_base + end, page_no))
+            pending = True
+            
+            if len(window) == chunk_size:
+                yield make_chunk()
+                chunk_end = window[-1][1]
+                for _ in range(min(step, len(window))):
+                    window.popleft()
+                start_index += step
+                pending = False
+                
+                # Drop text the window has moved past, once it is at least
+                # half the buffer so the copying stays linear overall
+                keep_from = window[0][0] if window else chunk_end
+                if keep_from - buffer_base > len(buffer) // 2:
+                    buffer = buffer[keep_from - buffer_base:]
+                    buffer_base = keep_from
+    
+    if pending:
+        yield make_chunk()
+
+
+def _iter_spans(pages: Iterable[str], unit: str) -> Iterator[Tuple[str, Iterable[Tuple[int, int]]]]:
+    """Yield each page with the character spans of its words or tokens."""
+    if unit == 'tokens':
+        yield from iter_token_spans(pages)
+        return
+    
+    for page_text in pages:
+        yield page_text, iter_segment_spans(page_text)
+
+
+# Fixed-width records of a segment file (see write_segment)
+DOCUMENT_RECORD = np.dtype([
+    ('first_chunk', '<u8'),
+    ('text_offset', '<u8'),
+    ('text_bytes', '<u8'),
+    ('metadata_offset', '<u8'),
+    ('metadata_bytes', '<u4'),
+    ('pages_bytes', '<u4'),
+    ('pages_offset', '<u8'),
+])
+CHUNK_RECORD = np.dtype([
+    ('document', '<u4'),
+    ('token_count', '<u4'),
+    ('start', '<u8'),
+    ('end', '<u8'),
+    ('byte_start', '<u8'),  # in the document's UTF-8 text
+    ('byte_end', '<u8'),
+    ('page_start', '<u4'),
+    ('page_end', '<u4'),
+])
+SEGMENT_VERSION = 1
+
+
+class ChunkSegment:
+    """
+    A run of documents read from a segment file through mmap. Documents
+    and chunks are fixed-width records over one blob of UTF-8 text, so a
+    chunk is decoded on its own when it is read, and metadata and page
+    tables only when they are asked for.
+    """
+    
+    def __init__(self, path: str):
+        self.file = MappedFile(path, 'chunks', SEGMENT_VERSION)
+        self.path = path
+        self.first_document = self.file.fields['first_document']
+        self.first_chunk = self.file.fields['first_chunk']
+        self.documents = self.file.array('documents')
+        self.chunks = self.file.array('chunks')
+        self._metadata: Dict[int, Dict] = {}
+    
+    @property
+    def document_count(self) -> int:
+        return len(self.documents)
+    
+    @property
+    def chunk_count(self) -> int:
+        return len(self.chunks)
+    
+    def text_bytes(self, document: int) -> bytes:
+        record = self.documents[document]
+        return self.file.bytes('text', int(record['text_offset']), int(record['text_offset'] + record['text_bytes']))
+    
+    def document_text(self, document: int) -> str:
+        return self.text_bytes(document).decode('utf-8')
+    
+    def document_text_slice(self, document: int, start: int, end: int) -> str:
+        """
+        Characters [start, end) of a document's text. The nearest chunk
+        start before `start` gives its byte position, so only about
+        end - start characters are read and decoded.
+        """
+        record = self.documents[document]
+        first = int(record['first_chunk']) - self.first_chunk
+        last = int(self.documents[document + 1]['first_chunk']) - self.first_chunk if document + 1 < len(self.documents) else len(self.chunks)
+        chunks = self.chunks[first:last]
+        
+        nearest = int(np.searchsorted(chunks['start'], start, side='right')) - 1
+        char, byte = (int(chunks['start'][nearest]), int(chunks['byte_start'][nearest])) if nearest >= 0 else (0, 0)
+        text_offset, text_bytes = int(record['text_offset']), int(record['text_bytes'])
+        # A character takes at most 4 bytes; a character cut off at the end is dropped
+        data = self.file.bytes('text', text_offset + byte, text_offset + min(text_bytes, byte + 4 * (end - char)))
+        return data.decode('utf-8', errors='ignore')[start - char:end - char]
+    
+    def chunk_text(self, chunk: int) -> str:
+        record = self.chunks[chunk]
+        offset = int(self.documents[int(record['document']) - self.first_document]['text_offset'])
+        return self.file.bytes('text', offset + int(record['byte_start']), offset + int(record['byte_end'])).decode('utf-8')
+    
+    def metadata_json(self, document: int) -> bytes:
+        record = self.documents[document]
+        offset = int(record['metadata_offset'])
+        return self.file.bytes('metadata', offset, offset + int(record['metadata_bytes']))
+    
+    def metadata(self, document: int) -> Dict:
+        if document not in self._metadata:
+            self._metadata[document] = json.loads(self.metadata_json(document))
+        return self._metadata[document]
+    
+    def pages_json(self, document: int) -> bytes:
+        record = self.documents[document]
+        offset = int(record['pages_offset'])
+        return self.file.bytes('pages', offset, offset + int(record['pages_bytes']))
+    
+    def pages(self, document: int) -> Optional[Dict]:
+        data = self.pages_json(document)
+        return json.loads(data) if data else None
+
+
+class _Column:
+    """
+    Read-only view of one per-document or per-chunk field of a ChunkTable,
+    indexed by document id or chunk index across its segments and the
+    documents held in memory.
+    """
+    
+    def __init__(self, table: 'ChunkTable', per_document: bool, attribute: str, read_segment):
+        self.table = table
+        self.per_document = per_document
+        self.attribute = attribute
+        self.read_segment = read_segment  # (segment, index within it) -> value
+    
+    def __len__(self) -> int:
+        return self.table.document_total if self.per_document else self.table.chunk_total
+    
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += len(self)
+        table = self.table
+        base = table.base_documents if self.per_document else table.base_chunks
+        if index >= base:
+            return getattr(table, self.attribute)[index - base]
+        
+        segment = table.segment_of(index, self.per_document)
+        first = segment.first_document if self.per_document else segment.first_chunk
+        return self.read_segment(segment, index - first)
+
+
+class ChunkTable:
+    """
+    Compact chunk index: one normalized text buffer per document and
+    (start, end) character offsets per chunk. Chunk text is a slice of its
+    document's buffer, materialized only on access, so overlapping chunks
+    do not store their overlap twice. Token counts are kept per chunk when
+    known (0 otherwise) so prompts can be packed to a token budget without
+    re-encoding, and so are the first and last page of each chunk so
+    answers can cite pages.
+    
+    Committed documents are read from memory-mapped segment files (see
+    ChunkSegment); only documents added since are held in memory, in
+    array-backed columns. The texts, metadata, starts, ... attributes give
+    the same indexed access to both.
+    
+    Documents may also carry a page table (character range and fingerprint
+    of every page) so a revised upload can be diffed page by page. Replaced
+    documents are only marked removed, which keeps chunk indices stable.
+    """
+    
+    def __init__(self):
+        self.segments: List[ChunkSegment] = []
+        self.base_documents = 0  # documents in the segments
+        self.base_chunks = 0
+        self._segment_documents: List[int] = []  # first document of each segment
+        self._segment_chunks: List[int] = []
+        
+        # Documents added since the segments were written
+        self._texts: List[str] = []
+        self._metadata: List[Dict] = []
+        self._pages: List[Optional[Dict]] = []  # per document: {'offsets': [[start, end], ...], 'hashes': [...]}
+        self._doc_first_chunk = array('Q')
+        self._doc_ids = array('I')
+        self._starts = array('Q')
+        self._ends = array('Q')
+        self._token_counts = array('I')
+        self._page_starts = array('I')
+        self._page_ends = array('I')
+        
+        self.removed = set()  # ids of replaced documents
+        self.removed_chunks = 0
+        
+        self.texts = _Column(self, True, '_texts', ChunkSegment.document_text)
+        self.metadata = _Column(self, True, '_metadata', ChunkSegment.metadata)
+        self.pages = _Column(self, True, '_pages', ChunkSegment.pages)
+        self.doc_first_chunk = _Column(self, True, '_doc_first_chunk', _record_reader('documents', 'first_chunk'))
+        self.doc_ids = _Column(self, False, '_doc_ids', _record_reader('chunks', 'document'))
+        self.starts = _Column(self, False, '_starts', _record_reader('chunks', 'start'))
+        self.ends = _Column(self, False, '_ends', _record_reader('chunks', 'end'))
+        self.token_counts = _Column(self, False, '_token_counts', _record_reader('chunks', 'token_count'))
+        self.page_starts = _Column(self, False, '_page_starts', _record_reader('chunks', 'page_start'))
+        self.page_ends = _Column(self, False, '_page_ends', _record_reader('chunks', 'page_end'))
+    
+    def __len__(self) -> int:
+        """Number of live chunks."""
+        return self.chunk_total - self.removed_chunks
+    
+    @property
+    def document_total(self) -> int:
+        """Number of documents, removed ones included; the next document id."""
+        return self.base_documents + len(self._texts)
+    
+    @property
+    def chunk_total(self) -> int:
+        return self.base_chunks + len(self._doc_ids)
+    
+    @property
+    def document_count(self) -> int:
+        return self.document_total - len(self.removed)
+    
+    def add_document(
+        self,
+        text: str,
+        offsets: Iterable[Tuple[int, int]],
+        metadata: Optional[Dict] = None,
+        token_counts: Optional[Iterable[int]] = None,
+        page_ranges: Optional[Iterable[Tuple[int, int]]] = None,
+        pages: Optional[Dict] = None
+    ) -> int:
+        """Append a document and its chunk offsets. Returns the number of chunks added."""
+        doc_id = self.document_total
+        first_chunk = len(self._doc_ids)
+        
+        self._texts.append(text)
+        self._metadata.append(metadata or {})
+        self._pages.append(pages)
+        self._doc_first_chunk.append(self.base_chunks + first_chunk)
+        
+        for start, end in offsets:
+            self._doc_ids.append(doc_id)
+            self._starts.append(start)
+            self._ends.append(end)
+        
+        added = len(self._doc_ids) - first_chunk
+        if token_counts is not None:
+            self._token_counts.extend(token_counts)
+        else:
+            self._token_counts.extend([0] * added)
+        
+        if page_ranges is not None:
+            for page_start, page_end in page_ranges:
+                self._page_starts.append(page_start)
+                self._page_ends.append(page_end)
+        else:
+            self._page_starts.extend([0] * added)
+            self._page_ends.extend([0] * added)
+        
+        return added
+    
+    def remove_document(self, doc_id: int):
+        if doc_id not in self.removed:
+            self.removed.add(doc_id)
+            self.removed_chunks += len(self.document_chunks(doc_id))
+    
+    def document_chunks(self, doc_id: int) -> range:
+        """Chunk indices of a document."""
+        last = self.doc_first_chunk[doc_id + 1] if doc_id + 1 < self.document_total else self.chunk_total
+        return range(self.doc_first_chunk[doc_id], last)
+    
+    def document_chunk_arrays(self, doc_id: int) -> Dict[str, array]:
+        """The per-chunk columns of one document, as arrays."""
+        chunks = self.document_chunks(doc_id)
+        if doc_id >= self.base_documents:
+            first, last = chunks.start - self.base_chunks, chunks.stop - self.base_chunks
+            return {
+                name: getattr(self, '_' + name)[first:last]
+                for name in ('starts', 'ends', 'token_counts', 'page_starts', 'page_ends')
+            }
+        
+        segment = self.segment_of(doc_id, True)
+        records = segment.chunks[chunks.start - segment.first_chunk:chunks.stop - segment.first_chunk]
+        return {
+            'starts': array('Q', records['start'].tobytes()),
+            'ends': array('Q', records['end'].tobytes()),
+            'token_counts': array('I', records['token_count'].tobytes()),
+            'page_starts': array('I', records['page_start'].tobytes()),
+            'page_ends': array('I', records['page_end'].tobytes()),
+        }
+    
+    def live_documents(self) -> Iterator[int]:
+        return (doc_id for doc_id in range(self.document_total) if doc_id not in self.removed)
+    
+    def text_slice(self, doc_id: int, start: int = 0, end: Optional[int] = None) -> str:
+        """
+        Characters [start, end) of a document's text (to its end if end is
+        None), reading only that part of a committed document.
+        """
+        if doc_id >= self.base_documents:
+            return self._texts[doc_id - self.base_documents][start:end]
+        
+        segment = self.segment_of(doc_id, True)
+        if end is None:
+            return segment.document_text(doc_id - segment.first_document)[start:]
+        if end <= start:
+            return ''
+        return segment.document_text_slice(doc_id - segment.first_document, start, end)
+    
+    def chunk_text(self, index: int) -> str:
+        if index >= self.base_chunks:
+            local = index - self.base_chunks
+            return self._texts[self._doc_ids[local] - self.base_documents][self._starts[local]:self._ends[local]]
+        
+        segment = self.segment_of(index, False)
+        return segment.chunk_text(index - segment.first_chunk)
+    
+    def get_chunk(self, index: int) -> Dict[str, any]:
+        doc_id = self.doc_ids[index]
+        return {
+            'text': self.chunk_text(index),
+            'metadata': self.metadata[doc_id],
+            'chunk_id': index - self.doc_first_chunk[doc_id],
+            'length': self.ends[index] - self.starts[index],
+            'token_count': self.token_counts[index],
+            'page_start': self.page_starts[index],
+            'page_end': self.page_ends[index]
+        }
+    
+    def segment_of(self, index: int, per_document: bool) -> ChunkSegment:
+        """The segment holding a document (or a chunk) that is not in memory."""
+        bounds = self._segment_documents if per_document else self._segment_chunks
+        return self.segments[bisect_right(bounds, index) - 1]
+    
+    def set_segments(self, segments: List[ChunkSegment]):
+        """
+        Read documents from these segments from now on. They must cover
+        documents 0 onwards without gaps: on an empty table, any number of
+        them; otherwise exactly the documents the table holds, whose
+        in-memory copies are then released. Removals are kept.
+        """
+        documents = chunks = 0
+        for segment in segments:
+            if (segment.first_document, segment.first_chunk) != (documents, chunks):
+                raise ValueError(f"{segment.path} does not start at document {documents}, chunk {chunks}")
+            documents += segment.document_count
+            chunks += segment.chunk_count
+        if self.document_total and (documents, chunks) != (self.document_total, self.chunk_total):
+            raise ValueError("The segments do not cover the documents of the table")
+        
+        removed, removed_chunks = self.removed, self.removed_chunks
+        self.__init__()
+        self.segments = list(segments)
+        self.base_documents = documents
+        self.base_chunks = chunks
+        self._segment_documents = [segment.first_document for segment in segments]
+        self._segment_chunks = [segment.first_chunk for segment in segments]
+        self.removed, self.removed_chunks = removed, removed_chunks
+    
+    def clear(self):
+        self.__init__()
+    
+    @classmethod
+    def from_dict(cls, data) -> 'ChunkTable':
+        table = cls()
+        
+        if isinstance(data, list):
+            # Legacy documents.json: a flat list of chunk dicts with the text
+            # of every chunk stored in full
+            for text, offsets, metadata in _rebuild_legacy_documents(data):
+                table.add_document(text, offsets, metadata)
+            return table
+        
+        for document in data.get('documents', []):
+            table.add_document(
+                document['text'],
+                document['chunks'],
+                document.get('metadata'),
+                document.get('token_counts'),
+                document.get('pages'),
+                document.get('page_table')
+            )
+        return table
+
+
+def write_segment(path: str, table: ChunkTable, first_document: int):
+    """
+    Write the documents of the table from first_document on to a segment
+    file (see ChunkSegment). They may come from the table's own segments,
+    when those are merged, or from memory. Removed documents keep their
+    records, so document ids and chunk indices stay stable, but not their
+    text or page table.
+    """
+    end_document = table.document_total
+    first_chunk = table.doc_first_chunk[first_document] if first_document < end_document else table.chunk_total
+    documents = np.zeros(end_document - first_document, dtype=DOCUMENT_RECORD)
+    chunk_records = []
+    metadata_parts = []
+    pages_parts = []
+    metadata_length = pages_length = 0
+    
+    with SectionWriter(path, 'chunks', SEGMENT_VERSION) as writer:
+        writer.begin('text', np.uint8)
+        for position, doc_id in enumerate(range(first_document, end_document)):
+            text, records, metadata, pages = _segment_document(table, doc_id)
+            if doc_id in table.removed:
+                text, pages = b'', b''
+                records['byte_start'] = records['byte_end'] = 0
+            
+            record = documents[position]
+            record['first_chunk'] = table.doc_first_chunk[doc_id]
+            record['text_offset'] = writer.write(text)
+            record['text_bytes'] = len(text)
+            record['metadata_offset'], record['metadata_bytes'] = metadata_length, len(metadata)
+            record['pages_offset'], record['pages_bytes'] = pages_length, len(pages)
+            metadata_length += len(metadata)
+            pages_length += len(pages)
+            metadata_parts.append(metadata)
+            pages_parts.append(pages)
+            chunk_records.append(records)
+        writer.end()
+        
+        writer.add('metadata', np.frombuffer(b''.join(metadata_parts), dtype=np.uint8))
+        writer.add('pages', np.frombuffer(b''.join(pages_parts), dtype=np.uint8))
+        writer.add('documents', documents)
+        writer.add('chunks', np.concatenate(chunk_records) if chunk_records else np.zeros(0, dtype=CHUNK_RECORD))
+        writer.finish({'first_document': first_document, 'first_chunk': first_chunk})
+
+
+def _segment_document(table: ChunkTable, doc_id: int) -> Tuple[bytes, np.ndarray, bytes, bytes]:
+    """UTF-8 text, chunk records, metadata JSON and page table JSON of a document."""
+    chunks = table.document_chunks(doc_id)
+    
+    if doc_id < table.base_documents:
+        segment = table.segment_of(doc_id, True)
+        document = doc_id - segment.first_document
+        records = segment.chunks[chunks.start - segment.first_chunk:chunks.stop - segment.first_chunk].copy()
+        return segment.text_bytes(document), records, segment.metadata_json(document), segment.pages_json(document)
+    
+    text = table.texts[doc_id]
+    columns = table.document_chunk_arrays(doc_id)
+    records = np.zeros(len(chunks), dtype=CHUNK_RECORD)
+    records['document'] = doc_id
+    for field, name in (('start', 'starts'), ('end', 'ends'), ('token_count', 'token_counts'),
+                        ('page_start', 'page_starts'), ('page_end', 'page_ends')):
+        records[field] = np.frombuffer(columns[name], dtype=records.dtype[field])
+    records['byte_start'] = _utf8_offsets(text, records['start'])
+    records['byte_end'] = _utf8_offsets(text, records['end'])
+    
+    pages = table.pages[doc_id]
+    return (
+        text.encode('utf-8'),
+        records,
+        json.dumps(table.metadata[doc_id], ensure_ascii=False).encode('utf-8'),
+        json.dumps(pages).encode('utf-8') if pages else b''
+    )
+
+
+def _utf8_offsets(text: str, positions: np.ndarray) -> np.ndarray:
+    """Byte offsets in the UTF-8 encoding of text of these character offsets."""
+    if text.isascii():
+        return positions
+    
+    code_points = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    sizes = 1 + (code_points >= 0x80) + (code_points >= 0x800) + (code_points >= 0x10000)
+    offsets = np.zeros(len(text) + 1, dtype=np.uint64)
+    np.cumsum(sizes, out=offsets[1:])
+    return offsets[positions]
+
+
+def _record_reader(records: str, field: str):
+    def read(segment: ChunkSegment, index: int) -> int:
+        return int(getattr(segment, records)[index][field])
+    return read
+
+
+def _rebuild_legacy_documents(chunks: List[Dict], legacy_overlap: int = 200):
+    """
+    Stitch legacy per-chunk records back into one buffer per document.
+    Consecutive chunks of a document share `legacy_overlap` words; when a
+    chunk does not start with the tail of the previous one it is appended
+    as-is instead.
+    """
+    documents = []
+    
+    for chunk in chunks:
+        text = normalize_text(chunk.get('text', ''))
+        if not text:
+            continue
+        
+        metadata = chunk.get('metadata') or {}
+        if chunk.get('chunk_id', 0) == 0 or not documents or documents[-1]['metadata'] != metadata:
+            documents.append({'parts': [], 'offsets': [], 'metadata': metadata, 'length': 0, 'last': ''})
+        
+        document = documents[-1]
+        overlap_end = 0
+        
+        if document['offsets']:
+            for count, match in enumerate(WORD_PATTERN.finditer(text), 1):
+                if count == legacy_overlap:
+                    overlap_end = match.end()
+                    break
+            
+            if not (overlap_end and document['last'].endswith(text[:overlap_end])):
+                overlap_end = 0
+                document['parts'].append(' ')
+                document['length'] += 1
+        
+        start = document['length'] - overlap_end
+        document['parts'].append(text[overlap_end:])
+        document['length'] = start + len(text)
+        document['offsets'].append((start, document['length']))
+        document['last'] = text
+    
+    for document in documents:
+        yield ''.join(document['parts']), document['offsets'], document['metadata']
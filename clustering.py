@@ -0,0 +1,36 @@
+import numpy as np
+
+# Lloyd iterations run by kmeans()
+KMEANS_ITERATIONS = 10
+# Centroids trained on a growing set of vectors (IVF lists, PQ codebooks)
+# are trained again once there are this many times the vectors they were
+# trained on
+RETRAIN_GROWTH = 4
+
+
+def kmeans(sample: np.ndarray, k: int, rng: np.random.Generator, spherical: bool = False) -> np.ndarray:
+    """
+    k centroids of the sample rows by Lloyd's algorithm. Spherical k-means
+    assigns by cosine similarity and keeps the centroids unit length.
+    """
+    centroids = sample[rng.choice(len(sample), k, replace=False)].astype(np.float32)
+    for _ in range(KMEANS_ITERATIONS):
+        similarity = sample @ centroids.T
+        if not spherical:
+            # Nearest by Euclidean distance: the sample's own norm is the same for every centroid
+            similarity -= 0.5 * np.einsum('ij,ij->i', centroids, centroids)
+        labels = np.argmax(similarity, axis=1)
+        order = np.argsort(labels, kind='stable')
+        sizes = np.bincount(labels, minlength=k)
+        filled = np.flatnonzero(sizes)
+        sums = np.zeros_like(centroids)
+        sums[filled] = np.add.reduceat(sample[order], (np.cumsum(sizes) - sizes)[filled])
+        # Clusters left empty restart from random sample points
+        empty = np.flatnonzero(sizes == 0)
+        sums[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+        sizes[empty] = 1
+        if spherical:
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+        else:
+            centroids = sums / sizes[:, None]
+    return centroids.astype(np.float32)
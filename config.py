@@ -13,11 +13,40 @@ class Config:
     
     EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'text-embedding-3-small')
     EMBEDDING_DIM = int(os.getenv('EMBEDDING_DIM', '1536'))
+    EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '64'))
+    EMBEDDING_CONCURRENCY = int(os.getenv('EMBEDDING_CONCURRENCY', '4'))
+    EMBEDDING_CACHE_DTYPE = os.getenv('EMBEDDING_CACHE_DTYPE', 'float32')  # or 'float16'
+    RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'bm25')  # 'bm25', 'embedding' or 'hybrid'
+    HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', '200'))
+    HYBRID_RRF_K = int(os.getenv('HYBRID_RRF_K', '60'))
+    QUERY_CACHE_MB = float(os.getenv('QUERY_CACHE_MB', '32'))
+    QUERY_CACHE_TTL = float(os.getenv('QUERY_CACHE_TTL', '3600'))  # seconds; 0 = no expiry
+    ANN_MIN_VECTORS = int(os.getenv('ANN_MIN_VECTORS', '50000'))
+    ANN_NLIST = int(os.getenv('ANN_NLIST', '0'))  # 0: about the square root of the chunk count
+    ANN_NPROBE = int(os.getenv('ANN_NPROBE', '32'))
+    VECTOR_QUANTIZATION = os.getenv('VECTOR_QUANTIZATION', 'none')  # 'none', 'int8' or 'pq'
+    PQ_SUBVECTORS = int(os.getenv('PQ_SUBVECTORS', '0'))  # 0: EMBEDDING_DIM / 16
+    QUANTIZED_RERANK = int(os.getenv('QUANTIZED_RERANK', '100'))
     
     MAX_CHUNK_SIZE = int(os.getenv('MAX_CHUNK_SIZE', '1000'))
     CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP', '200'))
+    CHUNK_UNIT = os.getenv('CHUNK_UNIT', 'words')  # 'words' or 'tokens'
+    TOKENIZER_BATCH_SIZE = int(os.getenv('TOKENIZER_BATCH_SIZE', '64'))
+    CONTEXT_MAX_TOKENS = int(os.getenv('CONTEXT_MAX_TOKENS', '1500'))
     MAX_HANDBOOK_LENGTH = int(os.getenv('MAX_HANDBOOK_LENGTH', '20000'))
     
+    EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', '1'))
+    EXTRACTION_STRATEGY = os.getenv('EXTRACTION_STRATEGY', 'pdfplumber')  # 'pdfplumber', 'fast' or 'adaptive'
+    EXTRACTION_MAX_RSS_MB = int(os.getenv('EXTRACTION_MAX_RSS_MB', '0'))  # 0 = no limit
+    EXTRACTION_RECYCLE_PAGES = int(os.getenv('EXTRACTION_RECYCLE_PAGES', '0'))  # 0 = never
+    EXTRACTION_PAGE_TIMEOUT = float(os.getenv('EXTRACTION_PAGE_TIMEOUT', '0'))  # seconds; 0 = extract inline
+    STRIP_BOILERPLATE = os.getenv('STRIP_BOILERPLATE', 'true').lower() in ('1', 'true', 'yes')
+    REVISION_MIN_SHARED_PAGES = float(os.getenv('REVISION_MIN_SHARED_PAGES', '0.5'))  # share of pages
+    
+    # BM25 keyword retrieval: term frequency saturation and length normalization
+    BM25_K1 = float(os.getenv('BM25_K1', '1.2'))
+    BM25_B = float(os.getenv('BM25_B', '0.75'))
+    
     UPLOAD_FOLDER = 'uploads'
     CACHE_FOLDER = 'cache'
     
@@ -0,0 +1,244 @@
+import json
+import sqlite3
+from array import array
+from typing import Iterable, List, Tuple
+from chunk_store import ChunkTable
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    text TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    page_table TEXT,
+    starts BLOB NOT NULL,
+    ends BLOB NOT NULL,
+    token_counts BLOB,
+    page_starts BLOB,
+    page_ends BLOB,
+    removed INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS removed_documents ON documents (id) WHERE removed = 1;
+CREATE INDEX IF NOT EXISTS document_content_hashes ON documents (json_extract(metadata, '$.content_hash')) WHERE removed = 0;
+CREATE INDEX IF NOT EXISTS document_filenames ON documents (json_extract(metadata, '$.filename')) WHERE removed = 0;
+CREATE INDEX IF NOT EXISTS document_titles ON documents (json_extract(metadata, '$.title')) WHERE removed = 0;
+CREATE TABLE IF NOT EXISTS segments (
+    name TEXT PRIMARY KEY,
+    first_document INTEGER NOT NULL,
+    document_count INTEGER NOT NULL,
+    first_chunk INTEGER NOT NULL,
+    chunk_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    dimensions INTEGER NOT NULL,
+    chunk_count INTEGER NOT NULL
+);
+DROP TABLE IF EXISTS index_files;
+"""
+# PRAGMA user_version from which rows covered by a segment hold no text
+TEXT_IN_SEGMENTS_VERSION = 1
+# Metadata keys with an index for find_documents()
+INDEXED_METADATA_KEYS = ('content_hash', 'filename', 'title')
+
+
+class DocumentStore:
+    """
+    SQLite storage for a ChunkTable, in WAL mode.
+    
+    Each document is one row keyed by its ChunkTable id, with the chunk
+    arrays packed into blobs, so saving a document costs time in proportion
+    to its own size. Rows are only appended: a replaced document is marked
+    removed and its text dropped, which keeps the ids and chunk indices of
+    every other document stable. The segment files that documents are read
+    from (see RAGManager.commit) are registered here as well, so rows and
+    segments are committed together in a single transaction; a crash
+    leaves either the previous state or the new one.
+    
+    The text of a document is kept in the segment that covers it, not in
+    its row. Only rows no segment covers yet, such as documents migrated
+    from documents.json, hold their text, until a segment is written for
+    them.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL keeps every commit atomic; only the last ones may
+        # be lost on power failure, never half of one
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+    
+    def close(self):
+        self.connection.close()
+    
+    def document_count(self) -> int:
+        """Number of rows, removed documents included; ids run from 0 without gaps."""
+        return self.connection.execute("SELECT COALESCE(MAX(id) + 1, 0) FROM documents").fetchone()[0]
+    
+    def removed_documents(self) -> List[int]:
+        return [row[0] for row in self.connection.execute("SELECT id FROM documents WHERE removed = 1")]
+    
+    def load(self, table: ChunkTable, first_document: int = 0) -> List[int]:
+        """
+        Append the stored documents from first_document on to a table that
+        holds the ones before, in id order. Removals are not applied.
+        Returns the ids of live documents whose text was only in a segment
+        and is lost; they are added with empty text.
+        """
+        rows = self.connection.execute(
+            "SELECT id, text, metadata, page_table, starts, ends, token_counts, page_starts, page_ends, removed "
+            "FROM documents WHERE id >= ? ORDER BY id",
+            (first_document,)
+        )
+        lost = []
+        for doc_id, text, metadata, page_table, starts, ends, token_counts, page_starts, page_ends, removed in rows:
+            if doc_id != table.document_total:
+                raise ValueError(f"Document {table.document_total} is missing from {self.path}")
+            if not text and starts and not removed:
+                lost.append(doc_id)
+            
+            table.add_document(
+                text,
+                zip(array('Q', starts), array('Q', ends)),
+                json.loads(metadata),
+                array('I', token_counts) if token_counts else None,
+                zip(array('I', page_starts), array('I', page_ends)) if page_starts else None,
+                json.loads(page_table) if page_table else None
+            )
+        return lost
+    
+    def find_documents(self, key: str, value: str) -> List[int]:
+        """
+        Ids of the stored documents that are not removed and whose metadata
+        has this value for an INDEXED_METADATA_KEYS key, newest first.
+        """
+        if key not in INDEXED_METADATA_KEYS:
+            raise ValueError(f"Metadata key {key} is not indexed")
+        # The expression must match the index's for SQLite to use it
+        return [row[0] for row in self.connection.execute(
+            f"SELECT id FROM documents WHERE json_extract(metadata, '$.{key}') = ? AND removed = 0 ORDER BY id DESC",
+            (value,)
+        )]
+    
+    def segments(self) -> List[Tuple[str, int, int, int, int]]:
+        """
+        (name, first document, document count, first chunk, chunk count) of
+        every registered segment, in document order.
+        """
+        return self.connection.execute(
+            "SELECT name, first_document, document_count, first_chunk, chunk_count FROM segments "
+            "ORDER BY first_document"
+        ).fetchall()
+    
+    def embedded_chunks(self, model: str, dimensions: int) -> int:
+        """
+        Number of leading chunks whose embeddings by this model are saved
+        (see VectorIndex); 0 if they were made by another model.
+        """
+        row = self.connection.execute("SELECT model, dimensions, chunk_count FROM embeddings").fetchone()
+        if row is None or (row[0], row[1]) != (model, dimensions):
+            return 0
+        return row[2]
+    
+    def commit(
+        self,
+        table: ChunkTable,
+        new_documents: Iterable[int],
+        removed_documents: Iterable[int],
+        added_segments: Iterable[Tuple[str, int, int, int, int]] = (),
+        dropped_segments: Iterable[str] = (),
+        embedded: Tuple[str, int, int] = None
+    ):
+        """
+        In one transaction: insert the given documents of the table, mark
+        already stored documents removed, update the segment list and, if
+        given, record (model, dimensions, chunk count) of the embeddings.
+        Documents the added segments cover are stored without their text,
+        and rows that held it until now drop it.
+        """
+        added_segments = list(added_segments)
+        covered = [(first, first + count) for _, first, count, _, _ in added_segments]
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.executemany(
+                "INSERT INTO documents (id, text, metadata, page_table, starts, ends, token_counts, "
+                "page_starts, page_ends, removed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self._row(table, doc_id, any(first <= doc_id < end for first, end in covered))
+                    for doc_id in new_documents
+                )
+            )
+            cursor.executemany("UPDATE documents SET text = '' WHERE id >= ? AND id < ? AND text != ''", covered)
+            cursor.executemany(
+                "UPDATE documents SET text = '', page_table = NULL, removed = 1 WHERE id = ?",
+                ((doc_id,) for doc_id in removed_documents)
+            )
+            cursor.executemany("DELETE FROM segments WHERE name = ?", ((name,) for name in dropped_segments))
+            cursor.executemany(
+                "INSERT INTO segments (name, first_document, document_count, first_chunk, chunk_count) "
+                "VALUES (?, ?, ?, ?, ?)",
+                added_segments
+            )
+            if embedded is not None:
+                cursor.execute("DELETE FROM embeddings")
+                cursor.execute("INSERT INTO embeddings (model, dimensions, chunk_count) VALUES (?, ?, ?)", embedded)
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+    
+    def drop_segment_texts(self):
+        """
+        Drop the text of rows the registered segments cover, which stores
+        written before TEXT_IN_SEGMENTS_VERSION kept in both places. Only
+        call this once the segments are known to be readable; it runs once
+        per store.
+        """
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] >= TEXT_IN_SEGMENTS_VERSION:
+            return
+        
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute(
+                "UPDATE documents SET text = '' WHERE text != '' AND id < "
+                "(SELECT COALESCE(MAX(first_document + document_count), 0) FROM segments)"
+            )
+            cursor.execute(f"PRAGMA user_version = {TEXT_IN_SEGMENTS_VERSION}")
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+    
+    def clear(self):
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute("DELETE FROM documents")
+            cursor.execute("DELETE FROM segments")
+            cursor.execute("DELETE FROM embeddings")
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+    
+    def _row(self, table: ChunkTable, doc_id: int, in_segment: bool) -> tuple:
+        removed = doc_id in table.removed
+        columns = table.document_chunk_arrays(doc_id)
+        pages = table.pages[doc_id]
+        
+        return (
+            doc_id,
+            '' if removed or in_segment else table.texts[doc_id],
+            json.dumps(table.metadata[doc_id], ensure_ascii=False),
+            json.dumps(pages) if pages and not removed else None,
+            columns['starts'].tobytes(),
+            columns['ends'].tobytes(),
+            columns['token_counts'].tobytes() if any(columns['token_counts']) else None,
+            columns['page_starts'].tobytes() if any(columns['page_starts']) else None,
+            columns['page_ends'].tobytes() if any(columns['page_starts']) else None,
+            int(removed),
+        )
+
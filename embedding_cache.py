@@ -0,0 +1,77 @@
+import hashlib
+import sqlite3
+from typing import Dict, List
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    dimensions INTEGER NOT NULL,
+    hash BLOB NOT NULL,
+    vector BLOB NOT NULL,
+    PRIMARY KEY (model, dimensions, hash)
+) WITHOUT ROWID;
+"""
+# Hashes looked up per query; SQLite allows 999 parameters in older builds
+LOOKUP_BATCH = 500
+DTYPES = ('float32', 'float16')
+
+
+def text_hash(text: str) -> bytes:
+    """SHA-256 of the text, which callers normalize first."""
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+class EmbeddingCache:
+    """
+    Persistent embeddings keyed by (model, dimensions, text hash), in a
+    SQLite file of its own so it outlives RAGManager.clear(): overlapping
+    chunks, re-uploads and shared boilerplate are embedded once, and
+    re-indexing an unchanged corpus makes no API calls. Vectors are stored
+    as float32 blobs, or float16 to halve the file.
+    """
+    
+    def __init__(self, path: str, dtype: str = 'float32'):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown embedding cache dtype: {dtype}")
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+    
+    def close(self):
+        self.connection.close()
+    
+    def get_many(self, model: str, dimensions: int, hashes: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """Cached float32 vectors of those hashes that are present."""
+        found = {}
+        for start in range(0, len(hashes), LOOKUP_BATCH):
+            batch = hashes[start:start + LOOKUP_BATCH]
+            rows = self.connection.execute(
+                f"SELECT hash, vector FROM embeddings WHERE model = ? AND dimensions = ? "
+                f"AND hash IN ({','.join('?' * len(batch))})",
+                (model, dimensions, *batch)
+            )
+            for key, blob in rows:
+                # The blob length tells which dtype an entry was stored with
+                dtype = np.float16 if len(blob) == 2 * dimensions else np.float32
+                found[key] = np.frombuffer(blob, dtype=dtype).astype(np.float32)
+        return found
+    
+    def put_many(self, model: str, dimensions: int, hashes: List[bytes], vectors: np.ndarray):
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, dimensions, hash, vector) VALUES (?, ?, ?, ?)",
+                (
+                    (model, dimensions, key, vector.astype(self.dtype).tobytes())
+                    for key, vector in zip(hashes, vectors)
+                )
+            )
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
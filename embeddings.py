@@ -0,0 +1,127 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List
+import numpy as np
+import requests
+from chunk_store import normalize_text
+from config import Config
+from embedding_cache import EmbeddingCache, text_hash
+
+# Attempts per batch; rate limits, server errors, dropped connections and
+# timeouts are retried with backoff
+MAX_TRIES = 5
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class EmbeddingClient:
+    """
+    Embeds texts with the OpenAI embeddings API. Texts are sent in batches
+    of batch_size, up to `concurrency` requests at a time, and come back
+    as unit-length float32 rows in input order.
+    
+    Texts are looked up in an EmbeddingCache first, by hash of their
+    normalized text, and only the ones it misses are sent. cache_hits and
+    cache_misses count texts served each way.
+    """
+    
+    def __init__(
+        self,
+        model: str = None,
+        dimensions: int = None,
+        batch_size: int = None,
+        concurrency: int = None,
+        api_key: str = None,
+        api_base: str = None,
+        use_cache: bool = True
+    ):
+        self.model = model or Config.EMBEDDING_MODEL
+        self.dimensions = dimensions or Config.EMBEDDING_DIM
+        self.batch_size = max(1, batch_size or Config.EMBEDDING_BATCH_SIZE)
+        self.concurrency = max(1, concurrency or Config.EMBEDDING_CONCURRENCY)
+        self.api_key = api_key or Config.OPENAI_API_KEY
+        self.api_base = api_base or Config.OPENAI_API_BASE
+        
+        if not self.api_key:
+            raise ValueError("OPENAI_API_KEY is required for embeddings")
+        
+        self.cache = None
+        if use_cache:
+            os.makedirs(Config.CACHE_FOLDER, exist_ok=True)
+            self.cache = EmbeddingCache(os.path.join(Config.CACHE_FOLDER, 'embeddings.db'), Config.EMBEDDING_CACHE_DTYPE)
+        self.cache_hits = 0
+        self.cache_misses = 0
+    
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embeddings of the texts, one row each."""
+        texts = [normalize_text(text) for text in texts]
+        hashes = [text_hash(text) for text in texts]
+        found = self.cache.get_many(self.model, self.dimensions, list(set(hashes))) if self.cache else {}
+        
+        # Each distinct missing text is sent once
+        missing = {}
+        for text, key in zip(texts, hashes):
+            if key not in found and key not in missing:
+                missing[key] = text
+        self.cache_hits += len(texts) - len(missing)
+        self.cache_misses += len(missing)
+        
+        keys, pending = list(missing), list(missing.values())
+        for start, vectors in zip(range(0, len(pending), self.batch_size), self._embed_batches(pending)):
+            batch_keys = keys[start:start + self.batch_size]
+            found.update(zip(batch_keys, vectors))
+            # Saved batch by batch, so a failed request loses no paid-for results
+            if self.cache:
+                self.cache.put_many(self.model, self.dimensions, batch_keys, vectors)
+        
+        if not texts:
+            return np.zeros((0, self.dimensions), dtype=np.float32)
+        vectors = np.stack([found[key] for key in hashes])
+        # float16 cache entries are a little off unit length
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+    
+    def _embed_batches(self, texts: List[str]) -> Iterator[np.ndarray]:
+        """Embeddings of consecutive batches of texts, in order, sent concurrently."""
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) <= 1 or self.concurrency == 1:
+            yield from map(self._embed_batch, batches)
+            return
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(batches))) as pool:
+            yield from pool.map(self._embed_batch, batches)
+    
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        payload = {
+            'model': self.model,
+            # The API rejects empty input
+            'input': [text or ' ' for text in texts],
+        }
+        if self.model.startswith('text-embedding-3'):
+            payload['dimensions'] = self.dimensions
+        
+        for tries in range(1, MAX_TRIES + 1):
+            try:
+                response = requests.post(
+                    f'{self.api_base}/embeddings',
+                    json=payload,
+                    headers={'Authorization': f'Bearer {self.api_key}', 'Content-Type': 'application/json'},
+                    timeout=120
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if tries == MAX_TRIES:
+                    raise Exception(f"Embedding API Error: {e}") from e
+                time.sleep(2 ** tries)
+                continue
+            if response.status_code == 200:
+                break
+            if response.status_code not in RETRY_STATUS or tries == MAX_TRIES:
+                raise Exception(f"Embedding API Error: {response.status_code} - {response.text}")
+            time.sleep(2 ** tries)
+        
+        data = sorted(response.json()['data'], key=lambda item: item['index'])
+        vectors = np.array([item['embedding'] for item in data], dtype=np.float32)
+        if vectors.shape != (len(texts), self.dimensions):
+            raise ValueError(f"Expected {len(texts)} embeddings of {self.dimensions} dimensions, got {vectors.shape}")
+        
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+from typing import Dict, Iterator, List, Optional
+
+
+def hash_file(path: str, block_size: int = 1 << 20) -> str:
+    """SHA-256 of a file's bytes, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """
+    Content-addressed store of extracted PDF text.
+    Each entry is keyed by the hash of the PDF bytes plus the extractor and
+    cleaner versions, and holds the cleaned text (<key>.txt) next to its page
+    offsets and metadata (<key>.json). The .json file is written last, so an
+    entry only exists once it is complete.
+    """
+    
+    def __init__(self, cache_dir: str, version: str):
+        self.cache_dir = cache_dir
+        self.version = version
+        os.makedirs(cache_dir, exist_ok=True)
+        
+        # (path, size, mtime) -> content hash, so a file is hashed only once
+        self._hashes = {}
+    
+    def content_hash(self, pdf_path: str) -> str:
+        stat = os.stat(pdf_path)
+        file_key = (os.path.abspath(pdf_path), stat.st_size, stat.st_mtime_ns)
+        
+        if file_key not in self._hashes:
+            self._hashes[file_key] = hash_file(pdf_path)
+        return self._hashes[file_key]
+    
+    def key_for(self, pdf_path: str) -> str:
+        return hashlib.sha256(f"{self.content_hash(pdf_path)}:{self.version}".encode()).hexdigest()
+    
+    def _paths(self, key: str):
+        base = os.path.join(self.cache_dir, key)
+        return base + '.txt', base + '.json'
+    
+    def contains(self, pdf_path: str) -> bool:
+        return os.path.exists(self._paths(self.key_for(pdf_path))[1])
+    
+    def get(self, pdf_path: str) -> Optional[Dict]:
+        """Return the cached entry for a PDF, or None on a miss."""
+        text_path, index_path = self._paths(self.key_for(pdf_path))
+        
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            with open(text_path, 'r', encoding='utf-8') as f:
+                entry['text'] = f.read()
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading extraction cache: {e}")
+            return None
+        
+        return entry
+    
+    def iter_pages(self, entry: Dict) -> Iterator[str]:
+        text = entry['text']
+        for start, end in entry['pages']:
+            yield text[start:end]
+    
+    def writer(self, pdf_path: str) -> 'ExtractionCacheWriter':
+        return ExtractionCacheWriter(self, self.key_for(pdf_path), self.content_hash(pdf_path))
+
+
+class ExtractionCacheWriter:
+    """
+    Streams cleaned pages into a cache entry as they are extracted.
+    Nothing becomes visible until commit(); an abandoned writer leaves
+    only a temporary file behind, which discard() removes.
+    """
+    
+    def __init__(self, cache: ExtractionCache, key: str, content_hash: str):
+        self.cache = cache
+        self.key = key
+        self.content_hash = content_hash
+        self.text_path, self.index_path = cache._paths(key)
+        self.tmp_path = f"{self.text_path}.{os.getpid()}.tmp"
+        self.file = open(self.tmp_path, 'w', encoding='utf-8')
+        self.pages: List[List[int]] = []
+        self.length = 0
+    
+    def add_page(self, page_text: str):
+        # Pages are joined with a single space, matching extract_text_from_pdf()
+        if page_text and self.length:
+            self.file.write(' ')
+            self.length += 1
+        
+        start = self.length
+        self.file.write(page_text)
+        self.length += len(page_text)
+        self.pages.append([start, self.length])
+    
+    def commit(self, metadata: Dict, page_hashes: Optional[List[str]] = None):
+        self.file.close()
+        os.replace(self.tmp_path, self.text_path)
+        
+        index_tmp = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(index_tmp, 'w', encoding='utf-8') as f:
+            json.dump({
+                'content_hash': self.content_hash,
+                'version': self.cache.version,
+                'pages': self.pages,
+                'metadata': metadata,
+                'page_hashes': page_hashes,
+            }, f, ensure_ascii=False, default=str)
+        os.replace(index_tmp, self.index_path)
+    
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
@@ -1,9 +1,14 @@
 from typing import List, Dict, Optional
+from config import Config
 from openai_handler import OpenAIHandler
 from rag_manager import RAGManager
+from text_segmentation import count_words
 import re
 from tqdm import tqdm
 
+# Characters of the documents the outline is planned from
+PLAN_CONTEXT_CHARS = 8000
+
 class HandbookGenerator:
     def __init__(self, openai_handler: OpenAIHandler, rag_manager: RAGManager):
         self.openai = openai_handler
@@ -69,7 +74,7 @@ Write the section now:"""
         
         prompt = self.plan_template.format(
             topic=topic,
-            context=context[:8000],
+            context=context[:PLAN_CONTEXT_CHARS],
             target_length=target_length
         )
         
@@ -96,7 +101,7 @@ Write the section now:"""
         prompt = self.write_template.format(
             topic=topic,
             plan='\n'.join(plan),
-            context=context[:6000],
+            context=context,
             previous_text=previous_text[-3000:] if previous_text else "None - this is the first section",
             current_step=current_step,
             section_length=section_length
@@ -121,7 +126,7 @@ Write the section now:"""
         print(f"Target length: {target_length} words")
         print(f"{'='*60}\n")
         
-        context = self.rag.get_all_documents_text()
+        context = self.rag.get_documents_text(max_chars=PLAN_CONTEXT_CHARS)
         
         if not context:
             return {
@@ -154,6 +159,8 @@ Write the section now:"""
         full_text += "\n---\n\n"
         
         sections_content = []
+        # Context for every section, retrieved in one pass over the index
+        contexts = self.rag.get_contexts_for_queries(plan, max_tokens=Config.CONTEXT_MAX_TOKENS)
         
         for idx, step in enumerate(tqdm(plan, desc="Writing sections")):
             print(f"\nWriting section {idx+1}/{num_sections}: {step}")
@@ -162,7 +169,7 @@ Write the section now:"""
                 progress_callback(idx + 1, num_sections, step)
             
             try:
-                relevant_context = self.rag.get_context_for_query(step)
+                relevant_context = contexts[idx]
                 
                 section = self.generate_section(
                     topic=topic,
@@ -179,14 +186,14 @@ Write the section now:"""
                 sections_content.append(section_with_header)
                 full_text += section_with_header
                 
-                current_word_count = len(full_text.split())
+                current_word_count = count_words(full_text)
                 print(f"Section complete. Current total: {current_word_count} words")
                 
             except Exception as e:
                 print(f"Error writing section {step}: {e}")
                 continue
         
-        final_word_count = len(full_text.split())
+        final_word_count = count_words(full_text)
         
         print(f"\n{'='*60}")
         print(f"Handbook generation complete!")
@@ -0,0 +1,183 @@
+"""
+Inverted-file (IVF-flat) approximate nearest-neighbour search over the
+rows of a VectorIndex.
+
+Vectors are partitioned among nlist centroids trained with spherical
+k-means; a query is compared with the centroids, and only the rows of the
+nprobe nearest lists are scored exactly. nprobe trades recall for
+latency. The lists hold row numbers into the vector matrix, so vectors are
+not stored twice.
+"""
+import glob
+import os
+import uuid
+from typing import Iterator, Optional
+import numpy as np
+from config import Config
+from clustering import RETRAIN_GROWTH, kmeans
+from row_file import RowFile
+from vector_index import VectorIndex
+
+# Training sample size per list
+TRAINING_POINTS_PER_LIST = 64
+# Rows assigned per matrix product
+ASSIGN_BLOCK = 65536
+
+
+class IVFIndex:
+    """
+    IVF-flat index, persisted as an .npz file of the centroids that names
+    a row file (see RowFile) holding every row's list, so the two are
+    replaced together when the centroids are trained. New rows are
+    assigned to the nearest trained centroid as they are added and
+    appended to the row file, so an update writes only their lists; the
+    lists are regrouped on the first search after. The files are derived
+    from the vectors, so lost or stale ones are only rebuilt.
+    """
+    
+    def __init__(self, path: str, nlist: int = None, nprobe: int = None, min_vectors: int = None):
+        self.path = path
+        self.nlist = Config.ANN_NLIST if nlist is None else nlist  # 0: about sqrt(vectors)
+        self.nprobe = nprobe or Config.ANN_NPROBE
+        self.min_vectors = Config.ANN_MIN_VECTORS if min_vectors is None else min_vectors
+        self._reset(None)
+    
+    def __len__(self) -> int:
+        return len(self.file) if self.file is not None else 0
+    
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+    
+    @property
+    def assignments(self) -> np.ndarray:
+        """The list of every covered row."""
+        return self.file.rows if self.file is not None else np.zeros(0, dtype=np.int32)
+    
+    def open(self, key: str, count: int):
+        """
+        Load the saved index if it was built from vectors identified by
+        `key` (e.g. the model), covering their first `count` rows.
+        """
+        self._reset(key)
+        if not count:
+            return
+        try:
+            with np.load(self.path) as saved:
+                if str(saved['key']) != key:
+                    return
+                centroids, trained_count, assignments_id = (
+                    saved['centroids'], int(saved['trained_count']), str(saved['assignments_id'])
+                )
+            file = self._assignments_file(assignments_id)
+            file.open(count)
+            self.centroids, self.trained_count, self.file = centroids, trained_count, file
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error reading {self.path}, it will be rebuilt: {e}")
+            self._reset(key)
+    
+    def update(self, matrix: np.ndarray, count: int, key: str):
+        """
+        Cover the first `count` rows of the matrix: train once there are
+        min_vectors of them (again as they grow), otherwise assign the rows
+        added since the last update. Saves the index if it changed.
+        """
+        if key != self.key or count < len(self) or (count < self.min_vectors and self.trained):
+            self.clear()
+            self.key = key
+        if count < self.min_vectors:
+            return
+        
+        if not self.trained or count >= RETRAIN_GROWTH * self.trained_count:
+            self._train(matrix, count)
+        elif count > len(self):
+            self.file.append(self._assign(matrix, len(self), count))
+            self.file.flush()
+        else:
+            return
+        self._lists = None
+    
+    def rank(
+        self,
+        vectors: VectorIndex,
+        query_vector: np.ndarray,
+        removed: Optional[np.ndarray] = None,
+        nprobe: int = None
+    ) -> Iterator[int]:
+        """
+        Rows of the nprobe lists nearest to the query by descending
+        similarity, leaving out those flagged in `removed`. The rows are
+        scored by `vectors`, on its quantized codes if it has them.
+        """
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        order, bounds = self._inverted_lists()
+        
+        probed = np.argpartition(-(self.centroids @ query_vector), nprobe - 1)[:nprobe]
+        rows = np.sort(np.concatenate([order[bounds[i]:bounds[i + 1]] for i in probed.tolist()]))
+        return vectors.rank(query_vector, removed, rows)
+    
+    def clear(self):
+        self._reset(None)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        # Assignment files of every training, including any a crash left behind
+        for path in glob.glob(f"{glob.escape(os.path.splitext(self.path)[0])}-*.npy"):
+            os.remove(path)
+    
+    def _reset(self, key: Optional[str]):
+        self.key = key
+        self.centroids: Optional[np.ndarray] = None
+        self.file: Optional[RowFile] = None  # assignments, once trained
+        self.trained_count = 0
+        self._lists = None  # (rows grouped by list, start of each list)
+    
+    def _inverted_lists(self):
+        if self._lists is None:
+            order = np.argsort(self.assignments, kind='stable').astype(np.int64)
+            bounds = np.concatenate([[0], np.cumsum(np.bincount(self.assignments, minlength=len(self.centroids)))])
+            self._lists = (order, bounds)
+        return self._lists
+    
+    def _train(self, matrix: np.ndarray, count: int):
+        nlist = self.nlist or int(np.sqrt(count))
+        nlist = max(1, min(nlist, count))
+        rng = np.random.default_rng(0)
+        sample_size = min(count, nlist * TRAINING_POINTS_PER_LIST)
+        sample = np.asarray(matrix[np.sort(rng.choice(count, sample_size, replace=False))], dtype=np.float32)
+        
+        self.centroids = kmeans(sample, nlist, rng, spherical=True)
+        self.trained_count = count
+        
+        # Every row is assigned into a new file, which the centroid file
+        # then points to; the old assignments go last
+        old_file = self.file
+        assignments_id = uuid.uuid4().hex[:8]
+        self.file = self._assignments_file(assignments_id)
+        self.file.append(self._assign(matrix, 0, count))
+        self.file.flush()
+        
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                key=np.array(self.key),
+                centroids=self.centroids,
+                trained_count=np.array(self.trained_count),
+                assignments_id=np.array(assignments_id)
+            )
+        os.replace(tmp_path, self.path)
+        if old_file is not None:
+            old_file.clear()
+    
+    def _assign(self, matrix: np.ndarray, start: int, end: int) -> np.ndarray:
+        parts = [
+            np.argmax(matrix[block:min(block + ASSIGN_BLOCK, end)] @ self.centroids.T, axis=1).astype(np.int32)
+            for block in range(start, end, ASSIGN_BLOCK)
+        ]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int32)
+    
+    def _assignments_file(self, assignments_id: str) -> RowFile:
+        return RowFile(f"{os.path.splitext(self.path)[0]}-{assignments_id}.npy", np.int32)
@@ -0,0 +1,130 @@
+"""
+Binary files of named, aligned sections that are read through mmap.
+
+A file is its sections back to back, then a small JSON footer naming the
+kind of file, its fields and where each section is, then a fixed trailer
+(footer length and magic). Opening a file only reads the footer; section
+contents are paged in by the OS when they are first touched, so opening
+costs the same however large the file is.
+"""
+import json
+import mmap
+import os
+import struct
+from typing import Dict, Optional
+import numpy as np
+
+MAGIC = b'HBMAP01\n'
+TRAILER = struct.Struct('<Q8s')  # footer length, magic
+ALIGNMENT = 8
+
+
+class SectionWriter:
+    """
+    Writes a section file. Sections are written one after another, either
+    whole with add() or in pieces between begin() and end(). The file only
+    appears at `path` once finish() succeeds; used as a context manager,
+    an unfinished file is discarded.
+    """
+    
+    def __init__(self, path: str, kind: str, version: int):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.kind = kind
+        self.version = version
+        self.file = open(self.tmp_path, 'wb')
+        self.position = 0
+        self.sections: Dict[str, list] = {}
+        self.current: Optional[list] = None  # [name, start, dtype]
+    
+    def __enter__(self) -> 'SectionWriter':
+        return self
+    
+    def __exit__(self, *exc_info):
+        if not self.file.closed:
+            self.file.close()
+            os.remove(self.tmp_path)
+    
+    def add(self, name: str, data: np.ndarray):
+        self.begin(name, data.dtype)
+        self.write(data)
+        self.end()
+    
+    def begin(self, name: str, dtype):
+        self._pad()
+        self.current = [name, self.position, np.dtype(dtype)]
+    
+    def write(self, data, align: bool = False) -> int:
+        """Append to the open section; returns the byte offset of the data in it."""
+        if align:
+            self._pad()
+        offset = self.position - self.current[1]
+        data = data.tobytes() if isinstance(data, np.ndarray) else data
+        self.file.write(data)
+        self.position += len(data)
+        return offset
+    
+    def end(self):
+        name, start, dtype = self.current
+        self.sections[name] = [start, self.position - start, np.lib.format.dtype_to_descr(dtype)]
+        self.current = None
+    
+    def finish(self, fields: Dict[str, any]):
+        footer = json.dumps({
+            'kind': self.kind,
+            'version': self.version,
+            'fields': fields,
+            'sections': self.sections,
+        }).encode('utf-8')
+        self.file.write(footer)
+        self.file.write(TRAILER.pack(len(footer), MAGIC))
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+    
+    def _pad(self):
+        padding = -self.position % ALIGNMENT
+        if padding:
+            self.file.write(bytes(padding))
+            self.position += padding
+
+
+class MappedFile:
+    """A section file opened read-only through mmap."""
+    
+    def __init__(self, path: str, kind: str, version: int):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        if len(self.buffer) < TRAILER.size:
+            raise ValueError(f"{path} is truncated")
+        footer_length, magic = TRAILER.unpack_from(self.buffer, len(self.buffer) - TRAILER.size)
+        if magic != MAGIC or footer_length > len(self.buffer) - TRAILER.size:
+            raise ValueError(f"{path} is not a section file")
+        
+        footer_start = len(self.buffer) - TRAILER.size - footer_length
+        footer = json.loads(self.buffer[footer_start:footer_start + footer_length])
+        if (footer['kind'], footer['version']) != (kind, version):
+            raise ValueError(f"{path} is a {footer['kind']} file of version {footer['version']}, not {kind} {version}")
+        self.fields = footer['fields']
+        self.sections = footer['sections']
+    
+    def array(self, name: str, offset: int = 0, count: int = -1, dtype=None) -> np.ndarray:
+        """
+        Zero-copy, read-only view of a section, or of `count` items of
+        `dtype` at byte `offset` within it.
+        """
+        start, size, descr = self.sections[name]
+        dtype = np.dtype(dtype if dtype is not None else _descr_dtype(descr))
+        if count < 0:
+            count = (size - offset) // dtype.itemsize
+        return np.frombuffer(self.buffer, dtype=dtype, count=count, offset=start + offset)
+    
+    def bytes(self, name: str, start: int, end: int) -> bytes:
+        offset = self.sections[name][0]
+        return self.buffer[offset + start:offset + end]
+
+
+def _descr_dtype(descr) -> np.dtype:
+    # JSON turns the (name, type) tuples of a record dtype into lists
+    return np.dtype(descr if isinstance(descr, str) else [tuple(field) for field in descr])
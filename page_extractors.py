@@ -0,0 +1,332 @@
+import gc
+import hashlib
+import PyPDF2
+import pdfplumber
+import re
+from typing import Dict, List, Optional, Tuple
+from process_memory import MemoryLimitExceeded, current_rss_mb
+
+try:
+    import pypdfium2
+except ImportError:
+    pypdfium2 = None
+
+# Extraction strategies:
+#   pdfplumber - layout-aware extraction of every page (slowest, the default)
+#   fast       - pypdfium2 when installed, else PyPDF2, for every page
+#   adaptive   - fast extractor first, pdfplumber only for pages it scores poorly
+STRATEGIES = ('pdfplumber', 'fast', 'adaptive')
+
+# Replacement characters, private-use glyphs, control characters and
+# unmapped "(cid:NN)" glyph references all mean the text layer was not decoded.
+GARBAGE_PATTERN = re.compile(r'[\ufffd\ue000-\uf8ff\x00-\x08\x0b\x0c\x0e-\x1f]|\(cid:\d+\)')
+
+MAX_GARBAGE_RATIO = 0.05
+MIN_CHAR_DENSITY = 0.2  # visible characters per 1000 square points of page
+MAX_MEAN_WORD_LENGTH = 20  # longer means the extractor dropped the spaces
+
+# extract_metadata() field -> PDF document info key
+METADATA_FIELDS = {
+    'title': 'Title',
+    'author': 'Author',
+    'subject': 'Subject',
+    'creator': 'Creator',
+    'producer': 'Producer',
+    'creation_date': 'CreationDate',
+    'modification_date': 'ModDate',
+}
+
+
+def page_fingerprint(page) -> str:
+    """
+    Hash of what a PyPDF2 page draws: its content streams, the form
+    XObjects they reference (often where running headers live) and the
+    page size. Reading these is far cheaper than extracting the text, so
+    revised uploads can be compared page by page before any extraction.
+    """
+    digest = hashlib.sha1()
+    digest.update(repr([float(value) for value in page.mediabox]).encode())
+    
+    contents = page.get_contents()
+    if contents is not None:
+        digest.update(contents.get_data())
+    
+    resources = page.get('/Resources')
+    xobjects = resources.get_object().get('/XObject') if resources is not None else None
+    if xobjects is not None:
+        xobjects = xobjects.get_object()
+        for name in sorted(xobjects):
+            xobject = xobjects[name].get_object()
+            if xobject.get('/Subtype') == '/Form':
+                digest.update(name.encode())
+                digest.update(xobject.get_data())
+    
+    return digest.hexdigest()
+
+
+def score_page_text(text: str, page_area: float) -> Dict[str, float]:
+    """Cheap quality signals for one page of extracted text."""
+    visible = len(text) - sum(1 for char in text if char.isspace())
+    words = len(text.split())
+    garbage = sum(len(match.group()) for match in GARBAGE_PATTERN.finditer(text))
+    
+    return {
+        'chars': visible,
+        'density': visible / (page_area / 1000) if page_area else 0.0,
+        'garbage_ratio': garbage / visible if visible else 1.0,
+        'mean_word_length': visible / words if words else 0.0,
+    }
+
+
+def is_low_quality(scores: Dict[str, float]) -> bool:
+    return (
+        scores['chars'] == 0
+        or scores['density'] < MIN_CHAR_DENSITY
+        or scores['garbage_ratio'] > MAX_GARBAGE_RATIO
+        or scores['mean_word_length'] > MAX_MEAN_WORD_LENGTH
+    )
+
+
+class PageExtractor:
+    """
+    Per-page access to every extraction backend for one PDF.
+    Backends are opened on first use, so a strategy that never needs
+    pdfplumber never pays for parsing the document with it. `stats` counts
+    which backend produced each page.
+    """
+    
+    def __init__(self, pdf_path: str, strategy: str = 'pdfplumber'):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown extraction strategy: {strategy}")
+        
+        self.pdf_path = pdf_path
+        self.strategy = strategy
+        self.stats = {'fast': 0, 'pdfplumber': 0, 'pypdf2': 0, 'failed': 0}
+        self._plumber = None
+        self._plumber_error = None
+        self._reader = None
+        self._pdfium = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def close(self):
+        if self._plumber is not None:
+            self._plumber.close()
+            self._plumber = None
+        if self._pdfium is not None:
+            self._pdfium.close()
+            self._pdfium = None
+        self._reader = None
+    
+    @property
+    def num_pages(self) -> int:
+        """Page count from the backend the strategy reads pages with, so no extra parse is needed."""
+        if self.strategy == 'pdfplumber':
+            pdf = self._open_plumber()
+            if pdf is not None:
+                return len(pdf.pages)
+        elif pypdfium2 is not None:
+            try:
+                return len(self._open_pdfium())
+            except Exception as e:
+                print(f"pypdfium2 failed: {e}. Trying PyPDF2...")
+        
+        try:
+            return len(self._open_reader().pages)
+        except Exception as e:
+            pdf = self._open_plumber() if self.strategy != 'pdfplumber' else None
+            if pdf is None:
+                raise Exception(f"Both PDF extraction methods failed: {e}")
+            return len(pdf.pages)
+    
+    def metadata(self) -> Dict[str, any]:
+        """
+        Document info in the extract_metadata() format, read from a backend
+        that is already open rather than parsing the file again.
+        """
+        info = {}
+        try:
+            if self._plumber is not None:
+                info = self._plumber.metadata or {}
+            elif self._pdfium is not None:
+                info = self._pdfium.get_metadata_dict()
+            else:
+                info = {key.lstrip('/'): value for key, value in (self._open_reader().metadata or {}).items()}
+        except Exception as e:
+            print(f"Error extracting metadata: {e}")
+        
+        # Every field is present, '' when the PDF does not set it, whichever
+        # backend the document info came from
+        metadata = {
+            field: value if isinstance(value, str) else str(value)
+            for field, value in ((field, info.get(key, '')) for field, key in METADATA_FIELDS.items())
+        }
+        
+        try:
+            metadata['num_pages'] = self.num_pages
+        except Exception as e:
+            print(f"Error extracting metadata: {e}")
+        
+        return metadata
+    
+    def _open_plumber(self):
+        if self._plumber is None and self._plumber_error is None:
+            try:
+                self._plumber = pdfplumber.open(self.pdf_path)
+            except Exception as e:
+                print(f"pdfplumber failed: {e}. Trying PyPDF2...")
+                self._plumber_error = e
+        return self._plumber
+    
+    def _open_pdfium(self):
+        if self._pdfium is None:
+            self._pdfium = pypdfium2.PdfDocument(self.pdf_path)
+        return self._pdfium
+    
+    def _open_reader(self):
+        if self._reader is None:
+            self._reader = PyPDF2.PdfReader(self.pdf_path)
+        return self._reader
+    
+    def fingerprint(self, page_no: int) -> Optional[str]:
+        """page_fingerprint() of one page, or None if PyPDF2 cannot read it."""
+        try:
+            return page_fingerprint(self._open_reader().pages[page_no])
+        except Exception as e:
+            print(f"Error fingerprinting page {page_no + 1}: {e}")
+            return None
+    
+    def fingerprints(self) -> List[Optional[str]]:
+        """fingerprint() of every page, in page order."""
+        return [self.fingerprint(page_no) for page_no in range(len(self._open_reader().pages))]
+    
+    def plumber(self, page_no: int) -> str:
+        pdf = self._open_plumber()
+        if pdf is None:
+            raise self._plumber_error
+        
+        page = pdf.pages[page_no]
+        try:
+            return page.extract_text() or ""
+        finally:
+            # Each page keeps its parsed characters and layout cached for as
+            # long as the document is open; pages are never revisited, so
+            # drop them now instead of holding every page until close()
+            page.close()
+    
+    def pypdf2(self, page_no: int) -> Tuple[str, float]:
+        page = self._open_reader().pages[page_no]
+        return page.extract_text() or "", float(page.mediabox.width * page.mediabox.height)
+    
+    def fast(self, page_no: int) -> Tuple[str, float]:
+        """Fastest available backend: pypdfium2 if installed, else PyPDF2."""
+        if pypdfium2 is None:
+            return self.pypdf2(page_no)
+        
+        page = self._open_pdfium()[page_no]
+        try:
+            textpage = page.get_textpage()
+            try:
+                text = textpage.get_text_bounded()
+            finally:
+                textpage.close()
+            width, height = page.get_size()
+        finally:
+            page.close()
+        
+        return text, width * height
+    
+    def extract(self, page_no: int) -> str:
+        """Raw text of one page using the configured strategy and its fallbacks."""
+        if self.strategy == 'pdfplumber':
+            return self._extract_plumber(page_no)
+        
+        try:
+            text, page_area = self.fast(page_no)
+        except Exception as e:
+            print(f"Fast extraction failed on page {page_no + 1}: {e}. Trying pdfplumber...")
+            return self._extract_plumber(page_no)
+        
+        if self.strategy == 'fast' or not is_low_quality(score_page_text(text, page_area)):
+            self.stats['fast'] += 1
+            return text
+        
+        return self._extract_plumber(page_no)
+    
+    def _extract_plumber(self, page_no: int) -> str:
+        try:
+            text = self.plumber(page_no)
+            self.stats['pdfplumber'] += 1
+            return text
+        except Exception as e:
+            if self._plumber is not None:
+                print(f"pdfplumber failed on page {page_no + 1}: {e}. Trying PyPDF2...")
+        
+        try:
+            text = self.pypdf2(page_no)[0]
+            self.stats['pypdf2'] += 1
+            return text
+        except Exception as e2:
+            if self._plumber is None and self._reader is None:
+                raise Exception(f"Both PDF extraction methods failed: {e2}")
+            print(f"Both PDF extraction methods failed on page {page_no + 1}: {e2}")
+            self.stats['failed'] += 1
+            return ""
+
+
+def extract_page_range(
+    pdf_path: str,
+    start: int = 0,
+    end: Optional[int] = None,
+    strategy: str = 'pdfplumber',
+    info: Optional[Dict] = None,
+    max_rss_mb: int = 0,
+    recycle_pages: int = 0,
+    page_hashes: Optional[List[Optional[str]]] = None
+):
+    """
+    Yield the raw text of pages [start, end) in page order.
+    If an `info` dict is passed, it is filled with the document metadata
+    once the last page is read, from the same open document, and if a
+    `page_hashes` list is passed, the fingerprint of every page is appended
+    to it as the page is read.
+    
+    The parsers also cache document-level objects for as long as the file
+    is open. With recycle_pages the document is re-opened after that many
+    pages, and with max_rss_mb it is re-opened whenever the process grows
+    past the ceiling; if that does not bring it back under, the extraction
+    fails with MemoryLimitExceeded rather than running out of memory.
+    """
+    with PageExtractor(pdf_path, strategy) as extractor:
+        end = extractor.num_pages if end is None else end
+        since_open = 0
+        
+        for page_no in range(start, end):
+            text = extractor.extract(page_no)
+            if page_hashes is not None:
+                page_hashes.append(extractor.fingerprint(page_no))
+            yield text
+            since_open += 1
+            
+            if recycle_pages and since_open >= recycle_pages:
+                extractor.close()
+                since_open = 0
+            
+            if max_rss_mb and current_rss_mb() > max_rss_mb:
+                extractor.close()
+                gc.collect()
+                since_open = 0
+                
+                rss = current_rss_mb()
+                if rss > max_rss_mb:
+                    raise MemoryLimitExceeded(
+                        f"Extraction uses {rss:.0f} MB after page {page_no + 1}, above the {max_rss_mb} MB limit"
+                    )
+        
+        if info is not None:
+            info.update(extractor.metadata())
+
@@ -0,0 +1,234 @@
+"""
+Per-page time budgets for PDF extraction.
+
+Pages are extracted in child processes that the parent can kill, since a
+thread stuck inside a parser cannot be interrupted. A page that runs past
+its budget gets its worker killed and is retried once with the fast
+extractor in a fresh worker; if that also overruns, the page is skipped.
+Each page therefore costs at most two budgets plus a worker start, so the
+time to extract a document is bounded by its page count.
+"""
+import multiprocessing
+import time
+from collections import deque
+from multiprocessing.connection import wait
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from page_extractors import PageExtractor
+from process_memory import current_rss_mb
+
+# Ranges queued ahead of the page being yielded, per worker
+TASKS_IN_FLIGHT_PER_WORKER = 2
+# Keys of WatchedExtraction.report(): pages whose text is missing or came
+# from the fast extractor
+REPORT_KEYS = ('timed_out_pages', 'crashed_pages', 'skipped_pages')
+
+
+def _worker_main(conn, pdf_path: str, strategy: str):
+    """
+    Child process loop: receive lists of (page_no, fast) and send back
+    (page_no, text, fingerprint, error, rss_mb) for every page as soon as
+    it is done.
+    """
+    extractor = PageExtractor(pdf_path, strategy)
+    fallback = None
+    
+    try:
+        while True:
+            task = conn.recv()
+            if task is None:
+                break
+            
+            for page_no, fast in task:
+                if fast:
+                    fallback = fallback or PageExtractor(pdf_path, 'fast')
+                page_extractor = fallback if fast else extractor
+                try:
+                    text, error = page_extractor.extract(page_no), None
+                except Exception as e:
+                    text, error = "", str(e)
+                conn.send((page_no, text, page_extractor.fingerprint(page_no), error, current_rss_mb()))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        extractor.close()
+        if fallback is not None:
+            fallback.close()
+
+
+class _Worker:
+    def __init__(self, context, pdf_path: str, strategy: str):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn, pdf_path, strategy), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        
+        self.pages = deque()  # (page_no, fast) sent but not answered yet
+        self.page_started = None  # when the page at the head of `pages` started
+        self.done = 0
+    
+    def assign(self, pages: List[Tuple[int, bool]]):
+        if not self.pages:
+            self.page_started = time.monotonic()
+        self.pages.extend(pages)
+        self.conn.send(pages)
+    
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=1)
+        self.kill()
+    
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class WatchedExtraction:
+    """
+    Extract pages [start, end) of a PDF in watched worker processes.
+    Pages are yielded in order. Afterwards `timed_out_pages` lists the
+    (1-based) pages that overran their budget and `crashed_pages` those
+    that killed their worker; both were retried with the fast extractor.
+    `skipped_pages` lists those that produced no text because the retry
+    overran, crashed or failed as well. `page_hashes` maps the pages read
+    to their fingerprints, taken by the workers from the open document.
+    """
+    
+    def __init__(
+        self,
+        pdf_path: str,
+        strategy: str = 'pdfplumber',
+        page_timeout: float = 30,
+        workers: int = 1,
+        task_size: int = 25,
+        max_rss_mb: int = 0,
+        recycle_pages: int = 0
+    ):
+        self.pdf_path = pdf_path
+        self.strategy = strategy
+        self.page_timeout = page_timeout
+        self.workers = max(workers, 1)
+        self.task_size = max(task_size, 1)
+        self.max_rss_mb = max_rss_mb
+        self.recycle_pages = recycle_pages
+        self.timed_out_pages: List[int] = []
+        self.crashed_pages: List[int] = []
+        self.page_hashes: Dict[int, Optional[str]] = {}
+        self.skipped_pages: List[int] = []
+        self._context = multiprocessing.get_context()
+    
+    def report(self) -> Dict[str, List[int]]:
+        """Pages that needed the watchdog, for the document's metadata."""
+        report = {}
+        if self.timed_out_pages:
+            report['timed_out_pages'] = sorted(self.timed_out_pages)
+        if self.crashed_pages:
+            report['crashed_pages'] = sorted(self.crashed_pages)
+        if self.skipped_pages:
+            report['skipped_pages'] = sorted(self.skipped_pages)
+        return report
+    
+    def iter_pages(self, start: int, end: int) -> Iterator[str]:
+        return self.iter_selected_pages(range(start, end))
+    
+    def iter_selected_pages(self, page_nos: Iterable[int]) -> Iterator[str]:
+        """Yield the raw text of the given pages, in the order given."""
+        page_nos = list(page_nos)
+        # (position of the first page in page_nos, [(page_no, fast), ...])
+        tasks = deque(
+            (position, [(page_no, False) for page_no in page_nos[position:position + self.task_size]])
+            for position in range(0, len(page_nos), self.task_size)
+        )
+        workers = []
+        results = {}
+        position = 0
+        
+        def assign_next(worker: _Worker):
+            # Stay a bounded distance ahead of the page being yielded, so a
+            # slow page does not let finished text pile up behind it
+            horizon = position + self.workers * TASKS_IN_FLIGHT_PER_WORKER * self.task_size
+            if tasks and tasks[0][0] < horizon:
+                worker.assign(tasks.popleft()[1])
+        
+        def replace(worker: _Worker, retry: List[Tuple[int, bool]]):
+            worker.kill()
+            workers.remove(worker)
+            replacement = _Worker(self._context, self.pdf_path, self.strategy)
+            workers.append(replacement)
+            if retry:
+                replacement.assign(retry)
+            else:
+                assign_next(replacement)
+        
+        def handle_overrun(worker: _Worker, reason: str, crashed: bool = False):
+            page_no, fast = worker.pages.popleft()
+            if fast:
+                print(f"Page {page_no + 1} {reason} again with the fast extractor; skipping it")
+                self.skipped_pages.append(page_no + 1)
+                results[page_no] = ""
+                retry = list(worker.pages)
+            else:
+                print(f"Page {page_no + 1} {reason}; retrying with the fast extractor")
+                (self.crashed_pages if crashed else self.timed_out_pages).append(page_no + 1)
+                retry = [(page_no, True)] + list(worker.pages)
+            replace(worker, retry)
+        
+        try:
+            for _ in range(min(self.workers, len(tasks))):
+                worker = _Worker(self._context, self.pdf_path, self.strategy)
+                workers.append(worker)
+                assign_next(worker)
+            
+            while position < len(page_nos):
+                while position < len(page_nos) and page_nos[position] in results:
+                    yield results.pop(page_nos[position])
+                    position += 1
+                if position >= len(page_nos):
+                    break
+                
+                for worker in workers:
+                    if not worker.pages:
+                        assign_next(worker)
+                
+                busy = [worker for worker in workers if worker.pages]
+                now = time.monotonic()
+                timeout = max(0.0, min(worker.page_started + self.page_timeout - now for worker in busy))
+                ready = wait([worker.conn for worker in busy], timeout=timeout)
+                
+                for worker in busy:
+                    if worker.conn not in ready:
+                        if time.monotonic() - worker.page_started > self.page_timeout:
+                            handle_overrun(worker, f"exceeded the {self.page_timeout}s time limit")
+                        continue
+                    
+                    try:
+                        page_no, text, page_hash, error, rss_mb = worker.conn.recv()
+                    except (EOFError, OSError):
+                        # The worker died mid-page, e.g. a parser crash
+                        handle_overrun(worker, "crashed the extractor", crashed=True)
+                        continue
+                    
+                    if error:
+                        print(f"Both PDF extraction methods failed on page {page_no + 1}: {error}")
+                        if worker.pages[0][1]:
+                            self.skipped_pages.append(page_no + 1)
+                    
+                    worker.pages.popleft()
+                    worker.page_started = time.monotonic()
+                    worker.done += 1
+                    results[page_no] = text
+                    self.page_hashes[page_no] = page_hash
+                    
+                    over_memory = self.max_rss_mb and rss_mb > self.max_rss_mb
+                    if over_memory or (self.recycle_pages and worker.done >= self.recycle_pages):
+                        # A fresh process is the only sure way to give the memory back
+                        replace(worker, list(worker.pages))
+        finally:
+            for worker in workers:
+                worker.stop()
@@ -1,36 +1,447 @@
-import PyPDF2
-import pdfplumber
-from typing import List, Dict
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Iterable, Iterator, Optional, Tuple
+import os
 import re
 from config import Config
+from boilerplate import BoilerplateFilter
+from chunk_store import iter_text_chunks
+from extraction_cache import ExtractionCache, hash_file
+from page_extractors import PageExtractor, extract_page_range
+from page_watchdog import REPORT_KEYS, WatchedExtraction
+from text_segmentation import count_words
+
+# Bump when extraction or cleaning output changes so cached text is not reused
+EXTRACTOR_VERSION = 2
+CLEANER_VERSION = 1
+
+# Pages per task handed to a worker; small enough to balance load across
+# workers, large enough that re-opening the PDF in each task stays cheap.
+PAGES_PER_TASK = 25
+TASKS_IN_FLIGHT_PER_WORKER = 2
+
+# Keys iter_pages() adds to its `info` dict next to the document metadata:
+# the [start, end) range of every page in the joined text, and the
+# fingerprint of every page (see page_extractors.page_fingerprint)
+PAGE_TABLE_KEYS = ('page_offsets', 'page_hashes')
+
+_extraction_pool = None
+_extraction_pool_settings = None
+
+
+def get_extraction_pool(workers: int, max_tasks_per_child: Optional[int] = None) -> ProcessPoolExecutor:
+    """
+    Return the shared extraction pool, creating it on first use.
+    The pool lives for the whole process so uploads after the first one
+    do not pay the worker start-up cost again. With max_tasks_per_child,
+    each worker is replaced after that many tasks, which returns whatever
+    memory the parsers held on to.
+    """
+    global _extraction_pool, _extraction_pool_settings
+    
+    if _extraction_pool is None or _extraction_pool_settings != (workers, max_tasks_per_child):
+        if _extraction_pool is not None:
+            _extraction_pool.shutdown(wait=False)
+        
+        _extraction_pool = ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=max_tasks_per_child)
+        _extraction_pool_settings = (workers, max_tasks_per_child)
+        
+        # Start every worker now rather than on the first upload; recycled
+        # workers would count the warm-up against their task allowance
+        if max_tasks_per_child is None:
+            for future in [_extraction_pool.submit(_warm_up_worker) for _ in range(workers)]:
+                future.result()
+    
+    return _extraction_pool
+
+
+def shutdown_extraction_pool():
+    """Stop the shared extraction pool, if one was started."""
+    global _extraction_pool, _extraction_pool_settings
+    
+    if _extraction_pool is not None:
+        _extraction_pool.shutdown(wait=True)
+        _extraction_pool = None
+        _extraction_pool_settings = None
+
+
+def _warm_up_worker() -> bool:
+    return True
+
+
+def shared_page_ratio(previous_hashes: List[Optional[str]], page_hashes: List[Optional[str]]) -> float:
+    """
+    Share of pages two versions of a document have in common, by
+    fingerprint, out of the pages of the longer one.
+    """
+    previous = Counter(page_hash for page_hash in previous_hashes if page_hash)
+    current = Counter(page_hash for page_hash in page_hashes if page_hash)
+    longest = max(len(previous_hashes), len(page_hashes))
+    return sum((previous & current).values()) / longest if longest else 0.0
+
+
+def _read_document_info(pdf_path: str) -> Dict[str, any]:
+    """Metadata and page count from the cheapest backend, without extracting any text."""
+    with PageExtractor(pdf_path, 'fast') as extractor:
+        metadata = extractor.metadata()
+    
+    if 'num_pages' not in metadata:
+        raise Exception(f"Could not read page count of {pdf_path}")
+    return metadata
+
+
+def _count_pages(pdf_path: str) -> int:
+    return _read_document_info(pdf_path)['num_pages']
+
+
+def _iter_page_range(
+    pdf_path: str,
+    start: int = 0,
+    end: Optional[int] = None,
+    strategy: str = 'pdfplumber',
+    info: Optional[Dict] = None,
+    max_rss_mb: int = 0,
+    recycle_pages: int = 0,
+    page_hashes: Optional[List[Optional[str]]] = None
+) -> Iterator[str]:
+    """
+    Yield the raw text of pages [start, end) in page order.
+    Pages the chosen extractor cannot handle are retried one at a time
+    with the next backend (see page_extractors.PageExtractor).
+    """
+    return extract_page_range(pdf_path, start, end, strategy, info, max_rss_mb, recycle_pages, page_hashes)
+
+
+def _extract_page_range(
+    pdf_path: str,
+    start: int = 0,
+    end: Optional[int] = None,
+    strategy: str = 'pdfplumber',
+    max_rss_mb: int = 0
+) -> Tuple[List[str], List[Optional[str]]]:
+    """Pool entry point: extract pages [start, end) and return them with their fingerprints."""
+    page_hashes = []
+    pages = list(_iter_page_range(pdf_path, start, end, strategy, max_rss_mb=max_rss_mb, page_hashes=page_hashes))
+    return pages, page_hashes
+
 
 class PDFProcessor:
-    def __init__(self, chunk_size: int = None, chunk_overlap: int = None):
+    def __init__(
+        self,
+        chunk_size: int = None,
+        chunk_overlap: int = None,
+        workers: int = None,
+        use_cache: bool = True,
+        chunk_unit: str = None,
+        strategy: str = None,
+        max_rss_mb: int = None,
+        recycle_pages: int = None,
+        page_timeout: float = None,
+        strip_boilerplate: bool = None
+    ):
         self.chunk_size = chunk_size or Config.MAX_CHUNK_SIZE
         self.chunk_overlap = chunk_overlap or Config.CHUNK_OVERLAP
+        if self.chunk_overlap >= self.chunk_size:
+            raise ValueError(f"Chunk overlap ({self.chunk_overlap}) must be smaller than the chunk size ({self.chunk_size})")
+        self.chunk_unit = chunk_unit or Config.CHUNK_UNIT
+        self.workers = workers or Config.EXTRACTION_WORKERS
+        self.strategy = strategy or Config.EXTRACTION_STRATEGY
+        self.max_rss_mb = Config.EXTRACTION_MAX_RSS_MB if max_rss_mb is None else max_rss_mb
+        self.recycle_pages = Config.EXTRACTION_RECYCLE_PAGES if recycle_pages is None else recycle_pages
+        self.page_timeout = Config.EXTRACTION_PAGE_TIMEOUT if page_timeout is None else page_timeout
+        self.strip_boilerplate = Config.STRIP_BOILERPLATE if strip_boilerplate is None else strip_boilerplate
+        self.cache = None
+        
+        if use_cache:
+            cleaner = f"cleaner-{CLEANER_VERSION}" + ("-boilerplate" if self.strip_boilerplate else "")
+            self.cache = ExtractionCache(
+                os.path.join(Config.CACHE_FOLDER, 'extraction'),
+                version=f"extractor-{EXTRACTOR_VERSION}-{self.strategy}:{cleaner}"
+            )
+    
+    def settings(self) -> Dict[str, any]:
+        """Constructor arguments that rebuild this processor, e.g. in a worker process."""
+        return {
+            'chunk_size': self.chunk_size,
+            'chunk_overlap': self.chunk_overlap,
+            'workers': self.workers,
+            'use_cache': self.cache is not None,
+            'chunk_unit': self.chunk_unit,
+            'strategy': self.strategy,
+            'max_rss_mb': self.max_rss_mb,
+            'recycle_pages': self.recycle_pages,
+            'page_timeout': self.page_timeout,
+            'strip_boilerplate': self.strip_boilerplate,
+        }
+    
+    def content_hash(self, pdf_path: str) -> str:
+        """Hash of the PDF bytes, used to recognise re-uploads of the same file."""
+        return self.cache.content_hash(pdf_path) if self.cache else hash_file(pdf_path)
+    
+    def is_cached(self, pdf_path: str) -> bool:
+        return self.cache is not None and self.cache.contains(pdf_path)
     
     def extract_text_from_pdf(self, pdf_path: str) -> str:
-        text = ""
+        return ' '.join(page_text for page_text in self.iter_pages(pdf_path) if page_text)
+    
+    def iter_raw_pages(self, pdf_path: str, info: Optional[Dict] = None) -> Iterator[str]:
+        """
+        Yield raw text for every page, in page order.
+        With more than one worker, page ranges are spread over the shared
+        process pool and yielded as soon as the next range in order is done.
+        An `info` dict is filled with the document metadata (see
+        extract_metadata) and the fingerprint of every page (see
+        page_extractors.page_fingerprint), read from the documents the
+        pages were extracted from rather than opening the PDF again.
+        
+        With a page_timeout, pages are extracted in watched worker processes
+        (see page_watchdog) and `info` also lists the pages that overran.
+        Those are started for each document rather than taken from the
+        pool, which is why the time limit is off by default.
+        """
+        if self.page_timeout:
+            yield from self._iter_watched_pages(pdf_path, info)
+            return
+        
+        page_hashes = []
+        if self.workers <= 1:
+            yield from _iter_page_range(
+                pdf_path, strategy=self.strategy, info=info,
+                max_rss_mb=self.max_rss_mb, recycle_pages=self.recycle_pages, page_hashes=page_hashes
+            )
+            if info is not None:
+                info['page_hashes'] = page_hashes
+            return
+        
+        document_info = _read_document_info(pdf_path)
+        if info is not None:
+            info.update(document_info)
+        
+        num_pages = document_info['num_pages']
+        
+        # Short documents are split evenly so every worker gets a share
+        task_size = max(1, min(PAGES_PER_TASK, -(-num_pages // self.workers)))
+        tasks_per_child = max(1, self.recycle_pages // task_size) if self.recycle_pages else None
+        pool = get_extraction_pool(self.workers, tasks_per_child)
+        
+        # Only a few ranges are queued per worker, so finished pages the
+        # caller has not consumed yet do not pile up on large documents
+        starts = iter(range(0, num_pages, task_size))
+        futures = deque()
+        
+        def submit_next():
+            start = next(starts, None)
+            if start is not None:
+                futures.append(pool.submit(
+                    _extract_page_range, pdf_path, start, min(start + task_size, num_pages),
+                    self.strategy, self.max_rss_mb
+                ))
+        
+        for _ in range(self.workers * TASKS_IN_FLIGHT_PER_WORKER):
+            submit_next()
+        
+        while futures:
+            pages, range_hashes = futures.popleft().result()
+            submit_next()
+            page_hashes.extend(range_hashes)
+            yield from pages
+        
+        if info is not None:
+            info['page_hashes'] = page_hashes
+    
+    def _iter_watched_pages(self, pdf_path: str, info: Optional[Dict] = None) -> Iterator[str]:
+        document_info = _read_document_info(pdf_path)
+        num_pages = document_info['num_pages']
+        
+        watched = WatchedExtraction(
+            pdf_path,
+            strategy=self.strategy,
+            page_timeout=self.page_timeout,
+            workers=self.workers,
+            task_size=max(1, min(PAGES_PER_TASK, -(-num_pages // self.workers))),
+            max_rss_mb=self.max_rss_mb,
+            recycle_pages=self.recycle_pages
+        )
+        yield from watched.iter_pages(0, num_pages)
+        
+        if info is not None:
+            info.update(document_info)
+            info.update(watched.report())
+            info['page_hashes'] = [watched.page_hashes.get(page_no) for page_no in range(num_pages)]
+    
+    def iter_pages(self, pdf_path: str, info: Optional[Dict] = None) -> Iterator[str]:
+        """
+        Yield cleaned text page by page. Blank pages are yielded as empty
+        strings so the position of each item is its page number. An `info`
+        dict is filled with the document metadata and the page table (see
+        PAGE_TABLE_KEYS) once all pages are read. With strip_boilerplate,
+        the metadata also reports the header/footer lines that were removed
+        and how much text they made up.
+        """
+        entry = self.cache.get(pdf_path) if self.cache else None
+        # Entries written before pages were fingerprinted are extracted
+        # again, which records the fingerprints
+        if entry is not None and entry.get('page_hashes') is not None:
+            yield from self.cache.iter_pages(entry)
+            if info is not None:
+                info.update(entry['metadata'])
+                info['page_offsets'] = entry['pages']
+                info['page_hashes'] = entry['page_hashes']
+            return
+        
+        metadata = {}
+        yield from self._write_pages(
+            pdf_path,
+            self._clean_pages(self.iter_raw_pages(pdf_path, metadata), metadata),
+            metadata,
+            info
+        )
+    
+    def iter_revised_pages(
+        self,
+        pdf_path: str,
+        previous: Dict,
+        info: Optional[Dict] = None,
+        page_hashes: Optional[List[Optional[str]]] = None
+    ) -> Iterator[str]:
+        """
+        Like iter_pages() for a new revision of a document whose cleaned
+        pages, page fingerprints and boilerplate lines are already known
+        (see RAGManager.document_pages). Only pages whose fingerprint is not
+        among the previous ones are extracted; the others reuse the previous
+        text, wherever they moved to. `info` also gets the 1-based numbers of
+        the extracted pages as 'changed_pages'. Pass `page_hashes` if the
+        new fingerprints are already known (see page_fingerprints).
+        """
+        if self.is_cached(pdf_path):
+            yield from self.iter_pages(pdf_path, info)
+            if info is not None:
+                info['changed_pages'] = []
+            return
+        
+        # One open document serves the fingerprints, the metadata and the
+        # changed pages
+        with PageExtractor(pdf_path, self.strategy) as extractor:
+            page_hashes = page_hashes or extractor.fingerprints()
+            # Pages that could not be fingerprinted are always extracted
+            known = {
+                page_hash: page for page_hash, page in zip(previous['hashes'], previous['pages']) if page_hash
+            }
+            changed = [page_no for page_no, page_hash in enumerate(page_hashes) if page_hash not in known]
+            
+            metadata = extractor.metadata()
+            # Changed pages alone are too few to learn headers from, so they
+            # are stripped of the lines already found on the previous revision
+            extracted = self._clean_pages(
+                self._iter_selected_pages(extractor, changed, metadata),
+                {},
+                previous.get('boilerplate')
+            )
+            if self.strip_boilerplate:
+                metadata['boilerplate_lines'] = previous.get('boilerplate') or []
+            pages = (
+                known[page_hash] if page_hash in known else next(extracted)
+                for page_hash in page_hashes
+            )
+            
+            yield from self._write_pages(pdf_path, pages, metadata, info, page_hashes)
+        if info is not None:
+            info['changed_pages'] = [page_no + 1 for page_no in changed]
+    
+    def page_fingerprints(self, pdf_path: str) -> List[Optional[str]]:
+        """
+        Fingerprint of every page (see page_extractors.page_fingerprint),
+        from the extraction cache when it has them, else read without
+        extracting any text.
+        """
+        entry = self.cache.get(pdf_path) if self.cache else None
+        if entry is not None and entry.get('page_hashes') is not None:
+            return entry['page_hashes']
+        
+        with PageExtractor(pdf_path, self.strategy) as extractor:
+            return extractor.fingerprints()
+    
+    def _iter_selected_pages(self, extractor: PageExtractor, page_nos: List[int], info: Dict) -> Iterator[str]:
+        """Raw text of the given pages, in order, under the page time limit if one is set."""
+        if not self.page_timeout:
+            for page_no in page_nos:
+                yield extractor.extract(page_no)
+            return
+        
+        watched = WatchedExtraction(
+            extractor.pdf_path,
+            strategy=self.strategy,
+            page_timeout=self.page_timeout,
+            max_rss_mb=self.max_rss_mb,
+            recycle_pages=self.recycle_pages
+        )
+        yield from watched.iter_selected_pages(page_nos)
+        info.update(watched.report())
+    
+    def _write_pages(
+        self,
+        pdf_path: str,
+        pages: Iterable[str],
+        metadata: Dict,
+        info: Optional[Dict],
+        page_hashes: Optional[List[str]] = None
+    ) -> Iterator[str]:
+        """
+        Pass cleaned pages through while building the page table and, with
+        the cache on, its entry; the entry is only committed if the whole
+        document was read, and none of it was left to the watchdog's
+        fallback (see page_watchdog.REPORT_KEYS), so those pages are tried
+        again on the next upload.
+        """
+        writer = self.cache.writer(pdf_path) if self.cache else None
+        page_offsets = []
+        length = 0
         
         try:
-            with pdfplumber.open(pdf_path) as pdf:
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n\n"
-        except Exception as e:
-            print(f"pdfplumber failed: {e}. Trying PyPDF2...")
-            try:
-                with open(pdf_path, 'rb') as file:
-                    pdf_reader = PyPDF2.PdfReader(file)
-                    for page in pdf_reader.pages:
-                        page_text = page.extract_text()
-                        if page_text:
-                            text += page_text + "\n\n"
-            except Exception as e2:
-                raise Exception(f"Both PDF extraction methods failed: {e2}")
-        
-        return self._clean_text(text)
+            for page_text in pages:
+                # Joined with single spaces, as in extract_text_from_pdf()
+                if page_text and length:
+                    length += 1
+                page_offsets.append([length, length + len(page_text)])
+                length += len(page_text)
+                
+                if writer is not None:
+                    writer.add_page(page_text)
+                yield page_text
+            
+            # Fingerprints taken while the pages were extracted (see iter_raw_pages)
+            page_hashes = page_hashes or metadata.pop('page_hashes', None)
+            if writer is not None:
+                if any(metadata.get(key) for key in REPORT_KEYS):
+                    writer.discard()
+                else:
+                    writer.commit(metadata, page_hashes)
+        except BaseException:
+            if writer is not None:
+                writer.discard()
+            raise
+        
+        if info is not None:
+            info.update(metadata)
+            info['page_offsets'] = page_offsets
+            info['page_hashes'] = page_hashes
+    
+    def _clean_pages(
+        self,
+        raw_pages: Iterable[str],
+        metadata: Dict,
+        boilerplate_lines: Optional[List[str]] = None
+    ) -> Iterator[str]:
+        """Clean raw pages, removing boilerplate first if enabled, and report it in `metadata`."""
+        if not self.strip_boilerplate:
+            for page_text in raw_pages:
+                yield self._clean_text(page_text)
+            return
+        
+        boilerplate = BoilerplateFilter(boilerplate_lines)
+        for page_text in boilerplate.filter(raw_pages):
+            yield self._clean_text(page_text)
+        metadata.update(boilerplate.report())
     
     def _clean_text(self, text: str) -> str:
         text = re.sub(r'\n\s*\n+', '\n\n', text)
@@ -40,58 +451,79 @@ class PDFProcessor:
         return text
     
     def chunk_text(self, text: str) -> List[Dict[str, any]]:
-        words = text.split()
-        chunks = []
-        
-        for i in range(0, len(words), self.chunk_size - self.chunk_overlap):
-            chunk_words = words[i:i + self.chunk_size]
-            chunk_text = ' '.join(chunk_words)
-            
-            chunks.append({
-                'text': chunk_text,
-                'start_index': i,
-                'end_index': i + len(chunk_words),
-                'word_count': len(chunk_words)
-            })
-            
-            if i + self.chunk_size >= len(words):
-                break
+        return list(self.iter_chunks_from_pages([text]))
+    
+    def iter_chunks(self, pdf_path: str, info: Optional[Dict] = None) -> Iterator[Dict[str, any]]:
+        """
+        Extract, clean and chunk a PDF incrementally, one page at a time.
+        `info` is filled as in iter_pages() once the last chunk is read.
+        """
+        return self.iter_chunks_from_pages(self.iter_pages(pdf_path, info))
+    
+    def iter_chunks_from_pages(self, pages: Iterable[str]) -> Iterator[Dict[str, any]]:
+        """
+        Chunk a stream of cleaned page texts with a sliding window of words,
+        or of tokens when chunk_unit is 'tokens'. Overlap is carried across
+        page boundaries, and only the current window is held in memory, so
+        the output matches chunk_text() on the joined text without ever
+        building the whole document.
+        """
+        return iter_text_chunks(pages, self.chunk_size, self.chunk_overlap, self.chunk_unit)
+    
+    def analyze_document(self, pdf_path: str) -> Dict[str, any]:
+        """
+        Text, metadata, page count and page table of a PDF from a single
+        open of the file. `page_offsets` holds the [start, end) character
+        range of every page in `text`, so positions can be mapped back to
+        page numbers later without extracting again.
+        """
+        info = {}
+        pages = list(self.iter_pages(pdf_path, info))
+        metadata = {key: value for key, value in info.items() if key not in PAGE_TABLE_KEYS}
         
-        return chunks
+        return {
+            'text': ' '.join(page_text for page_text in pages if page_text),
+            'pages': pages,
+            'metadata': metadata,
+            'num_pages': metadata.get('num_pages', len(pages)),
+            'page_offsets': info['page_offsets'],
+            'page_hashes': info['page_hashes'],
+        }
     
     def process_pdf(self, pdf_path: str) -> Dict[str, any]:
-        text = self.extract_text_from_pdf(pdf_path)
-        chunks = self.chunk_text(text)
+        cache_hit = self.is_cached(pdf_path)
+        document = self.analyze_document(pdf_path)
+        pages = document['pages']
         
-        return {
-            'full_text': text,
+        chunks = list(self.iter_chunks_from_pages(pages))
+        total_units = chunks[-1]['end_index'] if chunks else 0
+        
+        result = {
+            'full_text': document['text'],
             'chunks': chunks,
             'total_chunks': len(chunks),
-            'total_words': len(text.split()),
-            'source_file': pdf_path
+            'total_words': total_units if self.chunk_unit == 'words' else sum(count_words(page) for page in pages),
+            'source_file': pdf_path,
+            'content_hash': self.content_hash(pdf_path),
+            'metadata': document['metadata'],
+            'num_pages': document['num_pages'],
+            'page_offsets': document['page_offsets'],
+            'cache_hit': cache_hit
         }
-    
-    def extract_metadata(self, pdf_path: str) -> Dict[str, any]:
-        metadata = {}
         
-        try:
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                info = pdf_reader.metadata
-                
-                if info:
-                    metadata = {
-                        'title': info.get('/Title', ''),
-                        'author': info.get('/Author', ''),
-                        'subject': info.get('/Subject', ''),
-                        'creator': info.get('/Creator', ''),
-                        'producer': info.get('/Producer', ''),
-                        'creation_date': info.get('/CreationDate', ''),
-                        'modification_date': info.get('/ModDate', ''),
-                    }
-                
-                metadata['num_pages'] = len(pdf_reader.pages)
-        except Exception as e:
-            print(f"Error extracting metadata: {e}")
+        if self.chunk_unit == 'tokens':
+            result['total_tokens'] = total_units
         
-        return metadata
+        return result
+    
+    def get_metadata(self, pdf_path: str) -> Dict[str, any]:
+        """Metadata from the extraction cache when available, else from the PDF."""
+        entry = self.cache.get(pdf_path) if self.cache else None
+        if entry is not None:
+            return entry['metadata']
+        return self.extract_metadata(pdf_path)
+    
+    def extract_metadata(self, pdf_path: str) -> Dict[str, any]:
+        """Document info and page count, read without extracting any text (see PageExtractor.metadata)."""
+        with PageExtractor(pdf_path, self.strategy) as extractor:
+            return extractor.metadata()
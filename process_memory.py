@@ -0,0 +1,34 @@
+import os
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class MemoryLimitExceeded(MemoryError):
+    """Raised when extraction cannot get back under its RSS ceiling."""
+
+
+def peak_rss_mb(children: bool = False) -> float:
+    """
+    Peak resident set size in MB of this process, or of the largest
+    finished child process (for example a recycled pool worker).
+    """
+    if resource is None:
+        return 0.0
+    
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return usage.ru_maxrss / (1 << 20 if sys.platform == 'darwin' else 1 << 10)
+
+
+def current_rss_mb() -> float:
+    """Current resident set size of this process in MB."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1 << 20)
+    except (OSError, ValueError, IndexError):
+        # No /proc: the peak is an upper bound on the current size
+        return peak_rss_mb()
@@ -0,0 +1,225 @@
+"""
+Compressed copies of the embedding matrix that queries are scored on.
+
+The float32 matrix stays on disk as the source of truth (see VectorIndex);
+a quantizer keeps a code per row that is a fraction of its size, so a scan
+only pages in the codes, and the float rows of the best few candidates
+are read back to re-rank them. Codes are derived from the float rows and
+are re-encoded from them whenever they are missing.
+"""
+import glob
+import os
+import uuid
+from typing import Optional
+import numpy as np
+from config import Config
+from clustering import RETRAIN_GROWTH, kmeans
+from row_file import RowFile
+
+# Rows encoded or scored per step, which bounds temporary copies
+SCORE_BLOCK = 16384
+# Size of the float copy of int8 codes scored per step; cache-sized, so a
+# scan runs as fast as on float32 rows
+INT8_BLOCK_BYTES = 1 << 20
+# Centroids per product quantization subspace (one byte per code) and
+# the largest sample they are trained on
+PQ_CENTROIDS = 256
+PQ_TRAINING_SAMPLE = 16384
+
+
+class ScalarQuantizer:
+    """
+    int8 codes: each vector is scaled so its largest component is 127 and
+    rounded, with the scale kept next to it. That is one byte per
+    dimension plus four, a quarter of float32, with no training.
+    """
+    
+    def __init__(self, path: str, dimensions: int):
+        self.file = RowFile(path, np.dtype([('scale', '<f4'), ('codes', 'i1', (dimensions,))]))
+    
+    def __len__(self) -> int:
+        return len(self.file)
+    
+    @property
+    def bytes_per_vector(self) -> int:
+        return self.file.dtype.itemsize
+    
+    def open(self, count: int):
+        self.file.open(count)
+    
+    def update(self, matrix: np.ndarray, count: int):
+        """Encode rows [len(self), count) of the float matrix."""
+        for start in range(len(self), count, SCORE_BLOCK):
+            vectors = np.asarray(matrix[start:min(start + SCORE_BLOCK, count)], dtype=np.float32)
+            rows = np.zeros(len(vectors), dtype=self.file.dtype)
+            scale = np.abs(vectors).max(axis=1) / 127
+            rows['scale'] = scale
+            rows['codes'] = np.rint(vectors / np.maximum(scale, 1e-12)[:, None])
+            self.file.append(rows)
+    
+    def scores(self, query_vector: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Approximate similarity of the query to the given rows, or to all."""
+        codes = self.file.rows
+        total = len(codes) if rows is None else len(rows)
+        step = max(1, INT8_BLOCK_BYTES // (4 * len(query_vector)))
+        parts = []
+        for start in range(0, total, step):
+            block = codes[start:start + step] if rows is None else codes[rows[start:start + step]]
+            parts.append((block['codes'].astype(np.float32) @ query_vector) * block['scale'])
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+    
+    def scores_many(self, query_vectors: np.ndarray) -> np.ndarray:
+        """Approximate similarity of several queries to all rows, one row per query."""
+        codes = self.file.rows
+        scores = np.empty((len(query_vectors), len(codes)), dtype=np.float32)
+        step = max(1, INT8_BLOCK_BYTES // (4 * query_vectors.shape[1]))
+        for start in range(0, len(codes), step):
+            block = codes[start:start + step]
+            scores[:, start:start + len(block)] = (query_vectors @ block['codes'].astype(np.float32).T) * block['scale']
+        return scores
+    
+    def flush(self):
+        self.file.flush()
+    
+    def clear(self):
+        self.file.clear()
+
+
+class ProductQuantizer:
+    """
+    Product quantization: a vector is cut into `subvectors` pieces, and
+    each piece is stored as the one-byte index of its nearest centroid
+    among 256 learned for that subspace. A query is scored with one
+    lookup table per subspace, so the cost per row is `subvectors` table
+    reads. The default, dimensions / 16 bytes per vector, is 1/64 of
+    float32.
+    
+    The codebooks are trained on the vectors there are, and again (with
+    every row re-encoded) once there are RETRAIN_GROWTH times as many.
+    They are kept in an .npz file that names the codes file encoded with
+    them, so the two are replaced together.
+    """
+    
+    def __init__(self, path: str, dimensions: int, subvectors: int = None):
+        self.path = path
+        self.dimensions = dimensions
+        self.subvectors = subvectors or Config.PQ_SUBVECTORS or next(
+            m for m in range(max(1, dimensions // 16), 0, -1) if dimensions % m == 0
+        )
+        if dimensions % self.subvectors:
+            raise ValueError(f"{dimensions} dimensions cannot be split into {self.subvectors} subvectors")
+        self.codebooks: Optional[np.ndarray] = None  # (subvectors, centroids, dimensions / subvectors)
+        self.trained_count = 0
+        self.file: Optional[RowFile] = None  # codes, once trained
+    
+    def __len__(self) -> int:
+        return len(self.file) if self.file is not None else 0
+    
+    @property
+    def bytes_per_vector(self) -> int:
+        return self.subvectors
+    
+    def open(self, count: int):
+        self.codebooks, self.trained_count, self.file = None, 0, None
+        if not count:
+            return
+        
+        with np.load(self.path) as saved:
+            codebooks, trained_count, codes_id = saved['codebooks'], int(saved['trained_count']), str(saved['codes_id'])
+        if codebooks.shape[0] != self.subvectors or codebooks.shape[0] * codebooks.shape[2] != self.dimensions:
+            raise ValueError(f"{self.path} does not hold {self.subvectors} codebooks for {self.dimensions} dimensions")
+        file = self._codes_file(codes_id)
+        file.open(count)
+        self.codebooks, self.trained_count, self.file = codebooks, trained_count, file
+    
+    def update(self, matrix: np.ndarray, count: int):
+        """Encode rows [len(self), count) of the float matrix, training first if it is due."""
+        if count <= len(self):
+            return
+        if self.codebooks is None or count >= RETRAIN_GROWTH * self.trained_count:
+            self._train(matrix, count)
+            return
+        self._encode(matrix, len(self), count, self.file)
+    
+    def scores(self, query_vector: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Approximate similarity of the query to the given rows, or to all."""
+        tables = np.einsum('mcd,md->mc', self.codebooks, query_vector.reshape(self.subvectors, -1))
+        codes = self.file.rows
+        total = len(codes) if rows is None else len(rows)
+        scores = np.zeros(total, dtype=np.float32)
+        for start in range(0, total, SCORE_BLOCK):
+            block = codes[start:start + SCORE_BLOCK] if rows is None else codes[rows[start:start + SCORE_BLOCK]]
+            block_scores = scores[start:start + len(block)]
+            for subspace, table in enumerate(tables):
+                block_scores += table[block[:, subspace]]
+        return scores
+    
+    def scores_many(self, query_vectors: np.ndarray) -> np.ndarray:
+        """
+        Approximate similarity of several queries to all rows, one row per
+        query. The codes are read once, each block looked up in the tables
+        of every query.
+        """
+        tables = np.einsum(
+            'mcd,qmd->mqc', self.codebooks, query_vectors.reshape(len(query_vectors), self.subvectors, -1)
+        )
+        codes = self.file.rows
+        scores = np.zeros((len(query_vectors), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK):
+            block = codes[start:start + SCORE_BLOCK]
+            block_scores = scores[:, start:start + len(block)]
+            for subspace, table in enumerate(tables):
+                block_scores += table[:, block[:, subspace]]
+        return scores
+    
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+    
+    def clear(self):
+        self.codebooks, self.trained_count, self.file = None, 0, None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        # Codes files of every training, including any a crash left behind
+        for path in glob.glob(f"{glob.escape(os.path.splitext(self.path)[0])}-*.npy"):
+            os.remove(path)
+    
+    def _codes_file(self, codes_id: str) -> RowFile:
+        return RowFile(f"{os.path.splitext(self.path)[0]}-{codes_id}.npy", np.uint8, (self.subvectors,))
+    
+    def _train(self, matrix: np.ndarray, count: int):
+        rng = np.random.default_rng(0)
+        sample = np.asarray(
+            matrix[np.sort(rng.choice(count, min(count, PQ_TRAINING_SAMPLE), replace=False))], dtype=np.float32
+        )
+        centroids = min(PQ_CENTROIDS, len(sample))
+        self.codebooks = np.stack([
+            kmeans(np.ascontiguousarray(part), centroids, rng)
+            for part in np.split(sample, self.subvectors, axis=1)
+        ])
+        self.trained_count = count
+        
+        # Every row is encoded into a new codes file, which the codebook
+        # file then points to; the old codes file goes last
+        old_file = self.file
+        codes_id = uuid.uuid4().hex[:8]
+        self.file = self._codes_file(codes_id)
+        self._encode(matrix, 0, count, self.file)
+        self.file.flush()
+        
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, codebooks=self.codebooks, trained_count=np.array(count), codes_id=np.array(codes_id))
+        os.replace(tmp_path, self.path)
+        if old_file is not None:
+            old_file.clear()
+    
+    def _encode(self, matrix: np.ndarray, start: int, end: int, file: RowFile):
+        norms = np.einsum('mcd,mcd->mc', self.codebooks, self.codebooks)
+        for block in range(start, end, SCORE_BLOCK):
+            vectors = np.asarray(matrix[block:min(block + SCORE_BLOCK, end)], dtype=np.float32)
+            codes = np.empty((len(vectors), self.subvectors), dtype=np.uint8)
+            for subspace, part in enumerate(np.split(vectors, self.subvectors, axis=1)):
+                # Nearest centroid: the part's own norm is the same for every centroid
+                codes[:, subspace] = np.argmax(part @ self.codebooks[subspace].T - 0.5 * norms[subspace], axis=1)
+            file.append(codes)
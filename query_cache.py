@@ -0,0 +1,76 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+
+# Bytes counted per entry on top of its key text and result
+ENTRY_OVERHEAD = 200
+
+
+class QueryCache:
+    """
+    LRU cache of query results with a memory cap and an optional time to
+    live. Callers put a corpus version in their keys, so changing the
+    corpus invalidates every entry without a scan: stale ones are never
+    looked up again and age out of the LRU order. Safe to share between
+    threads.
+    """
+    
+    def __init__(self, max_bytes: int, ttl: float = 0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl  # seconds; 0 keeps entries until they are evicted
+        self._entries: 'OrderedDict[Hashable, tuple]' = OrderedDict()  # key -> (value, size, expiry)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def get(self, key: Hashable) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] and entry[2] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+    
+    def put(self, key: Hashable, value: str):
+        size = ENTRY_OVERHEAD + sys.getsizeof(value) + sum(sys.getsizeof(part) for part in key if isinstance(part, str))
+        if size > self.max_bytes:
+            return
+        
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic() + self.ttl if self.ttl else 0)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+    
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+        }
+    
+    def _remove(self, key: Hashable):
+        self.bytes -= self._entries.pop(key)[1]
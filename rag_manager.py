@@ -1,143 +1,894 @@
 import os
-from typing import List, Dict, Optional
+import shutil
+import time
+import uuid
+from bisect import bisect_right
+from difflib import SequenceMatcher
+from itertools import islice
+from typing import List, Dict, Iterable, Iterator, Optional, Tuple
+from bm25_index import BM25Index, PostingsSegment
 from config import Config
+from chunk_store import ChunkSegment, ChunkTable, iter_text_chunks, normalize_text, write_segment
+from document_store import DocumentStore
+from embeddings import EmbeddingClient
+from ivf_index import IVFIndex
+from query_cache import QueryCache
+from tokenization import count_tokens, truncate_to_tokens
+from vector_index import VectorIndex
 import json
+import numpy as np
+
+# Chunks joined by get_context_for_query without a token budget
+CONTEXT_TOP_K = 3
+# Tokens taken by the "\n\n" between packed chunks
+CONTEXT_SEPARATOR_TOKENS = 1
+# Segments with up to this many times the chunks of a new one are merged into it
+SEGMENT_MERGE_FACTOR = 2
+# Ways _rank() can order chunks (see Config.RETRIEVAL_MODE)
+RETRIEVAL_MODES = ('bm25', 'embedding', 'hybrid')
+# Chunks embedded per call to the embedder while committing
+EMBEDDING_BLOCK = 4096
+# Scores held at a time while ranking several queries together (see _rank_many)
+QUERY_BATCH_BYTES = 128 * 2 ** 20
 
 class RAGManager:
     """
     Simplified RAG Manager without LightRAG dependency.
-    Stores documents and performs basic context retrieval.
+    Stores documents and retrieves context with a BM25 keyword index or,
+    in 'embedding' retrieval mode, by similarity of chunk embeddings;
+    'hybrid' mode re-ranks the best BM25 matches by embedding similarity.
+    Documents are kept in a SQLite store (see DocumentStore) and read from
+    memory-mapped segment files registered with it, so each commit writes
+    only what changed and startup does not read the corpus.
     """
     
-    def __init__(self, working_dir: str = "./cache"):
+    def __init__(
+        self,
+        working_dir: str = "./cache",
+        chunk_unit: str = None,
+        retrieval_mode: str = None,
+        embedder: Optional[EmbeddingClient] = None
+    ):
         self.working_dir = working_dir
         os.makedirs(working_dir, exist_ok=True)
         
-        self.documents = []
-        self.cache_file = os.path.join(working_dir, "documents.json")
+        self.chunk_unit = chunk_unit or Config.CHUNK_UNIT
+        self.retrieval_mode = retrieval_mode or Config.RETRIEVAL_MODE
+        if self.retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {self.retrieval_mode}")
+        self.embedder = None
+        self.vectors = None
+        self.ann = None
+        # Seconds spent in each stage of the last hybrid ranking
+        self.last_query_timings: Dict[str, float] = {}
+        # Results of get_context_for_query, keyed with corpus_version, which
+        # every change to the documents or their vectors bumps
+        self.query_cache = QueryCache(int(Config.QUERY_CACHE_MB * 2 ** 20), Config.QUERY_CACHE_TTL)
+        self.corpus_version = 0
+        if self.retrieval_mode in ('embedding', 'hybrid'):
+            self.embedder = embedder or EmbeddingClient()
+            self.vectors = VectorIndex(os.path.join(working_dir, "vectors.npy"), self.embedder.dimensions)
+            self.ann = IVFIndex(os.path.join(working_dir, "vectors.ivf.npz"))
+        
+        self.chunks = ChunkTable()
+        self.index = BM25Index(Config.BM25_K1, Config.BM25_B)
+        self.legacy_file = os.path.join(working_dir, "documents.json")
+        self.segment_dir = os.path.join(working_dir, "segments")
+        os.makedirs(self.segment_dir, exist_ok=True)
+        self.store = DocumentStore(os.path.join(working_dir, "documents.db"))
+        
+        # What the store already holds: documents [0, _saved_documents) and
+        # the registered segments, of which the open ones are a prefix
+        self._saved_documents = 0
+        self._segments: List[Tuple[str, int, int, int, int]] = []
+        self._pending_removals: List[int] = []
         
         # Load existing documents if any
         self._load_documents()
     
     def _load_documents(self):
-        """Load documents from cache file."""
-        if os.path.exists(self.cache_file):
+        """
+        Open the segment files of the store, migrating a documents.json cache
+        on first use. Only the segment footers are read, so this takes about
+        the same time however large the corpus is. Documents the segments
+        do not cover (after an upgrade) are read from the store, indexed and
+        written to a new segment. The text of a document is only kept in its
+        segment, so if a segment file is lost, its documents and those of the
+        segments after it are removed and have to be uploaded again.
+        """
+        try:
+            if not self.store.document_count() and os.path.exists(self.legacy_file):
+                self._migrate_legacy_file()
+            self._remove_legacy_index()
+            self._segments = self.store.segments()
+            self._saved_documents = self.store.document_count()
+            
             try:
-                with open(self.cache_file, 'r', encoding='utf-8') as f:
-                    self.documents = json.load(f)
-                print(f"Loaded {len(self.documents)} documents from cache")
+                self._open_segments()
             except Exception as e:
-                print(f"Error loading documents: {e}")
-                self.documents = []
+                print(f"Error opening document segments, rebuilding them: {e}")
+                self.chunks = ChunkTable()
+                self.index = BM25Index(Config.BM25_K1, Config.BM25_B)
+            if len(self.chunks.segments) == len(self._segments):
+                self.store.drop_segment_texts()
+            
+            missing = self._saved_documents - self.chunks.document_total
+            if missing:
+                print(f"Indexing {missing} documents from the document store...")
+                first_document = self.chunks.document_total
+                lost = self.store.load(self.chunks, first_document)
+                for doc_id in range(first_document, self.chunks.document_total):
+                    self._index_document(doc_id)
+                if lost:
+                    print(f"Error loading documents: the text of {len(lost)} documents was lost with their segment; upload them again")
+                for doc_id in lost:
+                    self.chunks.remove_document(doc_id)
+                    self.index.remove(self.chunks.document_chunks(doc_id))
+                    self._pending_removals.append(doc_id)
+            
+            for doc_id in self.store.removed_documents():
+                self.chunks.remove_document(doc_id)
+                self.index.remove(self.chunks.document_chunks(doc_id))
+            if self.vectors is not None:
+                self._open_vectors()
+                missing = missing or self.chunks.chunk_total - len(self.vectors)
+            if self.chunks.document_total:
+                print(f"Loaded {self.chunks.document_count} documents ({len(self.chunks)} chunks) from cache")
+        except Exception as e:
+            print(f"Error loading documents: {e}")
+            self.chunks = ChunkTable()
+            self.index = BM25Index(Config.BM25_K1, Config.BM25_B)
+            self._set_aside_store()
+            self._segments = []
+            self._saved_documents = missing = 0
+            if self.vectors is not None:
+                self.vectors.clear()
+                self.ann.clear()
+        
+        if missing:
+            self._save_documents()
+    
+    def _open_segments(self):
+        """
+        Read documents and postings from the registered segments, up to the
+        first one whose documents cannot be read; the documents after it
+        are left for _load_documents to read from the store. Postings that
+        cannot be read are built again from the documents.
+        """
+        chunk_segments, postings_segments = [], []
+        for name, *_ in self._segments:
+            try:
+                chunk_segment = ChunkSegment(self._segment_path(name, '.chunks'))
+            except Exception as e:
+                print(f"Error opening document segment {name}: {e}")
+                break
+            try:
+                postings_segment = PostingsSegment(self._segment_path(name, '.bm25'))
+            except Exception as e:
+                print(f"Error opening postings of segment {name}, indexing it again: {e}")
+                postings_segment = self._rebuild_postings(name, chunk_segment, postings_segments)
+            chunk_segments.append(chunk_segment)
+            postings_segments.append(postings_segment)
+        self.chunks.set_segments(chunk_segments)
+        self.index.set_segments(postings_segments)
+        
+        if self.index.chunk_count != self.chunks.chunk_total:
+            raise ValueError("Document and postings segments cover different chunks")
+        if self.chunks.document_total > self._saved_documents:
+            raise ValueError("The segments hold more documents than the store")
+    
+    def _rebuild_postings(
+        self,
+        name: str,
+        chunk_segment: ChunkSegment,
+        previous: List[PostingsSegment]
+    ) -> PostingsSegment:
+        """Index the chunks of a document segment and write its postings segment again."""
+        index = BM25Index(Config.BM25_K1, Config.BM25_B)
+        index.set_segments(previous)
+        index.add(chunk_segment.chunk_text(chunk) for chunk in range(chunk_segment.chunk_count))
+        path = self._segment_path(name, '.bm25')
+        index.write_segment(path, chunk_segment.first_chunk)
+        return PostingsSegment(path)
+    
+    def _open_vectors(self):
+        """Map the saved chunk embeddings; unusable ones are made again at the next commit."""
+        count = min(self.store.embedded_chunks(self.embedder.model, self.embedder.dimensions), self.chunks.chunk_total)
+        if not count and os.path.exists(self.vectors.path):
+            # Vectors of another model: record that none are valid before
+            # any of them is overwritten
+            self.store.commit(self.chunks, [], [], embedded=(self.embedder.model, self.embedder.dimensions, 0))
+            self.vectors.clear()
+        try:
+            self.vectors.open(count)
+        except Exception as e:
+            print(f"Error opening chunk embeddings, embedding chunks again: {e}")
+            self.vectors.clear()
+        self.ann.open(self._vectors_key(), len(self.vectors))
+        self.ann.update(self.vectors.matrix, len(self.vectors), self._vectors_key())
+        
+        pending = self.chunks.chunk_total - len(self.vectors)
+        if pending:
+            print(f"Embedding {pending} chunks...")
+    
+    def _migrate_legacy_file(self):
+        """Copy documents.json into the store in one transaction, then set it aside."""
+        with open(self.legacy_file, 'r', encoding='utf-8') as f:
+            table = ChunkTable.from_dict(json.load(f))
+        self.store.commit(table, range(table.document_total), [])
+        
+        os.replace(self.legacy_file, self.legacy_file + '.migrated')
+        print(f"Migrated {table.document_count} documents from {self.legacy_file}")
+    
+    def _remove_legacy_index(self):
+        """Remove index files of earlier versions, which are rebuilt as segments."""
+        legacy_index = os.path.join(self.working_dir, "bm25_index.npz")
+        if os.path.exists(legacy_index):
+            os.remove(legacy_index)
+        shutil.rmtree(os.path.join(self.working_dir, "bm25"), ignore_errors=True)
+    
+    def _set_aside_store(self):
+        """Move an unreadable store out of the way, keeping it for inspection, and start a new one."""
+        self.store.close()
+        path = self.store.path
+        suffix = time.strftime('%Y%m%d-%H%M%S')
+        for extension in ('', '-wal', '-shm'):
+            if os.path.exists(path + extension):
+                os.replace(path + extension, f"{path}.unreadable-{suffix}{extension}")
+        self.store = DocumentStore(path)
     
     def _save_documents(self):
         """Save documents to cache file."""
         try:
-            with open(self.cache_file, 'w', encoding='utf-8') as f:
-                json.dump(self.documents, f, ensure_ascii=False, indent=2)
+            self.commit()
         except Exception as e:
             print(f"Error saving documents: {e}")
     
-    def add_document(self, text: str, metadata: Optional[Dict] = None):
-        """Add a document to the RAG system."""
+    def commit(self):
+        """
+        Write the documents added and removed since the last commit in one
+        transaction. Unlike _save_documents, errors are raised.
+        
+        New documents are written to the store and, with their postings, to
+        a new segment, which is then read through mmap so they no longer
+        take memory. The newest existing segments are merged into it while
+        they are not much larger, so segments grow geometrically: there are
+        only logarithmically many, and each chunk is rewritten a logarithmic
+        number of times. Merging also drops the text and postings of removed
+        documents. In embedding retrieval mode the new chunks are embedded
+        first, in batches across all new documents.
+        """
+        embedded = None
+        if self.vectors is not None:
+            self._embed_pending()
+            self.ann.update(self.vectors.matrix, len(self.vectors), self._vectors_key())
+            embedded = (self.embedder.model, self.embedder.dimensions, len(self.vectors))
+        
+        table = self.chunks
+        segments = self._segments[:len(table.segments)]
+        first_document, first_chunk = table.base_documents, table.base_chunks
+        new_chunks = table.chunk_total - first_chunk
+        
+        added = []
+        if table.document_total > first_document:
+            while segments and segments[-1][4] <= SEGMENT_MERGE_FACTOR * new_chunks:
+                _, first_document, _, first_chunk, _ = segments.pop()
+            # A fresh name, so no registered file is ever overwritten
+            added.append((
+                f"documents-{first_document}-{table.document_total}-{uuid.uuid4().hex[:8]}",
+                first_document,
+                table.document_total - first_document,
+                first_chunk,
+                table.chunk_total - first_chunk,
+            ))
+            try:
+                write_segment(self._segment_path(added[0][0], '.chunks'), table, first_document)
+                self.index.write_segment(self._segment_path(added[0][0], '.bm25'), first_chunk)
+            except Exception:
+                self._remove_segment(added[0][0])
+                raise
+        
+        dropped = [name for name, *_ in self._segments[len(segments):]]
+        
         try:
-            # Split text into chunks for better retrieval
-            chunks = self._chunk_text(text)
+            self.store.commit(
+                table,
+                range(self._saved_documents, table.document_total),
+                [doc_id for doc_id in self._pending_removals if doc_id < self._saved_documents],
+                added,
+                dropped,
+                embedded
+            )
+        except Exception:
+            for name, *_ in added:
+                self._remove_segment(name)
+            raise
+        
+        self._saved_documents = table.document_total
+        self._pending_removals = []
+        if added:
+            kept = len(segments)
+            name = added[0][0]
+            table.set_segments(table.segments[:kept] + [ChunkSegment(self._segment_path(name, '.chunks'))])
+            self.index.set_segments(self.index.segments[:kept] + [PostingsSegment(self._segment_path(name, '.bm25'))])
+            self._segments = segments + added
+        for name in dropped:
+            self._remove_segment(name)
+    
+    def _embed_pending(self):
+        """Embed the chunks that have no vector yet and flush them to the vector file."""
+        if len(self.vectors) == self.chunks.chunk_total:
+            return
+        removed = self.index.removed_mask()
+        hits, misses = self.embedder.cache_hits, self.embedder.cache_misses
+        for start in range(len(self.vectors), self.chunks.chunk_total, EMBEDDING_BLOCK):
+            end = min(start + EMBEDDING_BLOCK, self.chunks.chunk_total)
+            vectors = np.zeros((end - start, self.vectors.dimensions), dtype=np.float32)
+            # Removed chunks are never ranked, so they keep a zero row
+            live = np.flatnonzero(~removed[start:end]) if len(removed) > start else np.arange(end - start)
+            if len(live):
+                vectors[live] = self.embedder.embed([self.chunks.chunk_text(start + i) for i in live.tolist()])
+            self.vectors.append(vectors)
+        self.vectors.flush()
+        # Embedding and hybrid rankings now include these chunks
+        self.corpus_version += 1
+        
+        hits, misses = self.embedder.cache_hits - hits, self.embedder.cache_misses - misses
+        if hits + misses:
+            print(f"Embedded {hits + misses} chunks: {hits} from cache ({hits / (hits + misses):.0%}), {misses} by API")
+    
+    def _vectors_key(self) -> str:
+        return f"{self.embedder.model}:{self.embedder.dimensions}"
+    
+    def _segment_path(self, name: str, extension: str) -> str:
+        return os.path.join(self.segment_dir, name + extension)
+    
+    def _remove_segment(self, name: str):
+        for extension in ('.chunks', '.bm25'):
+            try:
+                os.remove(self._segment_path(name, extension))
+            except OSError:
+                pass
+    
+    def add_document(
+        self,
+        text: Optional[str] = None,
+        metadata: Optional[Dict] = None,
+        chunks: Optional[Iterable[Dict]] = None,
+        commit: bool = True,
+        document_info: Optional[Dict] = None
+    ) -> int:
+        """
+        Add a document to the RAG system.
+        Either pass the full text, or a chunk iterator such as
+        PDFProcessor.iter_chunks() so the document is never held in memory
+        as a whole. With commit=False nothing is written until commit() is
+        called, so bulk loads can batch many documents into one write.
+        document_info is read after the chunks, so it can be the `info` dict
+        that PDFProcessor.iter_chunks() fills: its page table is kept so the
+        document can later be updated with replace_document(), and its PDF
+        title is added to the metadata for find_document().
+        Returns the number of chunks added.
+        """
+        try:
+            if chunks is None:
+                # Split text into chunks for better retrieval
+                chunks = self._chunk_text(normalize_text(text or ""))
             
-            for i, chunk in enumerate(chunks):
-                self.documents.append({
-                    'text': chunk,
-                    'metadata': metadata or {},
-                    'chunk_id': i,
-                    'length': len(chunk)
-                })
+            text, offsets, token_counts, page_ranges = self._stitch_chunks(chunks)
+            pages = None
+            if document_info:
+                if document_info.get('page_offsets') and document_info.get('page_hashes'):
+                    pages = {'offsets': document_info['page_offsets'], 'hashes': document_info['page_hashes']}
+                    if document_info.get('boilerplate_lines'):
+                        pages['boilerplate'] = document_info['boilerplate_lines']
+                if document_info.get('title'):
+                    metadata = {**(metadata or {}), 'title': document_info['title']}
+            added = self.chunks.add_document(text, offsets, metadata, token_counts, page_ranges, pages)
+            self._index_document(self.chunks.document_total - 1)
+            self.corpus_version += 1
             
-            self._save_documents()
-            print(f"Document added successfully. Total chunks: {len(self.documents)}")
+            if commit:
+                self._save_documents()
+                print(f"Document added successfully. Total chunks: {len(self.chunks)}")
+            return added
         except Exception as e:
             print(f"Error adding document: {e}")
             raise
     
-    def _chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
-        """Split text into overlapping chunks."""
-        words = text.split()
-        chunks = []
+    def find_document(self, filename: Optional[str] = None, title: Optional[str] = None) -> Optional[int]:
+        """
+        Id of the most recently added document with this filename or, failing
+        that, this (non-empty) PDF title. None if there is no such document.
+        """
+        for key, value in (('filename', filename), ('title', title)):
+            if value:
+                doc_id = next(self._find_documents(key, value), None)
+                if doc_id is not None:
+                    return doc_id
+        return None
+    
+    def _find_documents(self, key: str, value: str) -> Iterator[int]:
+        """
+        Live documents whose metadata has this value for key, newest first.
+        Committed documents are looked up in the store's index (see
+        DocumentStore.find_documents); only those added since the last
+        commit are scanned.
+        """
+        table = self.chunks
+        for doc_id in range(table.document_total - 1, self._saved_documents - 1, -1):
+            if doc_id not in table.removed and table.metadata[doc_id].get(key) == value:
+                yield doc_id
+        for doc_id in self.store.find_documents(key, value):
+            # Removed since the last commit
+            if doc_id not in table.removed:
+                yield doc_id
+    
+    def document_pages(self, doc_id: int) -> Optional[Dict[str, List[str]]]:
+        """
+        The 'pages' (cleaned text) and 'hashes' (fingerprints) of every page
+        of a document, and its 'boilerplate' lines, if it has a page table.
+        """
+        pages = self.chunks.pages[doc_id]
+        if not pages:
+            return None
+        
+        text = self.chunks.texts[doc_id]
+        return {
+            'pages': [text[start:end] for start, end in pages['offsets']],
+            'hashes': pages['hashes'],
+            'boilerplate': pages.get('boilerplate', []),
+        }
+    
+    def replace_document(
+        self,
+        doc_id: int,
+        pages: List[str],
+        page_hashes: List[str],
+        metadata: Optional[Dict] = None,
+        commit: bool = True,
+        chunk_size: int = None,
+        chunk_overlap: int = None,
+        boilerplate_lines: Optional[List[str]] = None
+    ) -> Dict[str, int]:
+        """
+        Replace a document with a new revision of it, given as cleaned pages
+        and their fingerprints. Chunks that lie entirely on pages which are
+        unchanged in the new revision are kept as they are, only moved to
+        their new position; only the text around changed pages is chunked
+        again. Returns how many chunks were kept, added and removed.
+        """
+        chunk_size = chunk_size or Config.MAX_CHUNK_SIZE
+        chunk_overlap = Config.CHUNK_OVERLAP if chunk_overlap is None else chunk_overlap
+        table = self.chunks
+        old_pages = table.pages[doc_id]
+        old_chunks = table.document_chunks(doc_id)
         
-        for i in range(0, len(words), chunk_size - overlap):
-            chunk = ' '.join(words[i:i + chunk_size])
-            if chunk:
-                chunks.append(chunk)
+        page_offsets = []
+        parts = []
+        length = 0
+        for page_text in pages:
+            if page_text and length:
+                parts.append(' ')
+                length += 1
+            page_offsets.append([length, length + len(page_text)])
+            parts.append(page_text)
+            length += len(page_text)
+        text = ''.join(parts)
+        page_starts = [start for start, _ in page_offsets]
+        
+        # Old page -> new page for runs of pages that are unchanged and in order
+        page_map = {}
+        matcher = SequenceMatcher(None, old_pages['hashes'] if old_pages else [], page_hashes, autojunk=False)
+        for old_start, new_start, size in matcher.get_matching_blocks():
+            for i in range(size):
+                page_map[old_start + i] = new_start + i
+        
+        def new_position(index: int) -> Optional[int]:
+            """Start of an old chunk in the new text, if every page under it is unchanged."""
+            first, last = table.page_starts[index] - 1, table.page_ends[index] - 1
+            if first < 0 or any(page_map.get(page) != page_map.get(first, -1) + page - first for page in range(first, last + 1)):
+                return None
             
-            if i + chunk_size >= len(words):
-                break
+            start = page_offsets[page_map[first]][0] + table.starts[index] - old_pages['offsets'][first][0]
+            end = start + table.ends[index] - table.starts[index]
+            return start if text[start:end] == table.chunk_text(index) else None
+        
+        kept = {index: new_position(index) for index in old_chunks}
+        kept = {index: start for index, start in kept.items() if start is not None}
+        if old_chunks and old_chunks[-1] in kept:
+            # A short final chunk is redone if the new revision continues past it
+            last = old_chunks[-1]
+            if kept[last] + table.ends[last] - table.starts[last] < len(text):
+                del kept[last]
+        
+        offsets, token_counts, page_ranges = [], [], []
+        
+        def add_chunk(start: int, end: int, token_count: int):
+            offsets.append((start, end))
+            token_counts.append(token_count)
+            page_ranges.append((bisect_right(page_starts, start), bisect_right(page_starts, max(end - 1, start))))
+        
+        def rechunk(start: int, end: int):
+            for chunk in iter_text_chunks([text[start:end]], chunk_size, chunk_overlap, self.chunk_unit):
+                add_chunk(start + chunk['start_char'], start + chunk['end_char'], chunk.get('token_count') or 0)
+        
+        previous = None  # last kept old chunk index
+        region_start = 0
+        for index in old_chunks:
+            if index not in kept:
+                continue
+            
+            start = kept[index]
+            end = start + table.ends[index] - table.starts[index]
+            gap = index != (old_chunks[0] if previous is None else previous + 1)
+            if previous is not None and not gap:
+                previous_end = kept[previous] + table.ends[previous] - table.starts[previous]
+                gap = start - previous_end != table.starts[index] - table.ends[previous]
+            elif previous is None and not gap:
+                gap = start != 0
+            
+            if gap:
+                # Re-chunk from where the first dropped chunk started up to
+                # the overlap this kept chunk shares with the chunk before it
+                overlap = next(iter_text_chunks([text[start:end]], chunk_overlap, 0, self.chunk_unit), None) if chunk_overlap else None
+                rechunk(region_start, start + (overlap['end_char'] if overlap else 0))
+            
+            add_chunk(start, end, table.token_counts[index])
+            previous = index
+            
+            following = index + 1
+            if following < old_chunks.stop and table.starts[following] < table.ends[index]:
+                region_start = start + table.starts[following] - table.starts[index]
+            else:
+                region_start = end
+        
+        if region_start < len(text):
+            rechunk(region_start, len(text))
+        
+        new_pages = {'offsets': page_offsets, 'hashes': page_hashes}
+        if boilerplate_lines:
+            new_pages['boilerplate'] = boilerplate_lines
+        
+        table.remove_document(doc_id)
+        self._pending_removals.append(doc_id)
+        table.add_document(text, offsets, metadata, token_counts, page_ranges, new_pages)
+        self.index.remove(old_chunks)
+        self._index_document(table.document_total - 1)
+        self.corpus_version += 1
+        if commit:
+            self._save_documents()
         
-        return chunks if chunks else [text]
+        reused = len(kept)
+        return {'chunks_kept': reused, 'chunks_added': len(offsets) - reused, 'chunks_removed': len(old_chunks) - reused}
+    
+    def _index_document(self, doc_id: int):
+        self.index.add(self.chunks.chunk_text(index) for index in self.chunks.document_chunks(doc_id))
+    
+    def _chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> Iterator[Dict]:
+        """Split normalized text into overlapping chunks."""
+        return iter_text_chunks([text], chunk_size, overlap, self.chunk_unit)
+    
+    def _stitch_chunks(
+        self,
+        chunks: Iterable[Dict]
+    ) -> Tuple[str, List[Tuple[int, int]], List[int], List[Tuple[int, int]]]:
+        """
+        Rebuild the document buffer from a chunk stream, keeping only the
+        part of each chunk that extends past the previous one.
+        """
+        parts = []
+        offsets = []
+        token_counts = []
+        page_ranges = []
+        length = 0
+        
+        for chunk in chunks:
+            chunk_text = chunk['text']
+            start = chunk.get('start_char', length + 1 if length else 0)
+            end = start + len(chunk_text)
+            
+            if start > length:
+                parts.append(' ' * (start - length))
+                length = start
+            if end > length:
+                parts.append(chunk_text[length - start:])
+                length = end
+            
+            offsets.append((start, end))
+            token_counts.append(chunk.get('token_count') or 0)
+            page_ranges.append((chunk.get('page_start') or 0, chunk.get('page_end') or 0))
+        
+        return ''.join(parts), offsets, token_counts, page_ranges
+    
+    def _rank(self, query: str, top_k: Optional[int] = None) -> Iterable[int]:
+        """
+        Indices of matching chunks, best first, by BM25 score, embedding
+        similarity or both (see _hybrid_rank). Without top_k the ranking is
+        produced lazily, as far as it is read. In embedding mode only
+        committed chunks are ranked.
+        """
+        if self.retrieval_mode == 'embedding':
+            ranked = self._dense_rank(self.embedder.embed([query])[0])
+        elif self.retrieval_mode == 'hybrid':
+            ranked = self._hybrid_rank(query)
+        else:
+            ranked = self.index.rank(query)
+        return list(islice(ranked, top_k)) if top_k else ranked
+    
+    def _dense_rank(self, query_vector: np.ndarray) -> Iterator[int]:
+        if self.ann.trained:
+            # Approximate once the corpus is large (see IVFIndex)
+            return self.ann.rank(self.vectors, query_vector, self.index.removed_mask())
+        return self.vectors.rank(query_vector, self.index.removed_mask())
+    
+    def _dense_rank_many(self, query_vectors: np.ndarray) -> List[Iterator[int]]:
+        if self.ann.trained:
+            # Each query probes only its own lists, which beats a full product
+            return [self._dense_rank(query_vector) for query_vector in query_vectors]
+        return self.vectors.rank_many(query_vectors, self.index.removed_mask())
+    
+    def _hybrid_rank(self, query: str) -> Iterable[int]:
+        """
+        The best HYBRID_CANDIDATES chunks by BM25, ranked again by
+        embedding similarity with a single matrix product over their rows;
+        the two rankings are fused by reciprocal rank. Only the candidates
+        are scored with vectors, so this costs little more than BM25 alone.
+        Without any keyword match, chunks are ranked by similarity alone,
+        lazily, as far as the ranking is read.
+        The time of each stage is kept in last_query_timings.
+        """
+        timings = {}
+        started = time.perf_counter()
+        lexical = list(islice(self.index.rank(query), Config.HYBRID_CANDIDATES))
+        timings['lexical'] = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        query_vector = self.embedder.embed([query])[0]
+        timings['query_embedding'] = time.perf_counter() - started
+        
+        ranked = self._hybrid_fuse(lexical, query_vector, timings)
+        self.last_query_timings = timings
+        return ranked
+    
+    def _hybrid_fuse(self, lexical: List[int], query_vector: np.ndarray, timings: Dict[str, float]) -> Iterable[int]:
+        """Rank BM25 candidates by similarity and fuse the two rankings, timing both stages."""
+        started = time.perf_counter()
+        if not lexical:
+            # Scoring happens here; only as much of the order as is read gets sorted
+            ranked = self._dense_rank(query_vector)
+            timings['vector'] = time.perf_counter() - started
+            return ranked
+        # Chunks added since the last commit have no vector yet and keep
+        # only their BM25 rank
+        rows = np.array(sorted(index for index in lexical if index < len(self.vectors)), dtype=np.int64)
+        dense = list(self.vectors.rank(query_vector, rows=rows))
+        timings['vector'] = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        fused = {}
+        for ranking in (lexical, dense):
+            for rank, index in enumerate(ranking, 1):
+                fused[index] = fused.get(index, 0.0) + 1.0 / (Config.HYBRID_RRF_K + rank)
+        ranked = sorted(fused, key=lambda index: (-fused[index], index))
+        timings['fusion'] = time.perf_counter() - started
+        return ranked
+    
+    def _rank_many(self, queries: List[str]) -> Iterator[Iterable[int]]:
+        """
+        Lazy rankings of several queries, as from _rank, in query order.
+        The queries are scored together: BM25 reads each term's postings
+        once for every query that has it (see BM25Index.rank_many), and
+        their embeddings, requested as one batch, are scored with a single
+        matrix product (see VectorIndex.rank_many). That product's scores
+        are held for QUERY_BATCH_BYTES worth of queries at a time, so memory
+        stays bounded as long as each ranking is read before the next.
+        In hybrid mode, last_query_timings holds the stages of the query
+        ranked last.
+        """
+        if not queries:
+            return
+        if self.retrieval_mode == 'bm25':
+            yield from self.index.rank_many(queries)
+            return
+        
+        started = time.perf_counter()
+        query_vectors = self.embedder.embed(list(queries))
+        # One request embeds every query; each is charged an equal share
+        embedding_seconds = (time.perf_counter() - started) / len(queries)
+        
+        if self.retrieval_mode == 'embedding':
+            step = max(1, QUERY_BATCH_BYTES // (4 * max(len(self.vectors), 1)))
+            for start in range(0, len(queries), step):
+                yield from self._dense_rank_many(query_vectors[start:start + step])
+            return
+        
+        rankings = self.index.rank_many(queries)
+        for query_vector in query_vectors:
+            timings = {'query_embedding': embedding_seconds}
+            started = time.perf_counter()
+            lexical = list(islice(next(rankings), Config.HYBRID_CANDIDATES))
+            timings['lexical'] = time.perf_counter() - started
+            ranked = self._hybrid_fuse(lexical, query_vector, timings)
+            self.last_query_timings = timings
+            yield ranked
     
     def query(self, query: str, top_k: int = 3) -> str:
         """
         Query documents and return relevant context.
-        Uses simple keyword matching.
+        Uses BM25 keyword scoring, or embeddings (see _rank).
         """
         try:
-            if not self.documents:
-                return ""
-            
-            # Simple keyword-based retrieval
-            query_words = set(query.lower().split())
-            
-            # Score each document chunk
-            scored_docs = []
-            for doc in self.documents:
-                doc_words = set(doc['text'].lower().split())
-                # Calculate overlap score
-                overlap = len(query_words & doc_words)
-                if overlap > 0:
-                    scored_docs.append((overlap, doc['text']))
-            
-            # Sort by score and take top_k
-            scored_docs.sort(reverse=True, key=lambda x: x[0])
-            top_docs = [doc[1] for doc in scored_docs[:top_k]]
-            
-            # Combine top documents
-            context = "\n\n".join(top_docs)
+            return self._query_context(query, top_k)
+        except Exception as e:
+            print(f"Error in query: {e}")
+            return ""
+    
+    def _query_context(self, query: str, top_k: int) -> str:
+        if not len(self.chunks):
+            return ""
+        
+        return self._join_chunks(self._rank(query, top_k))
+    
+    def _join_chunks(self, indices: Iterable[int]) -> str:
+        top_docs = [self.chunks.chunk_text(index) for index in indices]
+        
+        # Combine top documents
+        return "\n\n".join(top_docs)
+    
+    def query_many(self, queries: List[str], top_k: int = 3) -> List[str]:
+        """
+        query() for several queries at once, such as every section of a
+        handbook outline, ranked in one pass (see _rank_many).
+        """
+        try:
+            if not len(self.chunks):
+                return [""] * len(queries)
+            return [self._join_chunks(islice(ranked, top_k)) for ranked in self._rank_many(queries)]
+        except Exception as e:
+            print(f"Error in query: {e}")
+            return [""] * len(queries)
+    
+    def search(self, query: str, top_k: int = 3) -> List[Dict]:
+        """
+        Matching chunks as dicts (see ChunkTable.get_chunk), best first.
+        Unlike query(), each result keeps its source metadata and page range.
+        """
+        try:
+            return [self.chunks.get_chunk(index) for index in self._rank(query, top_k)]
+        except Exception as e:
+            print(f"Error in query: {e}")
+            return []
+    
+    def get_context_for_query(self, query: str, max_length: int = 4000, max_tokens: Optional[int] = None) -> str:
+        """
+        Get context for a query with length limit.
+        With max_tokens, matching chunks are packed best-first until the
+        token budget is full instead of cutting three chunks by characters.
+        Results are cached (see query_cache) until the corpus changes.
+        """
+        key = self._context_key(query, max_length, max_tokens)
+        context = self.query_cache.get(key)
+        if context is not None:
             return context
-            
+        
+        try:
+            context = self._context(self._rank(query), max_length, max_tokens) if len(self.chunks) else ""
         except Exception as e:
+            # Not cached, so a failed query is tried again
             print(f"Error in query: {e}")
             return ""
+        
+        self.query_cache.put(key, context)
+        return context
     
-    def get_context_for_query(self, query: str, max_length: int = 4000) -> str:
-        """Get context for a query with length limit."""
-        context = self.query(query, top_k=3)
+    def get_contexts_for_queries(
+        self,
+        queries: List[str],
+        max_length: int = 4000,
+        max_tokens: Optional[int] = None
+    ) -> List[str]:
+        """
+        get_context_for_query() for several queries, ranking those not
+        cached in one pass (see _rank_many).
+        """
+        keys = [self._context_key(query, max_length, max_tokens) for query in queries]
+        contexts = [self.query_cache.get(key) for key in keys]
+        missing = [i for i, context in enumerate(contexts) if context is None]
+        if not missing or not len(self.chunks):
+            return [context or "" for context in contexts]
         
+        try:
+            for i, ranked in zip(missing, self._rank_many([queries[i] for i in missing])):
+                contexts[i] = self._context(ranked, max_length, max_tokens)
+                self.query_cache.put(keys[i], contexts[i])
+        except Exception as e:
+            # Contexts not built yet stay empty and uncached
+            print(f"Error in query: {e}")
+        return [context or "" for context in contexts]
+    
+    def _context_key(self, query: str, max_length: int, max_tokens: Optional[int]) -> tuple:
+        return (normalize_text(query), CONTEXT_TOP_K, max_length, max_tokens, self.retrieval_mode, self.corpus_version)
+    
+    def _context(self, ranked: Iterable[int], max_length: int, max_tokens: Optional[int]) -> str:
+        if max_tokens is not None:
+            return self._pack_context(ranked, max_tokens)
+        context = self._join_chunks(islice(ranked, CONTEXT_TOP_K))
         if len(context) > max_length:
             context = context[:max_length] + "..."
-        
         return context
     
+    def _pack_context(self, indices: Iterable[int], max_tokens: int) -> str:
+        """Join chunks in order until max_tokens is reached, trimming the last one."""
+        parts = []
+        used = 0
+        
+        for index in indices:
+            chunk_text = self.chunks.chunk_text(index)
+            # Chunks indexed in token mode carry their count; others are counted here
+            chunk_tokens = self.chunks.token_counts[index] or count_tokens(chunk_text)
+            separator = CONTEXT_SEPARATOR_TOKENS if parts else 0
+            
+            if used + separator + chunk_tokens > max_tokens:
+                remaining = max_tokens - used - separator
+                if remaining > 0:
+                    parts.append(truncate_to_tokens(chunk_text, remaining))
+                break
+            
+            parts.append(chunk_text)
+            used += separator + chunk_tokens
+        
+        return "\n\n".join(parts)
+    
     def clear(self):
         """Clear all documents."""
-        self.documents = []
-        self._save_documents()
+        self.chunks.clear()
+        self.index.clear()
+        self.corpus_version += 1
+        self.query_cache.clear()
+        try:
+            if self.vectors is not None:
+                self.vectors.clear()
+                self.ann.clear()
+            self.store.clear()
+            for name, *_ in self._segments:
+                self._remove_segment(name)
+        except Exception as e:
+            print(f"Error saving documents: {e}")
+        
+        self._saved_documents = 0
+        self._segments = []
+        self._pending_removals = []
         print("Document cache cleared")
     
+    def has_document(self, content_hash: str) -> bool:
+        """Check whether a file with this content hash was already added."""
+        return next(self._find_documents('content_hash', content_hash), None) is not None
+    
     def get_document_count(self) -> int:
         """Get total number of document chunks."""
-        return len(self.documents)
+        return len(self.chunks)
     
-    def get_all_documents_text(self) -> str:
-        """Get all document text combined."""
-        if not self.documents:
-            return ""
-        
-        # Get unique text (avoid duplicates from overlapping chunks)
-        unique_texts = []
-        seen = set()
-        
-        for doc in self.documents:
-            text = doc['text']
-            if text not in seen:
-                unique_texts.append(text)
-                seen.add(text)
-        
-        return "\n\n".join(unique_texts)
+    def get_documents_text(self, max_chars: Optional[int] = None) -> str:
+        """
+        The text of every document, separated by blank lines, or only its
+        first max_chars characters. Each document is stored once, so
+        overlapping chunks add no duplicates, and documents are read only
+        as far as the prefix reaches: a short prefix costs the same however
+        large the corpus is.
+        """
+        parts = []
+        length = 0
+        for doc_id in self.chunks.live_documents():
+            separator = 2 if parts else 0
+            if max_chars is None:
+                text = self.chunks.text_slice(doc_id)
+            elif length + separator < max_chars:
+                text = self.chunks.text_slice(doc_id, 0, max_chars - length - separator)
+            else:
+                break
+            
+            if text:
+                parts.append(text)
+                length += separator + len(text)
+        return "\n\n".join(parts)
@@ -0,0 +1,25 @@
+from typing import Iterator
+import numpy as np
+
+# Candidates ranked per step of iter_ranked(); doubles every step
+FIRST_BLOCK = 32
+
+
+def iter_ranked(scores: np.ndarray, candidates: np.ndarray) -> Iterator[int]:
+    """
+    Candidate indices by descending score, ties in index order. Results are
+    selected a block at a time with argpartition, so taking only the first
+    few costs no more than a partial selection.
+    """
+    remaining = candidates
+    block = FIRST_BLOCK
+    
+    while len(remaining):
+        if len(remaining) > block:
+            split = np.argpartition(-scores[remaining], block)
+            head, remaining = remaining[split[:block]], remaining[split[block:]]
+        else:
+            head, remaining = remaining, remaining[:0]
+        
+        yield from head[np.lexsort((head, -scores[head]))].tolist()
+        block *= 2
@@ -0,0 +1,70 @@
+import os
+from typing import Tuple
+import numpy as np
+
+# Rows allocated when a file is created
+MIN_CAPACITY = 1024
+
+
+class RowFile:
+    """
+    A growable array of fixed-size rows in a .npy file that is
+    memory-mapped rather than read. The file is allocated ahead and doubled
+    when full, so appending only writes the new rows. Rows past `count`
+    are ignored; the caller records how many are valid once they are
+    flushed, so a crash mid-append loses nothing.
+    """
+    
+    def __init__(self, path: str, dtype, row_shape: Tuple[int, ...] = ()):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.array = None  # the whole mapped file, spare rows included
+        self.count = 0
+    
+    def __len__(self) -> int:
+        return self.count
+    
+    @property
+    def rows(self) -> np.ndarray:
+        """The valid rows."""
+        if self.array is None:
+            return np.zeros((0,) + self.row_shape, dtype=self.dtype)
+        return self.array[:self.count]
+    
+    def open(self, count: int):
+        """Map the file, of which the first `count` rows are valid."""
+        self.array, self.count = None, 0
+        if not count:
+            return
+        
+        array = np.load(self.path, mmap_mode='r+')
+        if array.dtype != self.dtype or array.shape[1:] != self.row_shape or len(array) < count:
+            raise ValueError(f"{self.path} does not hold {count} rows of {self.row_shape} {self.dtype}")
+        self.array, self.count = array, count
+    
+    def append(self, rows: np.ndarray):
+        end = self.count + len(rows)
+        if self.array is None or end > len(self.array):
+            self._grow(end)
+        self.array[self.count:end] = rows
+        self.count = end
+    
+    def flush(self):
+        if self.array is not None:
+            self.array.flush()
+    
+    def clear(self):
+        self.array, self.count = None, 0
+        if os.path.exists(self.path):
+            os.remove(self.path)
+    
+    def _grow(self, rows: int):
+        capacity = max(rows, 2 * len(self.array) if self.array is not None else 0, MIN_CAPACITY)
+        tmp_path = self.path + '.tmp'
+        array = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=self.dtype, shape=(capacity,) + self.row_shape)
+        if self.count:
+            array[:self.count] = self.array[:self.count]
+        array.flush()
+        os.replace(tmp_path, self.path)
+        self.array = array
@@ -0,0 +1,125 @@
+"""
+Stress test extraction memory on a large synthetic PDF.
+
+Usage:
+    python stress_extraction.py --pages 5000 --max-rss-mb 400 --recycle-pages 500
+    python stress_extraction.py --pages 5000 --workers 2 --strategy fast
+
+Each configuration runs in a fresh process, so the reported peak RSS is
+that run's alone. Runs without limits first, then with the given limits.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from config import Config
+from page_extractors import STRATEGIES
+from process_memory import MemoryLimitExceeded, current_rss_mb, peak_rss_mb
+from synthetic_pdf import iter_synthetic_pages, write_pdf
+
+
+def synthetic_pdf_path(num_pages: int) -> str:
+    """Path of a synthetic PDF with num_pages pages, generated on first use."""
+    folder = os.path.join(Config.CACHE_FOLDER, 'stress')
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"synthetic_{num_pages}.pdf")
+    
+    if not os.path.exists(path):
+        print(f"Generating {path}...")
+        tmp_path = path + '.tmp'
+        write_pdf(tmp_path, iter_synthetic_pages(num_pages))
+        os.replace(tmp_path, path)
+    
+    return path
+
+
+def run_child(args):
+    """Extract every page once and print a JSON report on the last line."""
+    from pdf_processor import PDFProcessor, shutdown_extraction_pool
+    
+    processor = PDFProcessor(
+        workers=args.workers,
+        use_cache=False,
+        strategy=args.strategy,
+        max_rss_mb=args.max_rss_mb,
+        recycle_pages=args.recycle_pages
+    )
+    report = {'pages': 0, 'chars': 0, 'error': None, 'rss_trace': []}
+    
+    start = time.perf_counter()
+    try:
+        for page_text in processor.iter_pages(args.pdf_path):
+            report['pages'] += 1
+            report['chars'] += len(page_text)
+            if report['pages'] % args.trace_every == 0:
+                report['rss_trace'].append(round(current_rss_mb()))
+    except MemoryLimitExceeded as e:
+        report['error'] = str(e)
+    finally:
+        shutdown_extraction_pool()
+    
+    report['wall_clock'] = time.perf_counter() - start
+    report['peak_rss_mb'] = peak_rss_mb()
+    report['peak_worker_rss_mb'] = peak_rss_mb(children=True)
+    print(json.dumps(report))
+
+
+def run_configuration(args, pdf_path: str, max_rss_mb: int, recycle_pages: int) -> dict:
+    command = [
+        sys.executable, os.path.abspath(__file__), '--child', pdf_path,
+        '--workers', str(args.workers), '--strategy', args.strategy,
+        '--max-rss-mb', str(max_rss_mb), '--recycle-pages', str(recycle_pages),
+        '--trace-every', str(args.trace_every),
+    ]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    
+    if completed.returncode != 0:
+        # Killed by the OS (for example the OOM killer) or crashed
+        return {'error': f"exit code {completed.returncode}: {completed.stderr.strip()[-300:]}"}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak memory of PDF extraction on a large synthetic PDF")
+    parser.add_argument('--pages', type=int, default=5000)
+    parser.add_argument('--pdf', help="use this PDF instead of generating one")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--strategy', choices=STRATEGIES, default=Config.EXTRACTION_STRATEGY)
+    parser.add_argument('--max-rss-mb', type=int, default=400)
+    parser.add_argument('--recycle-pages', type=int, default=500)
+    parser.add_argument('--limited-only', action='store_true', help="skip the run without limits")
+    parser.add_argument('--trace-every', type=int, default=500, help="pages between RSS samples")
+    parser.add_argument('--child', metavar='PDF', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.child:
+        args.pdf_path = args.child
+        run_child(args)
+        return
+    
+    pdf_path = args.pdf or synthetic_pdf_path(args.pages)
+    configurations = [('limited', args.max_rss_mb, args.recycle_pages)]
+    if not args.limited_only:
+        configurations.insert(0, ('no limits', 0, 0))
+    
+    print(f"{pdf_path}: strategy={args.strategy} workers={args.workers}")
+    print(f"{'run':>10} {'pages':>6} {'wall (s)':>9} {'pages/s':>8} {'peak MB':>8} {'worker MB':>10}  result")
+    for name, max_rss_mb, recycle_pages in configurations:
+        result = run_configuration(args, pdf_path, max_rss_mb, recycle_pages)
+        if 'pages' not in result:
+            print(f"{name:>10}  FAILED {result['error']}")
+            continue
+        
+        wall = result['wall_clock']
+        print(
+            f"{name:>10} {result['pages']:>6} {wall:>9.1f} {result['pages'] / wall if wall else 0:>8.1f} "
+            f"{result['peak_rss_mb']:>8.0f} {result['peak_worker_rss_mb']:>10.0f}  "
+            f"{result['error'] or 'ok'}"
+        )
+        print(f"{'':>10} RSS every {args.trace_every} pages: {result['rss_trace']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Minimal PDF writer for generating large test documents without any
+PDF library. Pages are written one at a time, so a document of any
+length is produced in constant memory. Output depends only on the
+input, so the same pages always give byte-identical files.
+"""
+import random
+from typing import Iterable, Iterator, List, Tuple
+
+WORDS = (
+    "employee handbook policy procedure safety training manager leave benefits "
+    "schedule overtime payroll equipment report incident customer quality review "
+    "department approval request record emergency contact access security "
+    "confidential information vacation holiday conduct performance compliance"
+).split()
+
+CJK_WORDS = (
+    "员工 手册 政策 程序 安全 培训 经理 休假 福利 日程 加班 工资 设备 报告 事故 "
+    "客户 质量 审核 部门 批准 申请 记录 紧急 联系 访问 保密 信息 假期 行为 绩效 合规"
+).split()
+
+FONT_SIZE = 10
+LINE_HEIGHT = 14
+PAGE_WIDTH = 612
+PAGE_HEIGHT = 792
+MARGIN = 56
+
+
+def _escape(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def iter_synthetic_pages(
+    num_pages: int,
+    lines_per_page: int = 45,
+    seed: int = 0,
+    words_per_line: Tuple[int, int] = (8, 12)
+) -> Iterator[List[str]]:
+    """Pages of pseudo-random handbook prose, reproducible for a given seed."""
+    rng = random.Random(seed)
+    for page_no in range(1, num_pages + 1):
+        lines = [f"Section {page_no}"]
+        for _ in range(lines_per_page - 1):
+            lines.append(' '.join(rng.choice(WORDS) for _ in range(rng.randint(*words_per_line))))
+        yield lines
+
+
+def iter_cjk_pages(num_pages: int, lines_per_page: int = 45, seed: int = 0) -> Iterator[List[str]]:
+    """Pages of pseudo-random Chinese handbook prose, for write_pdf(cjk=True)."""
+    rng = random.Random(seed)
+    for page_no in range(1, num_pages + 1):
+        lines = [f"第{page_no}节"]
+        for _ in range(lines_per_page - 1):
+            lines.append(''.join(rng.choice(CJK_WORDS) for _ in range(rng.randint(10, 14))) + "。")
+        yield lines
+
+
+def _show_text(line: str, cjk: bool) -> str:
+    if cjk:
+        # Two-byte big-endian code units, as the UniGB-UCS2-H CMap expects
+        return f"<{line.encode('utf-16-be').hex()}> Tj"
+    return f"({_escape(line)}) Tj"
+
+
+def write_pdf(path: str, pages: Iterable[List[str]], columns: int = 1, cjk: bool = False) -> int:
+    """
+    Write pages of text lines as a PDF. Latin text (ASCII) uses the built-in
+    Helvetica font; with cjk=True the lines may hold any BMP characters and
+    use the standard STSong-Light CID font, which viewers and extractors
+    map back to Unicode without an embedded font. With columns > 1 the
+    lines of each page are laid out top to bottom in that many columns.
+    Returns the number of pages written.
+    """
+    offsets = {}
+    page_ids = []
+    column_width = (PAGE_WIDTH - 2 * MARGIN) / columns
+    
+    with open(path, 'wb') as f:
+        def write_object(obj_id: int, body: bytes):
+            offsets[obj_id] = f.tell()
+            f.write(f"{obj_id} 0 obj\n".encode() + body + b"\nendobj\n")
+        
+        f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        # 1: catalog, 2: page tree, 3: font; the page tree is written last
+        # once every page object id is known
+        write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        if cjk:
+            # 3: composite font, 4: its descendant CID font
+            write_object(3, (
+                b"<< /Type /Font /Subtype /Type0 /BaseFont /STSong-Light /Encoding /UniGB-UCS2-H "
+                b"/DescendantFonts [4 0 R] >>"
+            ))
+            write_object(4, (
+                b"<< /Type /Font /Subtype /CIDFontType0 /BaseFont /STSong-Light "
+                b"/CIDSystemInfo << /Registry (Adobe) /Ordering (GB1) /Supplement 2 >> "
+                b"/FontDescriptor 5 0 R /DW 1000 >>"
+            ))
+            write_object(5, (
+                b"<< /Type /FontDescriptor /FontName /STSong-Light /Flags 6 "
+                b"/FontBBox [-25 -254 1000 880] /ItalicAngle 0 /Ascent 880 /Descent -120 "
+                b"/CapHeight 880 /StemV 93 >>"
+            ))
+            next_id = 6
+        else:
+            write_object(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+            next_id = 4
+        
+        for lines in pages:
+            per_column = -(-len(lines) // columns) if lines else 0
+            ops = []
+            for column in range(columns):
+                column_lines = lines[column * per_column:(column + 1) * per_column]
+                if not column_lines:
+                    break
+                x = MARGIN + column * column_width
+                ops.append(f"BT /F1 {FONT_SIZE} Tf {LINE_HEIGHT} TL {x:g} {PAGE_HEIGHT - MARGIN} Td")
+                for line in column_lines:
+                    ops.append(f"{_show_text(line, cjk)} T*")
+                ops.append("ET")
+            stream = '\n'.join(ops).encode('latin-1')
+            
+            content_id, page_id = next_id, next_id + 1
+            next_id += 2
+            write_object(content_id, f"<< /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream")
+            write_object(page_id, (
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+                f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+            ).encode())
+            page_ids.append(page_id)
+        
+        kids = ' '.join(f"{page_id} 0 R" for page_id in page_ids)
+        write_object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode())
+        
+        xref_offset = f.tell()
+        f.write(f"xref\n0 {next_id}\n0000000000 65535 f \n".encode())
+        for obj_id in range(1, next_id):
+            f.write(f"{offsets[obj_id]:010d} 00000 n \n".encode())
+        f.write(f"trailer\n<< /Size {next_id} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+    
+    return len(page_ids)
@@ -0,0 +1,113 @@
+"""
+Checks of the ingestion and retrieval paths on synthetic_pdf.py output.
+
+Run with:
+    python -m pytest -q test_ingestion.py
+"""
+import numpy as np
+import pytest
+from config import Config
+from pdf_processor import PDFProcessor, shutdown_extraction_pool
+from rag_manager import RAGManager
+from synthetic_pdf import iter_synthetic_pages, write_pdf
+from vector_index import VectorIndex
+
+QUERIES = ["revised overtime approval", "emergency contact security", "vacation holiday leave", "Section 7"]
+
+
+@pytest.fixture(autouse=True)
+def cache_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'CACHE_FOLDER', str(tmp_path / 'cache'))
+
+
+@pytest.fixture(scope='module', autouse=True)
+def extraction_pool():
+    yield
+    shutdown_extraction_pool()
+
+
+def _write_handbook(path, num_pages=12, seed=1, revised_page=None):
+    """A synthetic handbook; a revised page has one line reworded, with as many words."""
+    pages = [list(lines) for lines in iter_synthetic_pages(num_pages, lines_per_page=20, seed=seed)]
+    if revised_page is not None:
+        pages[revised_page][3] = ' '.join('revised' for _ in pages[revised_page][3].split())
+    write_pdf(str(path), pages)
+    return str(path)
+
+
+def _add_pdf(rag, processor, pdf_path, filename):
+    info = {}
+    rag.add_document(chunks=processor.iter_chunks(pdf_path, info), metadata={'filename': filename}, document_info=info)
+
+
+def _results(rag):
+    return [[(chunk['text'], chunk['metadata']) for chunk in rag.search(query, top_k=5)] for query in QUERIES]
+
+
+def test_inline_pool_and_watched_extraction_agree(tmp_path):
+    pdf_path = _write_handbook(tmp_path / 'handbook.pdf')
+    
+    inline = list(PDFProcessor(use_cache=False, workers=1, page_timeout=0).iter_pages(pdf_path))
+    pooled = list(PDFProcessor(use_cache=False, workers=2, page_timeout=0).iter_pages(pdf_path))
+    watched = list(PDFProcessor(use_cache=False, workers=2, page_timeout=30).iter_pages(pdf_path))
+    
+    assert len(inline) == 12
+    assert pooled == inline
+    assert watched == inline
+
+
+def test_store_reload_gives_same_results(tmp_path):
+    processor = PDFProcessor(use_cache=False, workers=1, page_timeout=0)
+    rag = RAGManager(str(tmp_path / 'rag'), retrieval_mode='bm25')
+    _add_pdf(rag, processor, _write_handbook(tmp_path / 'a.pdf', seed=1), 'a.pdf')
+    _add_pdf(rag, processor, _write_handbook(tmp_path / 'b.pdf', seed=2), 'b.pdf')
+    before = _results(rag)
+    
+    reloaded = RAGManager(str(tmp_path / 'rag'), retrieval_mode='bm25')
+    
+    assert reloaded.get_document_count() == rag.get_document_count()
+    assert _results(reloaded) == before
+
+
+def test_revision_replace_matches_fresh_ingest(tmp_path):
+    processor = PDFProcessor(use_cache=False, workers=1, page_timeout=0)
+    v1 = _write_handbook(tmp_path / 'v1.pdf', num_pages=24)
+    v2 = _write_handbook(tmp_path / 'v2.pdf', num_pages=24, revised_page=5)
+    
+    rag = RAGManager(str(tmp_path / 'replaced'), retrieval_mode='bm25')
+    _add_pdf(rag, processor, v1, 'handbook.pdf')
+    doc_id = rag.find_document('handbook.pdf')
+    info = {}
+    pages = list(processor.iter_revised_pages(v2, rag.document_pages(doc_id), info))
+    report = rag.replace_document(
+        doc_id, pages, info['page_hashes'], {'filename': 'handbook.pdf'},
+        chunk_size=processor.chunk_size, chunk_overlap=processor.chunk_overlap,
+        boilerplate_lines=info.get('boilerplate_lines')
+    )
+    
+    fresh = RAGManager(str(tmp_path / 'fresh'), retrieval_mode='bm25')
+    _add_pdf(fresh, processor, v2, 'handbook.pdf')
+    
+    assert info['changed_pages'] == [6]
+    assert report['chunks_kept'] > 0
+    assert pages == list(processor.iter_pages(v2))
+    assert _results(rag) == _results(fresh)
+    assert _results(RAGManager(str(tmp_path / 'replaced'), retrieval_mode='bm25')) == _results(fresh)
+
+
+@pytest.mark.parametrize('quantization', ['none', 'int8', 'pq'])
+def test_quantized_ranking_matches_exact(tmp_path, quantization):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((300, 32), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = vectors[:5] + 0.3 * rng.standard_normal((5, 32), dtype=np.float32)
+    
+    # Reranking every chunk on its float row makes the quantized ranking exact
+    index = VectorIndex(str(tmp_path / 'vectors.npy'), 32, quantization=quantization, rerank=len(vectors))
+    index.open(0)
+    index.append(vectors)
+    
+    for query, ranked in zip(queries, index.rank_many(queries)):
+        exact = np.argsort(-(vectors @ query), kind='stable')[:10]
+        assert [next(ranked) for _ in range(10)] == exact.tolist()
+        assert list(index.rank(query))[:10] == exact.tolist()
@@ -0,0 +1,30 @@
+import re
+from typing import Iterator, Tuple
+
+# Scripts written without spaces between words: CJK ideographs, kana and
+# CJK/full-width punctuation. Each character counts as one word, the way
+# count_words in LongWriter's evaluation/pred.py counts Chinese text.
+CJK_CHARACTERS = (
+    '\u3000-\u303f'  # CJK symbols and punctuation
+    '\u3040-\u30ff'  # Hiragana, Katakana
+    '\u3400-\u4dbf'  # CJK Unified Ideographs Extension A
+    '\u4e00-\u9fff'  # CJK Unified Ideographs
+    '\uf900-\ufaff'  # CJK Compatibility Ideographs
+    '\uff00-\uffef'  # Half-width and full-width forms
+)
+
+SEGMENT_PATTERN = re.compile(f'[{CJK_CHARACTERS}]|[^\\s{CJK_CHARACTERS}]+')
+
+
+def iter_segment_spans(text: str) -> Iterator[Tuple[int, int]]:
+    """
+    Character spans of the words in text: whitespace-separated runs for
+    alphabetic scripts, single characters for CJK.
+    """
+    for match in SEGMENT_PATTERN.finditer(text):
+        yield match.span()
+
+
+def count_words(text: str) -> int:
+    """Word count that stays meaningful for Chinese and Japanese text."""
+    return sum(1 for _ in SEGMENT_PATTERN.finditer(text))
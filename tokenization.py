@@ -0,0 +1,87 @@
+import tiktoken
+from typing import Iterable, Iterator, List, Tuple
+from config import Config
+
+FALLBACK_ENCODING = 'cl100k_base'
+
+_encodings = {}
+
+
+def get_encoding(model: str = None) -> tiktoken.Encoding:
+    """tiktoken encoding for a model, loaded once per process."""
+    model = model or Config.OPENAI_MODEL
+    
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding(FALLBACK_ENCODING)
+    
+    return _encodings[model]
+
+
+def count_tokens(text: str, model: str = None) -> int:
+    return len(get_encoding(model).encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = None) -> str:
+    """Cut text to at most max_tokens tokens."""
+    encoding = get_encoding(model)
+    tokens = encoding.encode(text, disallowed_special=())
+    
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+def iter_token_spans(
+    pages: Iterable[str],
+    batch_size: int = None,
+    model: str = None
+) -> Iterator[Tuple[str, List[Tuple[int, int]]]]:
+    """
+    Tokenize a stream of pages in batches and yield each page with the
+    (start, end) character span of every token in it. Pages after the first
+    non-empty one are encoded with the single joining space in front, so the
+    spans match the tokenization of the pages joined by spaces.
+    """
+    encoding = get_encoding(model)
+    batch_size = batch_size or Config.TOKENIZER_BATCH_SIZE
+    batch = []
+    state = {'seen_text': False}
+    
+    def encode_batch(batch):
+        prefixed = []
+        for page_text in batch:
+            prefixed.append(bool(page_text) and state['seen_text'])
+            state['seen_text'] = state['seen_text'] or bool(page_text)
+        
+        texts = [' ' + page_text if prefix else page_text for page_text, prefix in zip(batch, prefixed)]
+        for page_text, prefix, tokens in zip(batch, prefixed, encoding.encode_batch(texts, disallowed_special=())):
+            yield page_text, _token_spans(encoding, tokens, 1 if prefix else 0)
+    
+    for page_text in pages:
+        batch.append(page_text)
+        if len(batch) == batch_size:
+            yield from encode_batch(batch)
+            batch = []
+    
+    if batch:
+        yield from encode_batch(batch)
+
+
+def _token_spans(encoding: tiktoken.Encoding, tokens: List[int], shift: int) -> List[Tuple[int, int]]:
+    """
+    Character spans of tokens in the decoded text, shifted left by `shift`
+    characters and with leading whitespace trimmed off each span.
+    """
+    text, offsets = encoding.decode_with_offsets(tokens)
+    spans = []
+    
+    for i, start in enumerate(offsets):
+        end = offsets[i + 1] if i + 1 < len(offsets) else len(text)
+        while start < end and text[start].isspace():
+            start += 1
+        spans.append((max(start - shift, 0), max(end - shift, 0)))
+    
+    return spans
@@ -0,0 +1,163 @@
+import os
+from itertools import islice
+from typing import Iterator, List, Optional
+import numpy as np
+from config import Config
+from quantization import ProductQuantizer, ScalarQuantizer
+from ranking import iter_ranked
+from row_file import RowFile
+
+# How chunks can be scored (see Config.VECTOR_QUANTIZATION)
+QUANTIZATIONS = ('none', 'int8', 'pq')
+
+
+class VectorIndex:
+    """
+    Chunk embeddings as one contiguous float32 matrix, row i for chunk i,
+    in a .npy file that is memory-mapped rather than read (see RowFile).
+    Rows are unit length, so a query is scored against every chunk with a
+    single matrix-vector product.
+    
+    With quantization, queries are scored on int8 or product-quantized
+    codes instead (see quantization.py), which take a quarter or less of
+    the memory, and the best `rerank` candidates are scored again on
+    their float rows. The codes are derived from the float rows and kept
+    in step with them.
+    """
+    
+    def __init__(self, path: str, dimensions: int, quantization: str = None, rerank: int = None):
+        self.path = path
+        self.dimensions = dimensions
+        self.file = RowFile(path, np.float32, (dimensions,))
+        self.quantization = quantization or Config.VECTOR_QUANTIZATION
+        self.rerank = Config.QUANTIZED_RERANK if rerank is None else rerank
+        if self.quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown vector quantization: {self.quantization}")
+        
+        self.quantizer = self._quantizer(self.quantization)
+    
+    def __len__(self) -> int:
+        return len(self.file)
+    
+    @property
+    def matrix(self) -> np.ndarray:
+        """The valid float rows."""
+        return self.file.rows
+    
+    @property
+    def bytes_per_vector(self) -> int:
+        """Bytes a full scan reads per chunk."""
+        return self.quantizer.bytes_per_vector if self.quantizer else self.file.dtype.itemsize * self.dimensions
+    
+    def open(self, count: int):
+        """
+        Map the file, of which the first `count` rows are valid. Codes that
+        are missing or unreadable are encoded again from the float rows.
+        """
+        self.file.open(count)
+        # Codes of another quantization would fall behind the vectors
+        for quantization in QUANTIZATIONS:
+            if quantization != self.quantization and quantization != 'none':
+                self._quantizer(quantization).clear()
+        if self.quantizer is None:
+            return
+        if not count:
+            self.quantizer.clear()
+            return
+        
+        try:
+            self.quantizer.open(count)
+        except Exception as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"Error opening quantized vectors, encoding them again: {e}")
+            self.quantizer.clear()
+        self.quantizer.update(self.matrix, count)
+    
+    def append(self, vectors: np.ndarray):
+        """Add the vectors of the next chunks."""
+        self.file.append(vectors)
+        if self.quantizer is not None:
+            self.quantizer.update(self.matrix, len(self))
+    
+    def flush(self):
+        self.file.flush()
+        if self.quantizer is not None:
+            self.quantizer.flush()
+    
+    def rank(
+        self,
+        query_vector: np.ndarray,
+        removed: Optional[np.ndarray] = None,
+        rows: Optional[np.ndarray] = None
+    ) -> Iterator[int]:
+        """
+        Chunks by descending similarity to the query vector, leaving out
+        those flagged in `removed` (a boolean array over chunks). With
+        `rows` (ascending), only those chunks are ranked.
+        """
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        if rows is None:
+            # A full scan scores every row in place, then drops removed ones
+            candidates = np.arange(len(self))
+            scores = self._scores(query_vector, None)
+        else:
+            candidates = rows
+        if removed is not None and removed[candidates].any():
+            keep = ~removed[candidates]
+            candidates = candidates[keep]
+            if rows is None:
+                scores = scores[keep]
+        if rows is not None:
+            scores = self._scores(query_vector, candidates)
+        
+        if self.quantizer is None:
+            return (int(candidates[i]) for i in iter_ranked(scores, np.arange(len(candidates))))
+        return self._reranked(query_vector, candidates, scores)
+    
+    def rank_many(self, query_vectors: np.ndarray, removed: Optional[np.ndarray] = None) -> List[Iterator[int]]:
+        """
+        Rankings of several queries over all chunks, as from rank(), scored
+        with a single matrix product (on the codes, if quantized).
+        """
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        candidates = np.arange(len(self))
+        if removed is not None and removed[candidates].any():
+            candidates = candidates[~removed[candidates]]
+        if self.quantizer is None:
+            scores = query_vectors @ self.matrix.T
+            return [iter_ranked(row, candidates) for row in scores]
+        
+        scores = self.quantizer.scores_many(query_vectors)
+        return [
+            self._reranked(query_vector, candidates, row if len(candidates) == len(row) else row[candidates])
+            for query_vector, row in zip(query_vectors, scores)
+        ]
+    
+    def _quantizer(self, quantization: str):
+        base = os.path.splitext(self.path)[0]
+        if quantization == 'int8':
+            return ScalarQuantizer(base + '.int8.npy', self.dimensions)
+        if quantization == 'pq':
+            return ProductQuantizer(base + '.pq.npz', self.dimensions)
+        return None
+    
+    def _scores(self, query_vector: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        if self.quantizer is not None:
+            return self.quantizer.scores(query_vector, rows)
+        return (self.matrix if rows is None else self.matrix[rows]) @ query_vector
+    
+    def _reranked(self, query_vector: np.ndarray, candidates: np.ndarray, scores: np.ndarray) -> Iterator[int]:
+        """Candidates in order of their approximate scores, the first `rerank` reordered by float rows."""
+        ranked = iter_ranked(scores, np.arange(len(candidates)))
+        head = np.sort(np.fromiter(islice(ranked, self.rerank), dtype=np.int64))
+        if len(head):
+            exact = self.matrix[candidates[head]] @ query_vector
+            for i in iter_ranked(exact, np.arange(len(head))):
+                yield int(candidates[head[i]])
+        for i in ranked:
+            yield int(candidates[i])
+    
+    def clear(self):
+        self.file.clear()
+        if self.quantizer is not None:
+            self.quantizer.clear()